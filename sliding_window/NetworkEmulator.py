@@ -0,0 +1,282 @@
+# A UDP relay that emulates a lossy, slow link between any sender and receiver, in place of
+# shaping the loopback device with "tc qdisc ... netem". It needs no privileges and only
+# affects the transfers sent through it, so several benchmarks can run side by side.
+#
+# The sender sends to the relay, which forwards to the receiver from a socket of its own per
+# sender, so the receiver's answers find their way back. Both directions go through a Link,
+# which decides with a seeded random number generator what is lost, duplicated or reordered,
+# so a run with the same seed sees the same decisions for the same packets.
+
+import argparse
+import collections
+import heapq
+import random
+import select
+import socket
+import threading
+import time
+from tracing import trace, RELAY_FORWARD, RELAY_REVERSE
+
+# Bits per second for the suffixes tc understands
+RATE_UNITS = {"bit": 1, "kbit": 10**3, "mbit": 10**6, "gbit": 10**9}
+# Datagrams are at most this large
+MAX_DATAGRAM_SIZE = 65536
+# How long the relay blocks at most, so that it notices close()
+POLL_INTERVAL_S = 0.1
+
+
+def parse_rate(rate: str) -> float:
+    """Returns the bits per second of a rate like "10mbit", a plain number is bits per second"""
+    rate = rate.strip().lower()
+    for unit in sorted(RATE_UNITS, key=len, reverse=True):
+        if rate.endswith(unit):
+            return float(rate[: -len(unit)]) * RATE_UNITS[unit]
+    return float(rate)
+
+
+class Link:
+    """
+    One direction of the emulated link. Packets are first put on the wire at the given rate,
+    queueing behind the packets before them, and then take delay plus or minus jitter to
+    arrive, like netem does it.
+    """
+
+    def __init__(
+        self,
+        loss: float = 0.0,
+        delay_s: float = 0.0,
+        jitter_s: float = 0.0,
+        reorder: float = 0.0,
+        duplicate: float = 0.0,
+        rate_bps: float = None,
+        queue_limit: int = 1000,
+        seed: int = 0,
+    ):
+        """
+        Params:
+            loss: Probability that a packet is dropped
+            delay_s, jitter_s: Every packet is delayed by a uniformly random time between
+                delay_s - jitter_s and delay_s + jitter_s
+            reorder: Probability that a packet skips the delay and so overtakes the packets
+                before it, only does something with a delay
+            duplicate: Probability that a packet is delivered twice
+            rate_bps: Bits per second the link carries, None for no limit
+            queue_limit: Packets waiting to be put on the wire, more are dropped
+            seed: Seeds the random number generator of this direction
+        """
+        self.loss = loss
+        self.delay_s = delay_s
+        self.jitter_s = jitter_s
+        self.reorder = reorder
+        self.duplicate = duplicate
+        self.rate_bps = rate_bps
+        self.queue_limit = queue_limit
+        self.random = random.Random(seed)
+        # When the packets in the queue are on the wire, in order
+        self.queue = collections.deque()
+        self.packets = 0
+        self.dropped = 0
+        self.duplicated = 0
+        self.reordered = 0
+
+    def arrivals(self, size: int, now: float) -> list:
+        """Returns when a packet of size bytes sent now arrives, one time per copy"""
+        self.packets += 1
+        # Always draw the same numbers per packet, so one decision does not shift the others
+        lost, duplicated, reordered, jitter = (self.random.random() for _ in range(4))
+        if lost < self.loss:
+            self.dropped += 1
+            return []
+
+        departure = now
+        if self.rate_bps is not None:
+            while self.queue and self.queue[0] <= now:
+                self.queue.popleft()
+            if len(self.queue) >= self.queue_limit:
+                # Tail drop, like a full router queue
+                self.dropped += 1
+                return []
+            departure = max(now, self.queue[-1] if self.queue else now)
+            departure += size * 8 / self.rate_bps
+            self.queue.append(departure)
+
+        delay_s = self.delay_s + (2 * jitter - 1) * self.jitter_s
+        if reordered < self.reorder:
+            self.reordered += 1
+            delay_s = 0.0
+        arrival = departure + max(0.0, delay_s)
+        if duplicated < self.duplicate:
+            self.duplicated += 1
+            return [arrival, arrival]
+        return [arrival]
+
+
+class NetworkEmulator:
+    """Relays datagrams between the senders on a local port and one receiver"""
+
+    def __init__(
+        self,
+        listen_port: int,
+        target_host: str,
+        target_port: int,
+        forward: Link = None,
+        reverse: Link = None,
+    ):
+        """
+        Params:
+            listen_port: Where the senders send to, 0 picks a free port, see port
+            target_host, target_port: The receiver
+            forward: The link from the senders to the receiver, defaults to a perfect one
+            reverse: The link the receiver's answers take back
+        """
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(("127.0.0.1", listen_port))
+        self.port = self.sock.getsockname()[1]
+        self.target = (target_host, target_port)
+        self.forward = forward or Link()
+        self.reverse = reverse or Link()
+        # The socket that talks to the receiver for each sender, and the other way round
+        self.upstream = {}
+        self.senders = {}
+        # Min-heap of (arrival, count, socket, data, addr) of the packets in flight
+        self.in_flight = []
+        self.count = 0
+        self.closed = False
+        self.thread = None
+
+    def upstream_socket(self, addr) -> socket.socket:
+        """Returns the socket that forwards the packets of the sender at addr"""
+        sock = self.upstream.get(addr)
+        if sock is None:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.connect(self.target)
+            self.upstream[addr] = sock
+            self.senders[sock] = addr
+        return sock
+
+    def relay(self, data: bytes, link: Link, sock: socket.socket, addr):
+        """Put a packet on the link, it is sent on sock to addr once it arrives"""
+        for arrival in link.arrivals(len(data), time.monotonic()):
+            self.count += 1
+            heapq.heappush(self.in_flight, (arrival, self.count, sock, data, addr))
+
+    def deliver(self):
+        """Send the packets that have arrived"""
+        now = time.monotonic()
+        while self.in_flight and self.in_flight[0][0] <= now:
+            _, _, sock, data, addr = heapq.heappop(self.in_flight)
+            try:
+                if addr is None:
+                    sock.send(data)
+                else:
+                    sock.sendto(data, addr)
+            except OSError:
+                # Nobody is listening (yet), the packet is lost like on a real link
+                pass
+
+    def run(self):
+        """Relay until close() is called"""
+        while not self.closed:
+            timeout = POLL_INTERVAL_S
+            if self.in_flight:
+                timeout = min(
+                    timeout, max(0.0, self.in_flight[0][0] - time.monotonic())
+                )
+            readable, _, _ = select.select([self.sock, *self.senders], [], [], timeout)
+            for sock in readable:
+                try:
+                    data, addr = sock.recvfrom(MAX_DATAGRAM_SIZE)
+                except OSError:
+                    # ICMP port unreachable of an earlier packet
+                    continue
+                if sock is self.sock:
+                    trace(RELAY_FORWARD, len(data))
+                    self.relay(data, self.forward, self.upstream_socket(addr), None)
+                else:
+                    trace(RELAY_REVERSE, len(data))
+                    self.relay(data, self.reverse, self.sock, self.senders[sock])
+            self.deliver()
+        for sock in [self.sock, *self.senders]:
+            sock.close()
+
+    def start(self):
+        """Relay in a background thread"""
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def close(self):
+        """Stop relaying, packets still in flight are lost"""
+        self.closed = True
+        if self.thread is not None:
+            self.thread.join()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("listen_port", type=int)
+    parser.add_argument("target_host")
+    parser.add_argument("target_port", type=int)
+    parser.add_argument(
+        "--loss", type=float, default=0.0, help="Percentage of packets dropped"
+    )
+    parser.add_argument(
+        "--delay", type=float, default=0.0, help="One way delay in milliseconds"
+    )
+    parser.add_argument(
+        "--jitter",
+        type=float,
+        default=0.0,
+        help="The delay varies uniformly by up to this many milliseconds",
+    )
+    parser.add_argument(
+        "--reorder",
+        type=float,
+        default=0.0,
+        help="Percentage of packets sent without delay, overtaking the others",
+    )
+    parser.add_argument(
+        "--duplicate",
+        type=float,
+        default=0.0,
+        help="Percentage of packets delivered twice",
+    )
+    parser.add_argument("--rate", type=parse_rate, help="Link rate like 10mbit")
+    parser.add_argument(
+        "--limit",
+        type=int,
+        default=1000,
+        help="Packets queued for the link rate before they are dropped",
+    )
+    parser.add_argument(
+        "--one-way",
+        action="store_true",
+        help="Only emulate the link towards the receiver, answers are relayed as they are",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    def link(seed: int) -> Link:
+        return Link(
+            args.loss / 100,
+            args.delay / 1000,
+            args.jitter / 1000,
+            args.reorder / 100,
+            args.duplicate / 100,
+            args.rate,
+            args.limit,
+            seed,
+        )
+
+    # Like netem on the loopback device, both directions see the same conditions, but
+    # independent decisions
+    emulator = NetworkEmulator(
+        args.listen_port,
+        args.target_host,
+        args.target_port,
+        link(2 * args.seed),
+        Link() if args.one_way else link(2 * args.seed + 1),
+    )
+    try:
+        emulator.run()
+    except KeyboardInterrupt:
+        pass
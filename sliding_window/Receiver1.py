@@ -4,19 +4,21 @@ import sys
 import socket
 import struct
 from typing import IO
-from utils import PACKET_SIZE, HEADER_SIZE, HEADER_FORMAT
+from utils import PACKET_SIZE, HEADER_SIZE, HEADER_FORMAT, EOF_FLAG
 
 
 def receive_packets(port: int, file: IO):
     with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
         sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         sock.bind(("0.0.0.0", port))
+        # Reuse one buffer for all packets and only hand out views into it
+        buffer = bytearray(PACKET_SIZE + HEADER_SIZE)
+        view = memoryview(buffer)
         while True:
-            packet = sock.recv(PACKET_SIZE + HEADER_SIZE)
-            _, eof_flag = struct.unpack(HEADER_FORMAT, packet[:HEADER_SIZE])
-            data = packet[HEADER_SIZE:]
-            file.write(data)
-            if eof_flag:
+            size = sock.recv_into(buffer)
+            _, flags = struct.unpack_from(HEADER_FORMAT, buffer)
+            file.write(view[HEADER_SIZE:size])
+            if flags & EOF_FLAG:
                 break
 
 
@@ -4,7 +4,14 @@ import sys
 import socket
 import struct
 from typing import IO
-from utils import PACKET_SIZE, HEADER_SIZE, log, SequenceNumber, HEADER_FORMAT
+from utils import (
+    PACKET_SIZE,
+    HEADER_SIZE,
+    SequenceNumber,
+    HEADER_FORMAT,
+    EOF_FLAG,
+)
+from tracing import trace, RECEIVE, EOF
 
 
 def receive_packets(port: int, file: IO):
@@ -13,20 +20,25 @@ def receive_packets(port: int, file: IO):
         sock.bind(("0.0.0.0", port))
         # Usually it should be limited to 2
         exp_seq_num = SequenceNumber()
+        # Reuse one buffer for all packets and only hand out views into it
+        buffer = bytearray(PACKET_SIZE + HEADER_SIZE)
+        view = memoryview(buffer)
         while True:
-            packet, address = sock.recvfrom(PACKET_SIZE + HEADER_SIZE)
-            seq_num, eof_flag = struct.unpack(HEADER_FORMAT, packet[:HEADER_SIZE])
+            size, address = sock.recvfrom_into(buffer)
+            seq_num, flags = struct.unpack_from(HEADER_FORMAT, buffer)
 
             ack_packet = struct.pack("!H", seq_num)
             sock.sendto(ack_packet, address)
 
             if seq_num != exp_seq_num():
-                log(f"Wrong sequence number: {seq_num}")
+                # The sender did not get our last acknowledgment and repeated the packet
+                trace(RECEIVE, exp_seq_num.index - 1, exp_seq_num.index)
                 continue
+            trace(RECEIVE, exp_seq_num.index, exp_seq_num.index)
 
-            data = packet[HEADER_SIZE:]
-            file.write(data)
-            if eof_flag:
+            file.write(view[HEADER_SIZE:size])
+            if flags & EOF_FLAG:
+                trace(EOF, exp_seq_num.index, exp_seq_num.index)
                 break
             exp_seq_num.next()
 
@@ -1,75 +1,232 @@
 # Robin Jehn s2024553
 
-import sys
+import argparse
 import socket
 import struct
-import threading
-from utils import log, PACKET_SIZE, HEADER_SIZE, HEADER_FORMAT
-
-
-LOCK = threading.Lock()
-BASE = 0  # Expected sequence number of the next in-order packet
-S = None
-OUTPUT_FILE = None
-
-
-def send_ack(sock: socket.socket, addr: str):
-    """Send an acknowledgment for a received packet. Acknowledging a sequence number also acknowledges all previous once."""
-    ack_packet = struct.pack("!H", BASE - 1)
-    sock.sendto(ack_packet, addr)
-    log(f"Ack: {BASE - 1}")
-
-
-def receive_packets():
-    """Receives packets and writes them in order to the output file."""
-    global BASE, S, BUFFER, OUTPUT_FILE
-    with LOCK:
-        if S is None:
-            raise ValueError("Socket not initialized")
-        if OUTPUT_FILE is None:
-            raise ValueError("File not open")
-
-    while True:
-        log("in loop")
-        packet, addr = S.recvfrom(PACKET_SIZE + HEADER_SIZE)
-        if not packet:
-            continue
+import sys
+from utils import (
+    HEADER_SIZE,
+    HEADER_FORMAT,
+    EOF_FLAG,
+    FEC_FLAG,
+    COMPRESSED_FLAG,
+    AckPolicy,
+    wire_seq_num,
+    unwrap_seq_num,
+)
+from batch_io import BatchReceiver
+from pmtu import answer_probe
+from fec import FecDecoder
+from resume import Checkpoint, answer_resume
+from compression import DecompressingWriter
+from streaming import CallbackSink
+from tracing import start_tracing, trace, RECEIVE, ACK_SENT, EOF
+
+
+class GoBackNReceiver:
+    """
+    The state of a single Go-Back-N transfer into one output file.
+    Several of them can share a socket, see ReceiverServer.py
+    """
+
+    def __init__(
+        self,
+        sock: socket.socket,
+        output_file,
+        ack_policy: AckPolicy = None,
+        checkpoint: Checkpoint = None,
+        start_offset: int = 0,
+    ):
+        """
+        Params:
+            sock: The socket to send acknowledgments on
+            output_file: The file opened for writing in binary mode
+            ack_policy: When to acknowledge, defaults to every packet
+            checkpoint: Records the progress so that an interrupted transfer can be resumed
+            start_offset: Where in the output file packet 0 goes when resuming, the output
+                file has to be positioned there
+        """
+        self.sock = sock
+        self.output_file = output_file
+        self.ack_policy = ack_policy or AckPolicy()
+        self.checkpoint = checkpoint
+        self.start_offset = start_offset
+        self.base = 0  # Logical index of the next in-order packet
+        # Rebuilds lost packets if the sender sends parity packets
+        self.fec = FecDecoder()
+
+    def send_ack(self, addr):
+        """Send an acknowledgment for a received packet. Acknowledging a sequence number also acknowledges all previous once."""
+        ack_packet = struct.pack("!H", wire_seq_num(self.base - 1))
+        self.sock.sendto(ack_packet, addr)
+        trace(ACK_SENT, self.base - 1, self.base)
+
+    def acknowledge(self, addr):
+        """Acknowledge everything received so far, including any delayed acknowledgment"""
+        self.send_ack(addr)
+        self.ack_policy.sent()
+
+    def send_delayed_ack(self):
+        """Send the pending acknowledgment once its delay has expired"""
+        if self.ack_policy.expired():
+            self.acknowledge(self.ack_policy.addr)
+
+    def handle_packet(self, packet: memoryview, addr) -> bool:
+        """
+        Handles a single received packet. Returns True once the end of the file was written.
+        The packet is only valid until the next packet is received, so it is copied if it needs to be kept.
+        """
+        if (
+            not packet
+            or answer_probe(self.sock, packet, addr)
+            or answer_resume(self.sock, packet, addr, self.start_offset)
+        ):
+            return False
 
         # Extract the sequence number and EOF flag
-        seq_num, eof_flag = struct.unpack(HEADER_FORMAT, packet[:HEADER_SIZE])
+        seq_num, flags = struct.unpack_from(HEADER_FORMAT, packet)
+        if flags & FEC_FLAG:
+            return self.handle_rebuilt(self.fec.add_parity(packet, self.base), addr)
+        eof_flag = flags & EOF_FLAG
         data = packet[HEADER_SIZE:]
-        log(f"eof_flag: {eof_flag}")
-
-        with LOCK:
-            if seq_num < BASE:
-                send_ack(S, addr)
-                log("seq_num < BASE")
-                continue
-
-            log(f"seq_num {seq_num}=={BASE} BASE")
-            if seq_num == BASE:
-                # Write data to the file
-                OUTPUT_FILE.write(data)
-                BASE += 1
-                send_ack(S, addr)
-
-                # If EOF flag is set, stop receiving
-                if eof_flag:
-                    log("End of file reached")
+
+        if flags & COMPRESSED_FLAG:
+            self.decompress()
+
+        index = unwrap_seq_num(seq_num, self.base)
+        trace(RECEIVE, index, self.base)
+        self.fec.add_data(index, packet, self.base)
+        if index < self.base:
+            # Our acknowledgment was probably lost, repeat it right away
+            self.acknowledge(addr)
+            return False
+
+        if index > self.base:
+            # A gap, tell the sender right away where we are
+            self.acknowledge(addr)
+            return False
+
+        # Write data to the file
+        self.output_file.write(data)
+        self.base += 1
+
+        # If EOF flag is set, stop receiving
+        if eof_flag:
+            self.acknowledge(addr)
+            trace(EOF, index, self.base)
+            return True
+        if self.ack_policy.received(addr):
+            self.acknowledge(addr)
+        return False
+
+    def decompress(self):
+        """The sender compressed the file, decompress what we write from now on"""
+        if not isinstance(self.output_file, DecompressingWriter):
+            self.output_file = DecompressingWriter(self.output_file)
+
+    def delivered(self) -> int:
+        """Returns how many bytes at the start of the output file are complete"""
+        return self.output_file.tell()
+
+    def timeout(self):
+        """Returns how long we may block without missing a delayed ACK or a checkpoint"""
+        timeouts = [self.ack_policy.timeout()]
+        if self.checkpoint is not None:
+            timeouts.append(self.checkpoint.timeout())
+        timeouts = [timeout for timeout in timeouts if timeout is not None]
+        return min(timeouts) if timeouts else None
+
+    def handle_rebuilt(self, rebuilt: list, addr) -> bool:
+        """Handle the packets FEC rebuilt, returns True once the end of the file was written"""
+        for _, packet in rebuilt:
+            if self.handle_packet(packet, addr):
+                return True
+        # We dropped the packets after the gap, but FEC kept them
+        while rebuilt and self.base in self.fec.packets:
+            if self.handle_packet(self.fec.packets[self.base], addr):
+                return True
+        return False
+
+
+def receive_packets(receiver: GoBackNReceiver):
+    """Receives packets and writes them in order to the output file."""
+    # Drains many datagrams per syscall where possible
+    batch_receiver = BatchReceiver(receiver.sock)
+    done = False
+    try:
+        while not done:
+            try:
+                # Wake up in time for a delayed acknowledgment or checkpoint
+                packets = batch_receiver.receive(receiver.timeout())
+            except socket.timeout:
+                packets = []
+            for packet, addr in packets:
+                done = receiver.handle_packet(packet, addr)
+                if done:
                     break
+            receiver.send_delayed_ack()
+            if receiver.checkpoint is not None:
+                receiver.checkpoint.update(receiver)
+    finally:
+        if receiver.checkpoint is not None:
+            receiver.checkpoint.close(receiver, done)
 
     # Close everything
-    S.close()
-    OUTPUT_FILE.close()
+    receiver.sock.close()
+    receiver.output_file.close()
 
 
 if __name__ == "__main__":
-    port = int(sys.argv[1])
-    output_filename = sys.argv[2]
-
-    S = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    S.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    S.bind(("0.0.0.0", port))
-    OUTPUT_FILE = open(output_filename, "wb")
-
-    receive_packets()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("port", type=int)
+    parser.add_argument("output_filename")
+    parser.add_argument(
+        "--ack-every",
+        type=int,
+        default=1,
+        help="Acknowledge every N in-order packets",
+    )
+    parser.add_argument(
+        "--ack-delay-ms",
+        type=float,
+        default=0.0,
+        help="Hold back an acknowledgment for at most this long, keep it below the sender timeout",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Keep a checkpoint next to the output file and resume an interrupted transfer from it",
+    )
+    parser.add_argument(
+        "--trace",
+        help="Record packet events and write them here at exit or on SIGUSR1, see tracing.py",
+    )
+    args = parser.parse_args()
+    # "-" writes to standard output, which may be a pipe that cannot seek
+    stream = args.output_filename == "-"
+    if stream and args.resume:
+        parser.error("Writing to standard output does not support --resume")
+    if args.trace:
+        start_tracing(args.trace)
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(("0.0.0.0", args.port))
+    checkpoint = None
+    start_offset = 0
+    if args.resume:
+        checkpoint = Checkpoint(args.output_filename + ".checkpoint")
+        output_file, start_offset = checkpoint.open_output(args.output_filename)
+    elif stream:
+        output_file = CallbackSink(sys.stdout.buffer.write, sys.stdout.buffer.flush)
+    else:
+        output_file = open(args.output_filename, "wb")
+    receiver = GoBackNReceiver(
+        sock,
+        output_file,
+        AckPolicy(args.ack_every, args.ack_delay_ms / 1000),
+        checkpoint,
+        start_offset,
+    )
+
+    receive_packets(receiver)
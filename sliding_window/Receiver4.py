@@ -1,88 +1,407 @@
 # Robin Jehn s2024553
 
-import sys
+import argparse
+import os
 import socket
 import struct
-import threading
-from utils import log, PACKET_SIZE, HEADER_SIZE, HEADER_FORMAT
+import sys
+from utils import (
+    HEADER_SIZE,
+    HEADER_FORMAT,
+    EOF_FLAG,
+    SACK_FLAG,
+    FEC_FLAG,
+    COMPRESSED_FLAG,
+    ACK_FORMAT,
+    SACK_FORMAT,
+    AckPolicy,
+    unwrap_seq_num,
+    wire_seq_num,
+)
+from batch_io import BatchReceiver
+from pmtu import answer_probe
+from fec import FecDecoder
+from resume import Checkpoint, answer_resume
+from compression import DecompressingWriter
+from streaming import CallbackSink
+from tracing import start_tracing, trace, RECEIVE, ACK_SENT, EOF
+
+
+class SelectiveRepeatReceiver:
+    """
+    The state of a single Selective Repeat transfer into one output file.
+    Several of them can share a socket, see ReceiverServer.py
+    """
+
+    def __init__(
+        self,
+        sock: socket.socket,
+        output_file,
+        window_size: int,
+        pwrite: bool = False,
+        stripe: int = 0,
+        stripes: int = 1,
+        ack_policy: AckPolicy = None,
+        packet_size: int = None,
+        checkpoint: Checkpoint = None,
+        start_offset: int = 0,
+    ):
+        """
+        Params:
+            sock: The socket to send acknowledgments on
+            output_file: The file opened for writing in binary mode
+            window_size: The window size of the sender
+            pwrite: Write every packet straight to its offset in the file instead of buffering it
+            stripe, stripes: In a striped transfer this session receives packets
+                stripe, stripe + stripes, ... of the file
+            ack_policy: When to acknowledge, only SACK acknowledgments are cumulative,
+                so only they can be delayed
+            packet_size: The payload size of the sender, only needed to find the offsets in
+                pwrite mode. If None it is taken from the first packet that is not the last one
+            checkpoint: Records the progress so that an interrupted transfer can be resumed,
+                not for striped transfers
+            start_offset: Where in the output file packet 0 goes when resuming, the output
+                file has to be positioned there
+        """
+        self.sock = sock
+        self.output_file = output_file
+        self.window_size = window_size
+        self.pwrite = pwrite
+        self.stripe = stripe
+        self.stripes = stripes
+        self.ack_policy = ack_policy or AckPolicy()
+        self.base = 0  # Logical index of the next in-order packet
+        self.buffer = {}  # Buffer for out-of-order packets by their logical index
+        # Ring bitmap of the packets in the window that were written (pwrite mode)
+        self.received = bytearray(window_size)
+        # Bytes preallocated in the output file (pwrite mode)
+        self.allocated = start_offset
+        # Offset of the end of the file once the EOF packet arrived (pwrite mode)
+        self.file_end = None
+        # Logical index of the EOF packet once it arrived (pwrite mode)
+        self.eof_index = None
+        self.packet_size = packet_size
+        self.checkpoint = checkpoint
+        self.start_offset = start_offset
+        # Rebuilds lost packets if the sender sends parity packets
+        self.fec = FecDecoder()
+
+    def send_ack(self, addr, seq_num: int):
+        """Send an acknowledgment for a single received packet."""
+        ack_packet = struct.pack(ACK_FORMAT, seq_num)
+        self.sock.sendto(ack_packet, addr)
+        trace(ACK_SENT, unwrap_seq_num(seq_num, self.base), self.base)
+
+    def received_out_of_order(self) -> list:
+        """Returns the indices of the packets above base that were already received"""
+        if not self.pwrite:
+            return list(self.buffer)
+        indices = []
+        slot = self.received.find(1)
+        while slot != -1:
+            indices.append(self.base + (slot - self.base) % self.window_size)
+            slot = self.received.find(1, slot + 1)
+        return indices
+
+    def send_sack(self, addr):
+        """
+        Send a cumulative acknowledgment for everything below base together with a bitmap of
+        the packets received above it
+        """
+        bits = 0
+        for index in self.received_out_of_order():
+            bits |= 1 << (index - self.base - 1)
+        # base itself is never received, so the bitmap covers the rest of the window,
+        # as far as the one byte length allows
+        size = min((self.window_size + 6) // 8, 255)
+        bitmap = (bits & ((1 << 8 * size) - 1)).to_bytes(size, "little")
+        header = struct.pack(SACK_FORMAT, wire_seq_num(self.base - 1), len(bitmap))
+        self.sock.sendto(header + bitmap, addr)
+        trace(ACK_SENT, self.base - 1, self.base)
+
+    def acknowledge(self, addr, seq_num: int, flags: int):
+        """Acknowledge a packet in the format the sender asked for"""
+        if flags & SACK_FLAG:
+            self.send_sack(addr)
+            self.ack_policy.sent()
+        else:
+            self.send_ack(addr, seq_num)
+
+    def send_delayed_ack(self):
+        """Send the pending SACK once its delay has expired"""
+        if self.ack_policy.expired():
+            self.send_sack(self.ack_policy.addr)
+            self.ack_policy.sent()
+
+    def handle_packet(self, packet: memoryview, addr) -> bool:
+        """
+        Handles a single received packet. Returns True once the end of the file was written.
+        The packet is only valid until the next packet is received, so it is copied if it needs to be kept.
+        """
+        if (
+            not packet
+            or answer_probe(self.sock, packet, addr)
+            or answer_resume(self.sock, packet, addr, self.start_offset)
+        ):
+            return False
+
+        # Extract the sequence number and flags
+        seq_num, flags = struct.unpack_from(HEADER_FORMAT, packet)
+        if flags & FEC_FLAG:
+            done = False
+            for _, rebuilt in self.fec.add_parity(packet, self.base):
+                done = self.handle_packet(rebuilt, addr) or done
+            return done
+        eof_flag = flags & EOF_FLAG
+        data = packet[HEADER_SIZE:]
+
+        if flags & COMPRESSED_FLAG:
+            self.decompress()
+
+        index = unwrap_seq_num(seq_num, self.base)
+        trace(RECEIVE, index, self.base)
+        self.fec.add_data(index, packet, self.base)
+        if (
+            index < self.base - self.window_size
+            or index >= self.base + self.window_size
+        ):
+            return False
+        if index < self.base:
+            self.acknowledge(addr, seq_num, flags)
+            return False
+
+        base = self.base
+        if self.pwrite:
+            done = self.write_in_place(index, data, eof_flag)
+        else:
+            done = self.write_in_order(index, data, eof_flag)
+        # Acknowledge after writing, so that a SACK includes this packet.
+        # Plain acknowledgments name a single packet and cannot be delayed. Out-of-order
+        # packets, filled gaps and the end of the file are acknowledged right away.
+        if (
+            not flags & SACK_FLAG
+            or done
+            or index != base
+            or self.base != base + 1
+            or self.ack_policy.received(addr)
+        ):
+            self.acknowledge(addr, seq_num, flags)
+        return done
+
+    def write_in_order(self, index: int, data: memoryview, eof_flag: bool) -> bool:
+        """
+        Write the packet if it is the next one in order, otherwise buffer it.
+        Returns True once the EOF packet was written
+        """
+        if index == self.base:
+            # Write data to the file
+            self.output_file.write(data)
+            self.base += 1
+
+            # Deliver any buffered packets in order
+            while self.base in self.buffer:
+                data, eof_flag_tmp = self.buffer.pop(self.base)
+                eof_flag |= eof_flag_tmp
+                self.output_file.write(data)
+                self.base += 1
+
+            # If EOF flag is set, stop receiving
+            if eof_flag:
+                trace(EOF, self.base - 1, self.base)
+                return True
+        else:
+            # Buffer out-of-order packets, this is the only place we copy the data
+            self.buffer[index] = (bytes(data), eof_flag)
+        return False
+
+    def packet_offset(self, index: int) -> int:
+        """Returns the offset in the file of the packet with the given logical index"""
+        return self.start_offset + (index * self.stripes + self.stripe) * (
+            self.packet_size or 0
+        )
+
+    def decompress(self):
+        """
+        The sender compressed the file, decompress what we write from now on.
+        A compressed stream can only be written in order, so this turns pwrite mode off.
+        Every packet of the transfer is flagged, so nothing was written in place yet
+        """
+        if not isinstance(self.output_file, DecompressingWriter):
+            self.output_file = DecompressingWriter(self.output_file)
+            self.pwrite = False
+
+    def delivered(self) -> int:
+        """Returns how many bytes at the start of the output file are complete"""
+        if self.pwrite:
+            return self.packet_offset(self.base)
+        return self.output_file.tell()
+
+    def timeout(self):
+        """Returns how long we may block without missing a delayed ACK or a checkpoint"""
+        timeouts = [self.ack_policy.timeout()]
+        if self.checkpoint is not None:
+            timeouts.append(self.checkpoint.timeout())
+        timeouts = [timeout for timeout in timeouts if timeout is not None]
+        return min(timeouts) if timeouts else None
+
+    def preallocate(self, end: int):
+        """Grow the output file so that it holds at least end bytes"""
+        if end <= self.allocated:
+            return
+        # Allocate a window ahead so that we do not need to do this for every packet
+        size = (
+            max(end, self.packet_offset(self.base + 2 * self.window_size))
+            - self.allocated
+        )
+        try:
+            os.posix_fallocate(self.output_file.fileno(), self.allocated, size)
+        except OSError:
+            # Not supported by the file system, pwrite grows the file instead
+            pass
+        self.allocated += size
+
+    def write_in_place(self, index: int, data: memoryview, eof_flag: bool) -> bool:
+        """
+        Write a packet to its final offset and advance the window over all written packets.
+        Returns True once every packet up to the EOF packet was written
+        """
+        if self.packet_size is None:
+            if not eof_flag:
+                # Every packet but the last one is full
+                self.packet_size = len(data)
+                # Now we know where the EOF packet goes
+                for held_index, (held_data, _) in self.buffer.items():
+                    self.place(held_index, held_data, True)
+                self.buffer.clear()
+            elif index > 0 or self.stripe > 0:
+                # Only the first packet of the file can be placed without knowing the size,
+                # keep the EOF packet until a full packet arrived
+                self.buffer[index] = (bytes(data), eof_flag)
+                return False
+        self.place(index, data, eof_flag)
 
-LOCK = threading.Lock()
-BASE = 0  # Expected sequence number of the next in-order packet
-BUFFER = {}  # Buffer for out-of-order packets
-S = None
-OUTPUT_FILE = None
+        while self.received[self.base % self.window_size]:
+            self.received[self.base % self.window_size] = 0
+            self.base += 1
 
+        # Every packet before the EOF packet has been written once base passes it
+        if self.eof_index is not None and self.base > self.eof_index:
+            # Cut off what we preallocated past the end. The stripes of a striped transfer end
+            # at different offsets, so there the caller truncates once all of them are done
+            if self.stripes == 1:
+                os.ftruncate(self.output_file.fileno(), self.file_end)
+            trace(EOF, self.eof_index, self.base)
+            return True
+        return False
 
-def send_ack(sock: socket.socket, addr: str, seq_num: int):
-    """Send an acknowledgment for a received packet. Acknowledging a sequence number also acknowledges all previous once."""
-    ack_packet = struct.pack("!H", seq_num)
-    sock.sendto(ack_packet, addr)
-    log(f"Ack: {seq_num}")
+    def place(self, index: int, data: memoryview, eof_flag: bool):
+        """Write a packet to its offset in the file unless it was written already"""
+        slot = index % self.window_size
+        if self.received[slot]:
+            return
+        offset = self.packet_offset(index)
+        self.preallocate(offset + len(data))
+        os.pwrite(self.output_file.fileno(), data, offset)
+        self.received[slot] = 1
+        if eof_flag:
+            self.eof_index = index
+            # An empty EOF packet carries no data, e.g. the only packet of an empty stripe
+            self.file_end = offset + len(data) if len(data) > 0 else self.start_offset
 
 
-def receive_packets():
+def receive_packets(receiver: SelectiveRepeatReceiver):
     """Receives packets and writes them in order to the output file."""
-    global BASE, S, BUFFER, OUTPUT_FILE
-    with LOCK:
-        if S is None:
-            raise ValueError("Socket not initialized")
-        if OUTPUT_FILE is None:
-            raise ValueError("File not open")
-
-    while True:
-        with LOCK:
-            log(f"Loop Base={BASE}")
-        packet, addr = S.recvfrom(PACKET_SIZE + HEADER_SIZE)
-        if not packet:
-            continue
-
-        # Extract the sequence number and EOF flag
-        seq_num, eof_flag = struct.unpack(HEADER_FORMAT, packet[:HEADER_SIZE])
-        data = packet[3:]
-        log(f"eof_flag: {eof_flag}")
-
-        with LOCK:
-            if seq_num < BASE - WINDOW_SIZE or seq_num >= BASE + WINDOW_SIZE:
-                continue
-            send_ack(S, addr, seq_num)
-            if seq_num < BASE:
-                log("seq_num < BASE")
-                continue
-
-            log(f"seq_num {seq_num}=={BASE} BASE")
-            if seq_num == BASE:
-                # Write data to the file
-                OUTPUT_FILE.write(data)
-                BASE += 1
-
-                # Deliver any buffered packets in order
-                while BASE in BUFFER:
-                    data, eof_flag_tmp = BUFFER.pop(BASE)
-                    eof_flag |= eof_flag_tmp
-                    OUTPUT_FILE.write(data)
-                    BASE += 1
-
-                # If EOF flag is set, stop receiving
-                if eof_flag:
-                    log("End of file reached")
+    # Drains many datagrams per syscall where possible
+    batch_receiver = BatchReceiver(receiver.sock)
+    done = False
+    try:
+        while not done:
+            try:
+                # Wake up in time for a delayed acknowledgment or checkpoint
+                packets = batch_receiver.receive(receiver.timeout())
+            except socket.timeout:
+                packets = []
+            for packet, addr in packets:
+                done = receiver.handle_packet(packet, addr)
+                if done:
                     break
-            else:
-                # Buffer out-of-order packets
-                BUFFER[seq_num] = (data, eof_flag)
+            receiver.send_delayed_ack()
+            if receiver.checkpoint is not None:
+                receiver.checkpoint.update(receiver)
+    finally:
+        if receiver.checkpoint is not None:
+            receiver.checkpoint.close(receiver, done)
 
     # Close everything
-    S.close()
-    OUTPUT_FILE.close()
+    receiver.sock.close()
+    receiver.output_file.close()
 
 
 if __name__ == "__main__":
-    port = int(sys.argv[1])
-    output_filename = sys.argv[2]
-    WINDOW_SIZE = int(sys.argv[3])
+    parser = argparse.ArgumentParser()
+    parser.add_argument("port", type=int)
+    parser.add_argument("output_filename")
+    parser.add_argument("window_size", type=int)
+    parser.add_argument(
+        "--pwrite",
+        action="store_true",
+        help="Write packets to their offset in the file as soon as they arrive",
+    )
+    parser.add_argument(
+        "--ack-every",
+        type=int,
+        default=1,
+        help="Acknowledge every N in-order packets, only with senders that use --sack",
+    )
+    parser.add_argument(
+        "--ack-delay-ms",
+        type=float,
+        default=0.0,
+        help="Hold back an acknowledgment for at most this long, keep it below the sender timeout",
+    )
+    parser.add_argument(
+        "--packet-size",
+        type=int,
+        help="The payload size the sender uses, only needed with --pwrite and learned if not given",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Keep a checkpoint next to the output file and resume an interrupted transfer from it",
+    )
+    parser.add_argument(
+        "--trace",
+        help="Record packet events and write them here at exit or on SIGUSR1, see tracing.py",
+    )
+    args = parser.parse_args()
+    # "-" writes to standard output, which may be a pipe that cannot seek
+    stream = args.output_filename == "-"
+    if stream and (args.pwrite or args.resume):
+        parser.error("Writing to standard output does not support --pwrite or --resume")
+    if args.trace:
+        start_tracing(args.trace)
 
-    S = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    S.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    S.bind(("0.0.0.0", port))
-    OUTPUT_FILE = open(output_filename, "wb")
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(("0.0.0.0", args.port))
+    checkpoint = None
+    start_offset = 0
+    if args.resume:
+        checkpoint = Checkpoint(args.output_filename + ".checkpoint")
+        output_file, start_offset = checkpoint.open_output(args.output_filename)
+    elif stream:
+        output_file = CallbackSink(sys.stdout.buffer.write, sys.stdout.buffer.flush)
+    else:
+        output_file = open(args.output_filename, "wb")
+    receiver = SelectiveRepeatReceiver(
+        sock,
+        output_file,
+        args.window_size,
+        args.pwrite,
+        ack_policy=AckPolicy(args.ack_every, args.ack_delay_ms / 1000),
+        packet_size=args.packet_size,
+        checkpoint=checkpoint,
+        start_offset=start_offset,
+    )
 
-    receive_packets()
+    receive_packets(receiver)
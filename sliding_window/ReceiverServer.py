@@ -0,0 +1,230 @@
+# A long running receiver for many Go-Back-N or Selective Repeat transfers on one port.
+# Datagrams are demultiplexed by the address of their sender into per-session receivers,
+# so any number of senders can push at once or one after another, and every transfer is
+# written to its own file in the output directory.
+
+import argparse
+import os
+import socket
+import struct
+import time
+from utils import log, AckPolicy, HEADER_FORMAT, HEADER_SIZE, FEC_FLAG
+from batch_io import BatchReceiver
+from Receiver3 import GoBackNReceiver
+from Receiver4 import SelectiveRepeatReceiver
+from pmtu import answer_probe
+from resume import answer_resume
+from tracing import start_tracing
+
+# How often idle and lingering sessions are cleaned up
+EXPIRE_INTERVAL_S = 1.0
+
+
+class ReceiverServer:
+    def __init__(
+        self,
+        sock: socket.socket,
+        output_dir: str,
+        make_session,
+        linger_s: float = 2.0,
+        idle_timeout_s: float = 30.0,
+    ):
+        """
+        Params:
+            sock: The bound socket to serve
+            output_dir: Where to write the received files
+            make_session: Called with the socket and an open output file, returns a new
+                GoBackNReceiver or SelectiveRepeatReceiver
+            linger_s: How long a finished session still acknowledges retransmissions,
+                in case its last acknowledgment was lost
+            idle_timeout_s: Sessions that receive nothing for this long are abandoned
+        """
+        self.sock = sock
+        self.output_dir = output_dir
+        self.make_session = make_session
+        self.linger_s = linger_s
+        self.idle_timeout_s = idle_timeout_s
+        self.batch_receiver = BatchReceiver(sock)
+        # Receivers of the running transfers by the address of their sender
+        self.sessions = {}
+        self.last_seen = {}
+        self.paths = {}
+        # The latest data packet with sequence number 0 of every session. Every transfer
+        # starts with one, so a different one from a finished session's address is a new
+        # transfer rather than a retransmission
+        self.first_packets = {}
+        # (receiver, expiry, first packet) of finished transfers by the address of their sender
+        self.finished = {}
+        # (address, path) of every completed transfer
+        self.completed = []
+        self.session_count = 0
+        self.next_expiry = time.monotonic() + EXPIRE_INTERVAL_S
+
+    def open_session(self, addr):
+        host, port = addr
+        path = os.path.join(self.output_dir, f"{host}_{port}_{self.session_count}")
+        self.session_count += 1
+        receiver = self.make_session(self.sock, open(path, "wb"))
+        self.sessions[addr] = receiver
+        self.paths[addr] = path
+        log(f"New session {addr} writing to {path}")
+        return receiver
+
+    def close_session(self, addr, now: float):
+        receiver = self.sessions.pop(addr)
+        receiver.output_file.close()
+        del self.last_seen[addr]
+        path = self.paths.pop(addr)
+        first_packet = self.first_packets.pop(addr, None)
+        self.finished[addr] = (receiver, now + self.linger_s, first_packet)
+        self.completed.append((addr, path))
+        print(f"{addr[0]}:{addr[1]} {path}")
+
+    def handle_packet(self, packet: memoryview, addr, now: float):
+        # Probes come before a transfer and from a socket of their own, so no session.
+        # Sessions do not outlive their transfer, so there is nothing to resume
+        if answer_probe(self.sock, packet, addr) or answer_resume(
+            self.sock, packet, addr, 0
+        ):
+            return
+        first = False
+        if len(packet) >= HEADER_SIZE:
+            seq_num, flags = struct.unpack_from(HEADER_FORMAT, packet)
+            first = seq_num == 0 and not flags & FEC_FLAG
+        receiver = self.sessions.get(addr)
+        if receiver is None:
+            finished = self.finished.get(addr)
+            if finished is not None:
+                finished_receiver, _, first_packet = finished
+                if not first or packet == first_packet:
+                    # A retransmission after the transfer ended, it only gets acknowledged again
+                    finished_receiver.handle_packet(packet, addr)
+                    return
+                # The sender started another transfer from the same address
+                del self.finished[addr]
+            receiver = self.open_session(addr)
+        if first:
+            # Copied as the receive buffers are reused, only one in SEQ_MODULUS packets
+            self.first_packets[addr] = bytes(packet)
+        self.last_seen[addr] = now
+        if receiver.handle_packet(packet, addr):
+            self.close_session(addr, now)
+
+    def expire(self, now: float):
+        """Forget lingering sessions and abandon idle ones"""
+        for addr, (_, expiry, _) in list(self.finished.items()):
+            if now >= expiry:
+                del self.finished[addr]
+        for addr, last_seen in list(self.last_seen.items()):
+            if now - last_seen >= self.idle_timeout_s:
+                log(f"Session {addr} timed out")
+                self.sessions.pop(addr).output_file.close()
+                del self.last_seen[addr]
+                del self.paths[addr]
+                self.first_packets.pop(addr, None)
+
+    def timeout(self):
+        """Returns how long we may block without missing a delayed ACK or the next cleanup"""
+        if not self.sessions and not self.finished:
+            return None
+        timeout = max(0.0, self.next_expiry - time.monotonic())
+        for receiver in self.sessions.values():
+            ack_timeout = receiver.ack_policy.timeout()
+            if ack_timeout is not None:
+                timeout = min(timeout, ack_timeout)
+        return timeout
+
+    def serve(self, max_transfers: int = None):
+        """
+        Receive transfers until max_transfers of them completed, or forever if it is None
+        """
+        while max_transfers is None or len(self.completed) < max_transfers:
+            try:
+                packets = self.batch_receiver.receive(self.timeout())
+            except socket.timeout:
+                packets = []
+            now = time.monotonic()
+            for packet, addr in packets:
+                self.handle_packet(packet, addr, now)
+            for receiver in self.sessions.values():
+                receiver.send_delayed_ack()
+            if now >= self.next_expiry:
+                self.expire(now)
+                self.next_expiry = now + EXPIRE_INTERVAL_S
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("port", type=int)
+    parser.add_argument("output_dir")
+    parser.add_argument("protocol", choices=["go_back_n", "selective_repeat"])
+    parser.add_argument(
+        "--window-size",
+        type=int,
+        help="The window size of the senders, needed for selective_repeat",
+    )
+    parser.add_argument(
+        "--pwrite",
+        action="store_true",
+        help="Write packets to their offset in the file as soon as they arrive",
+    )
+    parser.add_argument(
+        "--ack-every",
+        type=int,
+        default=1,
+        help="Acknowledge every N in-order packets, with selective_repeat only for senders that use --sack",
+    )
+    parser.add_argument(
+        "--ack-delay-ms",
+        type=float,
+        default=0.0,
+        help="Hold back an acknowledgment for at most this long, keep it below the sender timeout",
+    )
+    parser.add_argument(
+        "--linger-s",
+        type=float,
+        default=2.0,
+        help="How long finished transfers still acknowledge retransmissions",
+    )
+    parser.add_argument(
+        "--idle-timeout-s",
+        type=float,
+        default=30.0,
+        help="Abandon transfers that receive nothing for this long",
+    )
+    parser.add_argument(
+        "--transfers",
+        type=int,
+        help="Exit after this many transfers completed",
+    )
+    parser.add_argument(
+        "--trace",
+        help="Record packet events and write them here at exit or on SIGUSR1, see tracing.py",
+    )
+    args = parser.parse_args()
+    if args.trace:
+        start_tracing(args.trace)
+    if args.protocol == "selective_repeat" and args.window_size is None:
+        parser.error("selective_repeat needs --window-size")
+
+    def make_session(sock: socket.socket, output_file):
+        # Delayed acknowledgments are tracked per session
+        ack_policy = AckPolicy(args.ack_every, args.ack_delay_ms / 1000)
+        if args.protocol == "go_back_n":
+            return GoBackNReceiver(sock, output_file, ack_policy)
+        return SelectiveRepeatReceiver(
+            sock, output_file, args.window_size, args.pwrite, ack_policy=ack_policy
+        )
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(("0.0.0.0", args.port))
+    server = ReceiverServer(
+        sock, args.output_dir, make_session, args.linger_s, args.idle_timeout_s
+    )
+    try:
+        server.serve(args.transfers)
+    except KeyboardInterrupt:
+        pass
+    sock.close()
@@ -18,7 +18,7 @@ class NoRetry:
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.sock.connect((host, port))
 
-    def send(self, data: bytes, eof_flag: bool) -> bool:
+    def send(self, data: memoryview, eof_flag: bool) -> bool:
         """
         Params:
             data: The data to send
@@ -28,10 +28,9 @@ class NoRetry:
         """
         # Create the packet
         header = struct.pack(HEADER_FORMAT, self.seq_num(), eof_flag)
-        packet = header + data
 
-        # Send the packet
-        self.sock.sendall(packet)
+        # Send the packet, header and data are gathered by the kernel
+        self.sock.sendmsg([header, data])
         self.seq_num.next()
         # We need to sleep a bit to avoid the receiver getting overwhelmed
         time.sleep(0.001)
@@ -1,25 +1,35 @@
 # Robin Jehn s2024553
 
-import sys
+import argparse
 import socket
 import struct
 import time
 import os
-from utils import SequenceNumber, log, send_file, HEADER_FORMAT
+from utils import SequenceNumber, send_file, HEADER_FORMAT, timeout_estimator
+from async_engine import StopAndWaitProtocol, send_file_async
+from metrics import TransferMetrics
+from tracing import start_tracing, trace, SEND, ACK, DUP_ACK, TIMEOUT, GIVE_UP
 
 
 class StopAndWait:
-    def __init__(self, host: str, port: int, retry_timeout_ms: int):
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        retry_timeout_ms: int,
+        adaptive_timeout: bool = False,
+    ):
         # Usually it should be limited to 2
         self.seq_num = SequenceNumber()
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self.sock.connect((host, port))
-        self.sock.settimeout(retry_timeout_ms / 1000)
+        self.rto = timeout_estimator(retry_timeout_ms / 1000, adaptive_timeout)
         self.total_retransmissions = 0
         self.packet_retry_limit = 1000
+        self.metrics = TransferMetrics()
 
-    def send(self, data: bytes, eof_flag: bool) -> bool:
+    def send(self, data: memoryview, eof_flag: bool) -> bool:
         """
         Params:
             data: The data to send
@@ -29,35 +39,53 @@ class StopAndWait:
         """
         # Create the packet
         header = struct.pack(HEADER_FORMAT, self.seq_num(), eof_flag)
-        packet = header + data
+        packet = [header, data]
 
-        # Send the packet
+        # Send the packet, we are blocked until it is acknowledged
+        trace(SEND, self.seq_num.index, self.seq_num.index)
+        start = time.monotonic()
         success = self.send_packet_with_retry(packet)
+        self.metrics.blocked(time.monotonic() - start)
+        if success:
+            self.metrics.acknowledged(1, len(data), 0, 1)
         self.seq_num.next()
         return success
 
-    def send_packet_with_retry(self, packet: bytes) -> bool:
+    def send_packet_with_retry(self, packet: list) -> bool:
+        """
+        Params:
+            packet: The buffers that make up the packet, they are sent as one datagram
+        """
         start_retry_amount = self.total_retransmissions
         while start_retry_amount + self.packet_retry_limit > self.total_retransmissions:
             try:
-                self.sock.sendall(packet)
+                self.sock.settimeout(self.rto.timeout())
+                send_time = time.monotonic()
+                self.sock.sendmsg(packet)
                 # Wait for acknowledgment and verify that it matches the seq_num
                 ack_data = self.sock.recv(2)
                 ack_seq_num = struct.unpack("!H", ack_data)[0]
                 if ack_seq_num == self.seq_num():
+                    # Karn's rule: only sample packets that were not retransmitted
+                    if start_retry_amount == self.total_retransmissions:
+                        rtt_s = time.monotonic() - send_time
+                        self.rto.sample(rtt_s)
+                        self.metrics.rtt(rtt_s)
+                    trace(ACK, self.seq_num.index, self.seq_num.index)
                     return True
                 else:
-                    log(
-                        f"Received wrong ack: {ack_seq_num}, should be {self.seq_num()}"
-                    )
+                    # The acknowledgment of the previous packet, repeated
+                    trace(DUP_ACK, self.seq_num.index - 1, self.seq_num.index)
                     self.total_retransmissions += 1
-                    pass
+                    self.metrics.retransmit(self.seq_num.index)
             except socket.timeout:
                 self.total_retransmissions += 1
-                log(f"Retransmission: {self.total_retransmissions}")
+                self.metrics.retransmit(self.seq_num.index)
+                self.rto.backoff()
+                trace(TIMEOUT, self.seq_num.index, self.seq_num.index)
             # Does this only happen when the receiver finishes?
-            except ConnectionRefusedError as e:
-                log(f"Connection refused: {e}")
+            except ConnectionRefusedError:
+                trace(GIVE_UP, self.seq_num.index, self.seq_num.index)
                 break
 
         return False
@@ -67,15 +95,59 @@ class StopAndWait:
 
 
 if __name__ == "__main__":
-    remoteHost = sys.argv[1]
-    port = int(sys.argv[2])
-    filename = sys.argv[3]
-    retry_timeout_ms = int(sys.argv[4])
+    parser = argparse.ArgumentParser()
+    parser.add_argument("remote_host")
+    parser.add_argument("port", type=int)
+    parser.add_argument("filename")
+    parser.add_argument("retry_timeout_ms", type=int)
+    parser.add_argument(
+        "--adaptive-timeout",
+        action="store_true",
+        help="Estimate the timeout from RTT samples, starting at retry_timeout_ms",
+    )
+    parser.add_argument(
+        "--asyncio",
+        action="store_true",
+        help="Use the single threaded asyncio sender",
+    )
+    parser.add_argument(
+        "--metrics-json",
+        help="Write RTT samples, retransmissions, blocked time and a timeline here",
+    )
+    parser.add_argument(
+        "--metrics-csv", help="Write the window and goodput timeline here"
+    )
+    parser.add_argument(
+        "--trace",
+        help="Record packet events and write them here at exit or on SIGUSR1, see tracing.py",
+    )
+    args = parser.parse_args()
+    if args.trace:
+        start_tracing(args.trace)
+    if args.asyncio and (args.metrics_json or args.metrics_csv):
+        parser.error("--asyncio does not record metrics")
+    filename = args.filename
 
-    sender = StopAndWait(remoteHost, port, retry_timeout_ms)
-    start_time = time.time()
-    send_file(filename, sender)
-    time_took = time.time() - start_time
+    if args.asyncio:
+        sender, time_took = send_file_async(
+            args.remote_host,
+            args.port,
+            filename,
+            lambda file_view: StopAndWaitProtocol(
+                file_view, args.retry_timeout_ms / 1000, args.adaptive_timeout
+            ),
+        )
+    else:
+        sender = StopAndWait(
+            args.remote_host, args.port, args.retry_timeout_ms, args.adaptive_timeout
+        )
+        start_time = time.time()
+        send_file(filename, sender)
+        time_took = time.time() - start_time
+        sender.sock.close()
+        if args.metrics_json:
+            sender.metrics.write_json(args.metrics_json)
+        if args.metrics_csv:
+            sender.metrics.write_csv(args.metrics_csv)
     throughput = int(os.path.getsize(filename) / time_took / 1024)
     print(f"{sender.total_retransmissions} {throughput}")
-    sender.sock.close()
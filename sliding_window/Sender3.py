@@ -1,13 +1,47 @@
 # Robin Jehn s2024553
 
-import sys
+import argparse
 import socket
+import sys
 import struct
 import threading
 import time
 import os
-import math
-from utils import log, SequenceNumber, PACKET_SIZE, send_file, HEADER_FORMAT
+from utils import (
+    SequenceNumber,
+    packet_count,
+    send_file,
+    map_file,
+    PACKET_SIZE,
+    UNKNOWN_PACKET_COUNT,
+    MAX_PACKET_SIZE,
+    HEADER_FORMAT,
+    EOF_FLAG,
+    COMPRESSED_FLAG,
+    RetransmissionTimer,
+    timeout_estimator,
+    unwrap_seq_num,
+)
+from batch_io import send_batch
+from congestion import CONTROLLERS, TokenBucket
+from pmtu import probe_packet_size
+from fec import FecSender
+from resume import query_resume_offset
+from compression import send_compressed, worth_compressing, COMPRESSORS
+from streaming import send_stream
+from metrics import TransferMetrics
+from tracing import (
+    trace,
+    start_tracing,
+    SEND,
+    RESEND,
+    ACK,
+    DUP_ACK,
+    TIMEOUT,
+    FAST_RETRANSMIT,
+    GIVE_UP,
+)
+from async_engine import GoBackNProtocol, send_file_async
 
 
 class GoBackN:
@@ -18,83 +52,174 @@ class GoBackN:
         retry_timeout_ms: int,
         window_size: int,
         total_packets: int,
+        adaptive_timeout: bool = False,
+        congestion_control: str = "fixed",
+        pacing: bool = False,
+        dup_ack_threshold: int = 3,
+        flags: int = 0,
     ):
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self.sock.connect((host, port))
         self.retry_timeout_s = retry_timeout_ms / 1000
         self.sock.settimeout(self.retry_timeout_s)
+        self.rto = timeout_estimator(self.retry_timeout_s, adaptive_timeout)
         self.window_size = window_size
         self.lock = threading.Lock()
+        # Notified whenever base advances or we are done, so send() can fill the window
+        self.window_open = threading.Condition(self.lock)
+        # Logical packet index of the oldest unacknowledged packet
         self.base = 0
         self.seq_num = SequenceNumber()
+        # Packets by their logical index
         self.packets_in_transit = {}
-        self.timer = None
+        # Send times of packets that were only sent once, used for RTT samples
+        self.send_times = {}
+        self.timer = RetransmissionTimer(self.timeout_event)
         self.total_packets = total_packets
         self.done = False
         self.consecutive_retransmissions = 0
         # When dropping the last ack we need to terminate
         self.max_retransmissions = max(50, self.window_size * 5)
+        # Decides how much of the window may be used, see congestion.py
+        self.congestion = CONTROLLERS[congestion_control](window_size)
+        self.pacer = TokenBucket() if pacing else None
+        self.total_retransmissions = 0
+        # After a timeout the packets from resend_next up to resend_until are resent as
+        # the congestion window allows
+        self.resend_next = 0
+        self.resend_until = 0
+        # The receiver acknowledges base - 1 again for every packet after a gap, this many
+        # of those in a row trigger a fast retransmit instead of waiting for the timeout.
+        # 0 turns fast retransmits off
+        self.dup_ack_threshold = dup_ack_threshold
+        self.dup_acks = 0
+        self.total_fast_retransmits = 0
+        # Set on every data packet, e.g. COMPRESSED_FLAG
+        self.flags = flags
+        self.metrics = TransferMetrics()
 
     def start_timer(self):
-        if self.timer:
-            self.timer.cancel()
-        self.timer = threading.Timer(self.retry_timeout_s, self.timeout_event)
-        self.timer.start()
+        self.timer.start(self.rto.timeout())
 
     def stop_timer(self):
-        if self.timer:
-            self.timer.cancel()
-        self.timer = None
+        self.timer.stop()
         self.consecutive_retransmissions = 0
 
     def timeout_event(self):
         # Resend all in-transit packets
-        log("Timeout")
         with self.lock:
+            trace(TIMEOUT, self.seq_num.index, self.base)
+            if self.done:
+                return
             if self.consecutive_retransmissions >= self.max_retransmissions:
-                log("Max retransmissions reached")
+                trace(GIVE_UP, self.seq_num.index, self.base)
                 self.done = True
+                self.window_open.notify_all()
                 return
             if self.base >= self.total_packets - self.window_size:
                 self.consecutive_retransmissions += 1
-            for data in self.packets_in_transit.values():
-                try:
-                    self.sock.sendall(data)
-                except ConnectionRefusedError:
-                    log("Connection refused")
-                    self.done = True
-                    break
-            self.start_timer()
+            self.rto.backoff()
+            self.congestion.on_timeout()
+            self.go_back()
+
+    def go_back(self):
+        """Go back to base and resend everything in transit. Needs a lock around"""
+        # Karn's rule: the ACKs of resent packets are ambiguous
+        self.send_times.clear()
+        self.resend_next = self.base
+        self.resend_until = self.seq_num.index
+        self.resend_window()
+        self.start_timer()
 
-    def remove_from_transit(self, ack_seq_num: int):
+    def duplicate_ack(self):
         """
-        Only keep packets that have a sequence number higher then the last acknowledged one
+        The receiver acknowledged base - 1 again, so a packet after it arrived out of order.
+        Needs a lock around
         """
-        self.packets_in_transit = {
-            k: v for k, v in self.packets_in_transit.items() if k > ack_seq_num
-        }
+        self.dup_acks += 1
+        # Only once per lost packet, the rest of the window keeps producing duplicates
+        if self.dup_acks != self.dup_ack_threshold:
+            return
+        trace(FAST_RETRANSMIT, self.seq_num.index, self.base)
+        self.total_fast_retransmits += 1
+        self.congestion.on_loss()
+        self.go_back()
 
-    def send(self, data: bytes, eof_flag: bool) -> bool:
-        # Wait until we have gotten acknowledgments
-        while True:
-            with self.lock:
-                if self.seq_num() < self.base + window_size:
-                    break
-            # Avoid full cpu usage
-            time.sleep(0.01)
+    def resend_window(self):
+        """
+        Resend the packets marked for resending that fit into the congestion window.
+        Needs a lock around
+        """
+        start = max(self.resend_next, self.base)
+        end = min(self.resend_until, self.base + self.congestion.window())
+        if start >= end:
+            return
+        packets = [self.packets_in_transit[index] for index in range(start, end)]
+        self.resend_next = end
+        self.total_retransmissions += len(packets)
+        for index in range(start, end):
+            self.metrics.retransmit(index)
+            trace(RESEND, index, self.base)
+        try:
+            # Resend with as few syscalls as possible
+            send_batch(self.sock, packets)
+        except ConnectionRefusedError:
+            trace(GIVE_UP, self.seq_num.index, self.base)
+            self.done = True
+            self.window_open.notify_all()
+
+    def pacing_delay(self) -> float:
+        """Returns how long to wait before sending the next packet. Needs a lock around"""
+        if self.pacer is None:
+            return 0.0
+        return self.pacer.delay(self.congestion.pacing_rate())
+
+    def remove_from_transit(self, ack_index: int) -> int:
+        """
+        Only keep packets that have an index higher then the last acknowledged one.
+        A cumulative ACK may cover many packets when the receiver delays its ACKs.
+        Returns the payload bytes of the removed packets
+        """
+        size = 0
+        for index in range(self.base, ack_index + 1):
+            packet = self.packets_in_transit.pop(index, None)
+            if packet is not None:
+                size += len(packet[1])
+            self.send_times.pop(index, None)
+        return size
 
+    def send(self, data: memoryview, eof_flag: bool) -> bool:
         with self.lock:
+            # Wait until we have gotten acknowledgments and the pacer lets the packet go
+            start = time.monotonic()
+            while not self.done:
+                if self.seq_num.index >= self.base + self.congestion.window():
+                    self.window_open.wait()
+                    continue
+                delay = self.pacing_delay()
+                if delay <= 0:
+                    break
+                self.window_open.wait(delay)
+            self.metrics.blocked(time.monotonic() - start)
+            if self.done:
+                return False
+
             # Build packet
-            if self.seq_num() == self.base:
+            if self.seq_num.index == self.base:
                 self.start_timer()
-            log(f"{self.seq_num()}")
-            header = struct.pack(HEADER_FORMAT, self.seq_num(), eof_flag)
-            packet = header + data
+            trace(SEND, self.seq_num.index, self.base)
+            flags = self.flags | (EOF_FLAG if eof_flag else 0)
+            header = struct.pack(HEADER_FORMAT, self.seq_num(), flags)
+            # The data references the mapped file, so keeping it for resends is free
+            packet = [header, data]
 
             # Send packet
-            self.packets_in_transit[self.seq_num()] = packet
-            self.sock.sendall(packet)
+            self.packets_in_transit[self.seq_num.index] = packet
+            self.send_times[self.seq_num.index] = time.monotonic()
+            self.sock.sendmsg(packet)
+            if self.pacer is not None:
+                self.pacer.consume()
             self.seq_num.next()
         return True
 
@@ -109,12 +234,35 @@ class GoBackN:
                 continue
             ack_seq_num = struct.unpack("!H", ack_data)[0]
             with self.lock:
-                # Ignore old acknowledgments
-                if ack_seq_num < self.base:
+                ack_index = unwrap_seq_num(ack_seq_num, self.base)
+                trace(ACK, ack_index, self.base)
+                if ack_index == self.base - 1 and self.seq_num.index > self.base:
+                    trace(DUP_ACK, ack_index, self.base)
+                    if self.dup_ack_threshold > 0:
+                        self.duplicate_ack()
+                    continue
+                # Ignore old acknowledgments and ones for packets we did not send
+                if ack_index < self.base or ack_index >= self.seq_num.index:
                     continue
-                self.remove_from_transit(ack_seq_num)
-                self.base = ack_seq_num + 1
-                if self.seq_num() == self.base:
+                self.dup_acks = 0
+                rtt_s = None
+                if ack_index in self.send_times:
+                    rtt_s = time.monotonic() - self.send_times[ack_index]
+                    self.rto.sample(rtt_s)
+                    self.metrics.rtt(rtt_s)
+                acked = ack_index + 1 - self.base
+                self.congestion.on_ack(acked, rtt_s)
+                size = self.remove_from_transit(ack_index)
+                self.base = ack_index + 1
+                self.metrics.acknowledged(
+                    acked,
+                    size,
+                    self.seq_num.index - self.base,
+                    self.congestion.window(),
+                )
+                self.resend_window()
+                self.window_open.notify()
+                if self.seq_num.index == self.base:
                     # Stop timer as every packet has been received
                     self.stop_timer()
                 else:
@@ -124,35 +272,198 @@ class GoBackN:
                 if self.base >= self.total_packets:  # Base is 0 indexed
                     break
         self.stop_timer()
+        self.timer.shutdown()
 
     def __del__(self):
         self.sock.close()
 
 
 if __name__ == "__main__":
-    remote_host = sys.argv[1]
-    port = int(sys.argv[2])
-    filename = sys.argv[3]
-    retry_timeout_ms = int(sys.argv[4])
-    window_size = int(sys.argv[5])
+    parser = argparse.ArgumentParser()
+    parser.add_argument("remote_host")
+    parser.add_argument("port", type=int)
+    parser.add_argument("filename")
+    parser.add_argument("retry_timeout_ms", type=int)
+    parser.add_argument("window_size", type=int)
+    parser.add_argument(
+        "--adaptive-timeout",
+        action="store_true",
+        help="Estimate the timeout from RTT samples, starting at retry_timeout_ms",
+    )
+    parser.add_argument(
+        "--asyncio",
+        action="store_true",
+        help="Use the single threaded asyncio sender",
+    )
+    parser.add_argument(
+        "--congestion-control",
+        choices=sorted(CONTROLLERS),
+        default="fixed",
+        help="How to size the window, window_size is only the upper bound",
+    )
+    parser.add_argument(
+        "--pacing",
+        action="store_true",
+        help="Spread the packets of a window over the round trip time",
+    )
+    parser.add_argument(
+        "--dup-ack-threshold",
+        type=int,
+        default=3,
+        help="Resend the window after this many duplicate ACKs, 0 to only resend on timeouts",
+    )
+    parser.add_argument(
+        "--packet-size",
+        type=int,
+        help=f"Payload bytes per packet, at most {MAX_PACKET_SIZE}, {PACKET_SIZE} by default",
+    )
+    parser.add_argument(
+        "--probe-mtu",
+        action="store_true",
+        help="Use the largest packet size up to --packet-size that gets through unfragmented",
+    )
+    parser.add_argument(
+        "--fec",
+        action="store_true",
+        help="Send XOR parity packets so the receiver can repair losses without retransmissions",
+    )
+    parser.add_argument(
+        "--fec-group-size",
+        type=int,
+        help="Packets per parity group, tuned from the retransmissions if not given",
+    )
+    parser.add_argument(
+        "--fec-parity",
+        type=int,
+        help="Parity packets per group, tuned from the retransmissions if not given",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Ask the receiver how much of the file it already has and only send the rest",
+    )
+    parser.add_argument(
+        "--compress",
+        choices=sorted(COMPRESSORS),
+        help="Compress the file while sending it, unless its start does not compress well",
+    )
+    parser.add_argument(
+        "--metrics-json",
+        help="Write RTT samples, retransmissions, blocked time and a timeline here",
+    )
+    parser.add_argument(
+        "--metrics-csv", help="Write the window and goodput timeline here"
+    )
+    parser.add_argument(
+        "--trace",
+        help="Record packet events and write them here at exit or on SIGUSR1, see tracing.py",
+    )
+    args = parser.parse_args()
+    if args.trace:
+        start_tracing(args.trace)
+    if args.asyncio and (args.congestion_control != "fixed" or args.pacing):
+        parser.error("--asyncio does not support congestion control or pacing")
+    if args.asyncio and args.fec:
+        parser.error("--asyncio does not support --fec")
+    if args.asyncio and args.compress:
+        parser.error("--asyncio does not support --compress")
+    if args.asyncio and (args.metrics_json or args.metrics_csv):
+        parser.error("--asyncio does not record metrics")
+    if args.packet_size is not None and not 0 < args.packet_size <= MAX_PACKET_SIZE:
+        parser.error(f"--packet-size must be between 1 and {MAX_PACKET_SIZE}")
+    filename = args.filename
+    # "-" sends standard input, which may be a pipe of unknown length
+    stream = filename == "-"
+    if stream and (args.asyncio or args.resume or args.compress):
+        parser.error(
+            "Sending standard input does not support --asyncio, --resume or --compress"
+        )
+
+    packet_size = args.packet_size or PACKET_SIZE
+    if args.probe_mtu:
+        packet_size = probe_packet_size(
+            args.remote_host,
+            args.port,
+            args.packet_size or MAX_PACKET_SIZE,
+            args.retry_timeout_ms / 1000,
+        )
+        print(f"Packet size: {packet_size}", file=sys.stderr)
+    offset = 0
+    if args.resume:
+        offset = query_resume_offset(
+            args.remote_host, args.port, args.retry_timeout_ms / 1000
+        )
+        print(f"Resuming at: {offset}", file=sys.stderr)
+    file_size = None
+    if not stream:
+        # What is left to send
+        offset = min(offset, os.path.getsize(filename))
+        file_size = os.path.getsize(filename) - offset
 
-    total_packets = math.ceil(os.path.getsize(filename) / PACKET_SIZE)
+    if args.asyncio:
+        sender, time_taken = send_file_async(
+            args.remote_host,
+            args.port,
+            filename,
+            lambda file_view: GoBackNProtocol(
+                file_view[offset:],
+                args.window_size,
+                args.retry_timeout_ms / 1000,
+                args.adaptive_timeout,
+                packet_size=packet_size,
+                dup_ack_threshold=args.dup_ack_threshold,
+            ),
+        )
+        throughput = int(file_size / time_taken / 1024)
+        print(
+            f"{throughput} {sender.total_retransmissions} {sender.total_fast_retransmits}"
+        )
+        sys.exit()
+
+    compress = args.compress
+    if compress and not worth_compressing(map_file(filename)[offset:], compress):
+        print("Not compressing, the file does not compress well", file=sys.stderr)
+        compress = None
+    if stream or compress:
+        # Unknown until the input ends or is compressed, send_payloads() fills it in
+        total_packets = UNKNOWN_PACKET_COUNT
+    else:
+        total_packets = packet_count(file_size, packet_size=packet_size)
     sender = GoBackN(
-        remote_host,
-        port,
-        retry_timeout_ms,
-        window_size,
+        args.remote_host,
+        args.port,
+        args.retry_timeout_ms,
+        args.window_size,
         total_packets,
+        args.adaptive_timeout,
+        args.congestion_control,
+        args.pacing,
+        args.dup_ack_threshold,
+        COMPRESSED_FLAG if compress else 0,
     )
 
     ack_thread = threading.Thread(target=sender.handle_acknowledgments)
     ack_thread.start()
 
     start_time = time.time()
-    send_file(filename, sender)
+    source = sender
+    if args.fec:
+        source = FecSender(sender, args.fec_group_size, args.fec_parity)
+    if stream:
+        file_size = send_stream(sys.stdin.buffer, source, packet_size)
+    elif compress:
+        send_compressed(filename, source, compress, packet_size, offset)
+    else:
+        send_file(filename, source, packet_size=packet_size, offset=offset)
     time_taken = time.time() - start_time
-    throughput = int(os.path.getsize(filename) / time_taken / 1024)
-    print(f"{throughput}")
+    throughput = int(file_size / time_taken / 1024)
 
     ack_thread.join()
     sender.sock.close()
+    if args.metrics_json:
+        sender.metrics.write_json(args.metrics_json)
+    if args.metrics_csv:
+        sender.metrics.write_csv(args.metrics_csv)
+    print(
+        f"{throughput} {sender.total_retransmissions} {sender.total_fast_retransmits}"
+    )
@@ -1,13 +1,38 @@
 # Robin Jehn s2024553
 
-import sys
+import argparse
 import socket
+import sys
 import struct
 import threading
 import time
+import heapq
 import os
-import math
-from utils import log, SequenceNumber, PACKET_SIZE, send_file, HEADER_FORMAT
+from utils import (
+    SequenceNumber,
+    packet_count,
+    send_file,
+    map_file,
+    PACKET_SIZE,
+    UNKNOWN_PACKET_COUNT,
+    MAX_PACKET_SIZE,
+    HEADER_FORMAT,
+    EOF_FLAG,
+    SACK_FLAG,
+    COMPRESSED_FLAG,
+    MAX_ACK_SIZE,
+    acked_indices,
+    timeout_estimator,
+)
+from async_engine import SelectiveRepeatProtocol, send_file_async
+from congestion import CONTROLLERS, TokenBucket
+from pmtu import probe_packet_size
+from fec import FecSender
+from resume import query_resume_offset
+from compression import send_compressed, worth_compressing, COMPRESSORS
+from streaming import send_stream
+from metrics import TransferMetrics
+from tracing import start_tracing, trace, SEND, RESEND, ACK, GIVE_UP, WINDOW_FULL
 
 
 class SlidingWindow:
@@ -18,12 +43,27 @@ class SlidingWindow:
         window_size: int,
         total_packets: int,
         retry_timeout_s: float,
+        adaptive_timeout: bool = False,
+        sack: bool = False,
+        congestion_control: str = "fixed",
+        pacing: bool = False,
+        flags: int = 0,
     ):
         self.total_packets = total_packets
+        # Set on every data packet, e.g. COMPRESSED_FLAG
+        self.flags = flags
         self.window_size = window_size
         self.lock = threading.Lock()
+        # Wakes the resend thread when a deadline comes before all others or we are done
+        self.deadline_added = threading.Condition(self.lock)
+        # Notified whenever a packet is acknowledged or we are done, so send() can fill the window
+        self.window_open = threading.Condition(self.lock)
         self.seq_num = SequenceNumber()
+        # Packets by their logical index, in the order they were first sent
         self.packets_in_transit = {}
+        # Min-heap of (deadline, index, time_stamp). Acknowledged packets are not removed,
+        # instead their entries are skipped once they reach the top of the heap
+        self.deadlines = []
         self.highest_ack = -1
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
@@ -34,103 +74,341 @@ class SlidingWindow:
         # and stop sending
         self.max_retransmissions = 50
         self.retry_timeout_s = retry_timeout_s
+        self.rto = timeout_estimator(retry_timeout_s, adaptive_timeout)
+        # Ask the receiver for SACK acknowledgments, which old receivers do not understand
+        self.sack = sack
+        # Decides how much of the window may be used, see congestion.py
+        self.congestion = CONTROLLERS[congestion_control](window_size)
+        self.pacer = TokenBucket() if pacing else None
+        # Losses of packets sent before this index were already reacted to
+        self.recovery_point = 0
+        self.total_retransmissions = 0
+        self.metrics = TransferMetrics()
 
     def base(self) -> int:
         """
-        Returns the lowest not yet acknowledged sequence number.
+        Returns the logical index of the lowest not yet acknowledged packet.
         Needs a lock around
         """
         if len(self.packets_in_transit) == 0:
             return self.highest_ack + 1
-        return min(self.packets_in_transit.keys())
+        # Packets are inserted in index order and resending keeps their position
+        return next(iter(self.packets_in_transit))
+
+    def add_to_transit(self, index: int, packet: list, retry_attempts: int):
+        """
+        Record a packet that was just sent and schedule its retransmission deadline.
+        Needs a lock around
+        """
+        time_stamp = time.monotonic()
+        self.packets_in_transit[index] = (time_stamp, packet, retry_attempts)
+        # Each retransmission of a packet doubles its timeout
+        deadline = time_stamp + self.rto.timeout(retry_attempts)
+        # The timeout varies from packet to packet, so the resend thread may be sleeping
+        # until a later deadline
+        if len(self.deadlines) == 0 or deadline < self.deadlines[0][0]:
+            self.deadline_added.notify()
+        heapq.heappush(self.deadlines, (deadline, index, time_stamp))
 
     def resend_timedout_packets(self):
         """
-        Resend all the packets that are timedout.
+        Resend the packets that are timedout. Sleeps until the earliest deadline.
         This function is called in a thread
         """
-        while True:
-            with self.lock:
+        with self.lock:
+            while True:
                 # We are done
-                if self.base() >= self.total_packets:
+                if self.done or self.base() >= self.total_packets:
                     break
 
-                for seq_num, (
-                    time_stamp,
-                    packet,
-                    retry_attempts,
-                ) in self.packets_in_transit.items():
-                    if retry_attempts >= self.max_retransmissions:
-                        log("Max retransmissions reached")
-                        self.done = True
-                        return
+                if len(self.deadlines) == 0:
+                    self.deadline_added.wait()
+                    continue
 
-                    if self.retry_timeout_s < time.time() - time_stamp:
-                        self.sock.sendall(packet)
-                        log(f"Resend packet: {seq_num}")
-                        self.packets_in_transit[seq_num] = (
-                            time.time(),
-                            packet,
-                            retry_attempts + 1,
-                        )
-            time.sleep(0.005)
+                deadline, index, time_stamp = self.deadlines[0]
+                remaining = deadline - time.monotonic()
+                if remaining > 0:
+                    self.deadline_added.wait(remaining)
+                    continue
+                heapq.heappop(self.deadlines)
+
+                # Skip entries of packets that were acknowledged or resent since
+                entry = self.packets_in_transit.get(index)
+                if entry is None or entry[0] != time_stamp:
+                    continue
+
+                _, packet, retry_attempts = entry
+                if retry_attempts >= self.max_retransmissions:
+                    trace(GIVE_UP, index, self.base())
+                    self.done = True
+                    self.window_open.notify_all()
+                    return
+
+                # Only shrink the window once per window of lost packets
+                if index >= self.recovery_point:
+                    self.congestion.on_loss()
+                    self.recovery_point = self.seq_num.index
+                self.total_retransmissions += 1
+                self.metrics.retransmit(index)
+                self.sock.sendmsg(packet)
+                trace(RESEND, index, self.base())
+                self.add_to_transit(index, packet, retry_attempts + 1)
 
     def handle_acknowledgments(self):
         while True:
             try:
-                ack_data = self.sock.recv(2)
+                ack_data = self.sock.recv(MAX_ACK_SIZE)
             except socket.timeout:
                 with self.lock:
                     if self.base() >= self.total_packets or self.done:
                         return
                 continue
-            ack_seq_num = struct.unpack("!H", ack_data)[0]
             with self.lock:
                 if self.done:
                     return
 
-                # Ignore old acknowledgments
-                if ack_seq_num < self.base():
+                newest = None
+                newly_acked = 0
+                size = 0
+                acked = acked_indices(ack_data, self.base(), self.packets_in_transit)
+                for ack_index in acked:
+                    entry = self.packets_in_transit.pop(ack_index, None)
+                    # Old acknowledgment or duplicate ACK of a resent packet
+                    if entry is None:
+                        continue
+                    newly_acked += 1
+                    size += len(entry[1][1])
+                    self.highest_ack = max(self.highest_ack, ack_index)
+                    if newest is None or entry[0] > newest[0]:
+                        newest = entry
+                if newest is None:
                     continue
-                self.packets_in_transit.pop(ack_seq_num)
-                self.highest_ack = max(self.highest_ack, ack_seq_num)
+                trace(ACK, self.highest_ack, self.base())
+
+                # The most recently sent packet is most likely the one that triggered this ACK.
+                # Karn's rule: only sample packets that were not retransmitted
+                time_stamp, _, retry_attempts = newest
+                rtt_s = None
+                if retry_attempts == 0:
+                    rtt_s = time.monotonic() - time_stamp
+                    self.rto.sample(rtt_s)
+                    self.metrics.rtt(rtt_s)
+                self.congestion.on_ack(newly_acked, rtt_s)
+                self.metrics.acknowledged(
+                    newly_acked,
+                    size,
+                    len(self.packets_in_transit),
+                    self.congestion.window(),
+                )
+                self.window_open.notify()
 
                 # End if all packets have been acknowledged
                 if self.base() >= self.total_packets:  # Base is 0 indexed
+                    # Let the resend thread see that we are done
+                    self.deadline_added.notify()
                     return
 
-    def send(self, data: bytes, eof_flag: bool) -> bool:
-        # Wait until we have gotten acknowledgments
-        while True:
-            with self.lock:
-                if self.seq_num() < self.base() + window_size:
-                    break
-            # Avoid full cpu usage
-            time.sleep(0.005)
-            log(f"Waiting for {self.seq_num()}")
+    def pacing_delay(self) -> float:
+        """Returns how long to wait before sending the next packet. Needs a lock around"""
+        if self.pacer is None:
+            return 0.0
+        return self.pacer.delay(self.congestion.pacing_rate())
 
+    def send(self, data: memoryview, eof_flag: bool) -> bool:
         with self.lock:
+            # Wait until we have gotten acknowledgments and the pacer lets the packet go
+            start = time.monotonic()
+            while not self.done:
+                if self.seq_num.index >= self.base() + self.congestion.window():
+                    trace(WINDOW_FULL, self.seq_num.index, self.base())
+                    self.window_open.wait()
+                    continue
+                delay = self.pacing_delay()
+                if delay <= 0:
+                    break
+                self.window_open.wait(delay)
+            self.metrics.blocked(time.monotonic() - start)
+            if self.done:
+                return False
+
             # Build packet
-            header = struct.pack(HEADER_FORMAT, self.seq_num(), eof_flag)
-            packet = header + data
+            flags = self.flags | (EOF_FLAG if eof_flag else 0)
+            if self.sack:
+                flags |= SACK_FLAG
+            header = struct.pack(HEADER_FORMAT, self.seq_num(), flags)
+            # The data references the mapped file, so keeping it for resends is free
+            packet = [header, data]
 
             # Send packet
-            self.packets_in_transit[self.seq_num()] = (time.time(), packet, 0)
-            self.sock.sendall(packet)
+            trace(SEND, self.seq_num.index, self.base())
+            self.add_to_transit(self.seq_num.index, packet, 0)
+            self.sock.sendmsg(packet)
+            if self.pacer is not None:
+                self.pacer.consume()
             self.seq_num.next()
         return True
 
 
 if __name__ == "__main__":
-    remote_host = sys.argv[1]
-    port = int(sys.argv[2])
-    filename = sys.argv[3]
-    retry_timeout_s = int(sys.argv[4]) / 1000  # The arg is given in ms
-    window_size = int(sys.argv[5])
+    parser = argparse.ArgumentParser()
+    parser.add_argument("remote_host")
+    parser.add_argument("port", type=int)
+    parser.add_argument("filename")
+    parser.add_argument("retry_timeout_ms", type=int)
+    parser.add_argument("window_size", type=int)
+    parser.add_argument(
+        "--adaptive-timeout",
+        action="store_true",
+        help="Estimate the timeout from RTT samples, starting at retry_timeout_ms",
+    )
+    parser.add_argument(
+        "--sack",
+        action="store_true",
+        help="Ask the receiver for acknowledgments with a bitmap of the received packets",
+    )
+    parser.add_argument(
+        "--congestion-control",
+        choices=sorted(CONTROLLERS),
+        default="fixed",
+        help="How to size the window, window_size is only the upper bound",
+    )
+    parser.add_argument(
+        "--pacing",
+        action="store_true",
+        help="Spread the packets of a window over the round trip time",
+    )
+    parser.add_argument(
+        "--asyncio",
+        action="store_true",
+        help="Use the single threaded asyncio sender",
+    )
+    parser.add_argument(
+        "--packet-size",
+        type=int,
+        help=f"Payload bytes per packet, at most {MAX_PACKET_SIZE}, {PACKET_SIZE} by default",
+    )
+    parser.add_argument(
+        "--probe-mtu",
+        action="store_true",
+        help="Use the largest packet size up to --packet-size that gets through unfragmented",
+    )
+    parser.add_argument(
+        "--fec",
+        action="store_true",
+        help="Send XOR parity packets so the receiver can repair losses without retransmissions",
+    )
+    parser.add_argument(
+        "--fec-group-size",
+        type=int,
+        help="Packets per parity group, tuned from the retransmissions if not given",
+    )
+    parser.add_argument(
+        "--fec-parity",
+        type=int,
+        help="Parity packets per group, tuned from the retransmissions if not given",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Ask the receiver how much of the file it already has and only send the rest",
+    )
+    parser.add_argument(
+        "--compress",
+        choices=sorted(COMPRESSORS),
+        help="Compress the file while sending it, unless its start does not compress well",
+    )
+    parser.add_argument(
+        "--metrics-json",
+        help="Write RTT samples, retransmissions, blocked time and a timeline here",
+    )
+    parser.add_argument(
+        "--metrics-csv", help="Write the window and goodput timeline here"
+    )
+    parser.add_argument(
+        "--trace",
+        help="Record packet events and write them here at exit or on SIGUSR1, see tracing.py",
+    )
+    args = parser.parse_args()
+    if args.trace:
+        start_tracing(args.trace)
+    if args.asyncio and (args.congestion_control != "fixed" or args.pacing):
+        parser.error("--asyncio does not support congestion control or pacing")
+    if args.asyncio and args.fec:
+        parser.error("--asyncio does not support --fec")
+    if args.asyncio and args.compress:
+        parser.error("--asyncio does not support --compress")
+    if args.asyncio and (args.metrics_json or args.metrics_csv):
+        parser.error("--asyncio does not record metrics")
+    if args.packet_size is not None and not 0 < args.packet_size <= MAX_PACKET_SIZE:
+        parser.error(f"--packet-size must be between 1 and {MAX_PACKET_SIZE}")
+    filename = args.filename
+    # "-" sends standard input, which may be a pipe of unknown length
+    stream = filename == "-"
+    if stream and (args.asyncio or args.resume or args.compress):
+        parser.error(
+            "Sending standard input does not support --asyncio, --resume or --compress"
+        )
+    retry_timeout_s = args.retry_timeout_ms / 1000  # The arg is given in ms
+
+    packet_size = args.packet_size or PACKET_SIZE
+    if args.probe_mtu:
+        packet_size = probe_packet_size(
+            args.remote_host,
+            args.port,
+            args.packet_size or MAX_PACKET_SIZE,
+            args.retry_timeout_ms / 1000,
+        )
+        print(f"Packet size: {packet_size}", file=sys.stderr)
+    offset = 0
+    if args.resume:
+        offset = query_resume_offset(
+            args.remote_host, args.port, args.retry_timeout_ms / 1000
+        )
+        print(f"Resuming at: {offset}", file=sys.stderr)
+    file_size = None
+    if not stream:
+        # What is left to send
+        offset = min(offset, os.path.getsize(filename))
+        file_size = os.path.getsize(filename) - offset
+
+    if args.asyncio:
+        sender, time_taken = send_file_async(
+            args.remote_host,
+            args.port,
+            filename,
+            lambda file_view: SelectiveRepeatProtocol(
+                file_view[offset:],
+                args.window_size,
+                retry_timeout_s,
+                args.adaptive_timeout,
+                packet_size=packet_size,
+                sack=args.sack,
+            ),
+        )
+        throughput = int(file_size / time_taken / 1024)
+        print(f"{throughput} {sender.total_retransmissions}")
+        sys.exit()
 
-    total_packets = math.ceil(os.path.getsize(filename) / PACKET_SIZE)
+    compress = args.compress
+    if compress and not worth_compressing(map_file(filename)[offset:], compress):
+        print("Not compressing, the file does not compress well", file=sys.stderr)
+        compress = None
+    if stream or compress:
+        # Unknown until the input ends or is compressed, send_payloads() fills it in
+        total_packets = UNKNOWN_PACKET_COUNT
+    else:
+        total_packets = packet_count(file_size, packet_size=packet_size)
     sender = SlidingWindow(
-        remote_host, port, window_size, total_packets, retry_timeout_s
+        args.remote_host,
+        args.port,
+        args.window_size,
+        total_packets,
+        retry_timeout_s,
+        args.adaptive_timeout,
+        args.sack,
+        args.congestion_control,
+        args.pacing,
+        COMPRESSED_FLAG if compress else 0,
     )
 
     ack_thread = threading.Thread(target=sender.handle_acknowledgments)
@@ -139,11 +417,23 @@ if __name__ == "__main__":
     resend_thread.start()
 
     start_time = time.time()
-    send_file(filename, sender)
+    source = sender
+    if args.fec:
+        source = FecSender(sender, args.fec_group_size, args.fec_parity)
+    if stream:
+        file_size = send_stream(sys.stdin.buffer, source, packet_size)
+    elif compress:
+        send_compressed(filename, source, compress, packet_size, offset)
+    else:
+        send_file(filename, source, packet_size=packet_size, offset=offset)
     time_taken = time.time() - start_time
-    throughput = int(os.path.getsize(filename) / time_taken / 1024)
-    print(f"{throughput}")
+    throughput = int(file_size / time_taken / 1024)
 
     resend_thread.join()
     ack_thread.join()
     sender.sock.close()
+    if args.metrics_json:
+        sender.metrics.write_json(args.metrics_json)
+    if args.metrics_csv:
+        sender.metrics.write_csv(args.metrics_csv)
+    print(f"{throughput} {sender.total_retransmissions}")
@@ -0,0 +1,180 @@
+# Receives a file sent by StripedSender.py. Session i listens on port + i in its own process
+# and writes its packets straight to their offsets in the shared output file.
+
+import argparse
+import multiprocessing
+import os
+import queue
+import socket
+import sys
+import time
+from Receiver4 import SelectiveRepeatReceiver, receive_packets
+from utils import AckPolicy, PACKET_SIZE
+
+# How often we check whether a stripe process failed
+POLL_INTERVAL_S = 0.1
+# The stripes are sent side by side, so once one of them ended the others should not take
+# much longer. If one does, its sender probably gave up
+STRIPE_TIMEOUT_S = 30.0
+
+
+def receive_stripe(
+    sock: socket.socket,
+    output_filename: str,
+    window_size: int,
+    stripe: int,
+    stripes: int,
+    ack_policy: AckPolicy,
+    file_ends,
+    packet_size: int = PACKET_SIZE,
+):
+    """Receive one stripe with Receiver4 and put the offset where it ends into file_ends"""
+    receiver = SelectiveRepeatReceiver(
+        sock,
+        # Every session writes to its own offsets, so none of them may truncate the file
+        open(output_filename, "r+b"),
+        window_size,
+        pwrite=True,
+        stripe=stripe,
+        stripes=stripes,
+        ack_policy=ack_policy,
+        packet_size=packet_size,
+    )
+    receive_packets(receiver)
+    file_ends.put(receiver.file_end)
+
+
+def wait_for_stripes(processes: list, file_ends, timeout_s: float) -> list:
+    """
+    Returns the offsets where the stripes end. Raises RuntimeError if a stripe process failed
+    or a stripe did not end within timeout_s of the first one
+    """
+    ends = []
+    deadline = None
+    while len(ends) < len(processes):
+        try:
+            ends.append(file_ends.get(timeout=POLL_INTERVAL_S))
+        except queue.Empty:
+            pass
+        for stripe, process in enumerate(processes):
+            if process.exitcode not in (None, 0):
+                raise RuntimeError(
+                    f"Stripe {stripe} failed with exit code {process.exitcode}"
+                )
+        if ends and deadline is None:
+            deadline = time.monotonic() + timeout_s
+        if deadline is not None and time.monotonic() > deadline:
+            raise RuntimeError(
+                f"{len(processes) - len(ends)} of {len(processes)} stripes did not end "
+                f"within {timeout_s} s of the first"
+            )
+    return ends
+
+
+def receive_striped(
+    port: int,
+    output_filename: str,
+    window_size: int,
+    streams: int,
+    ack_policy: AckPolicy = None,
+    bind_address: str = "0.0.0.0",
+    packet_size: int = PACKET_SIZE,
+    timeout_s: float = STRIPE_TIMEOUT_S,
+):
+    """
+    Receive streams sessions on the ports port, port + 1, ... into output_filename.
+    The packet size has to match the sender, a stripe cannot tell where its packets go otherwise.
+    Raises RuntimeError if a stripe fails, see wait_for_stripes()
+    """
+    ack_policy = ack_policy or AckPolicy()
+    # Bind every port before the first packet can arrive
+    sockets = []
+    for stripe in range(streams):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((bind_address, port + stripe))
+        sockets.append(sock)
+    open(output_filename, "wb").close()
+
+    file_ends = multiprocessing.Queue()
+    processes = [
+        multiprocessing.Process(
+            target=receive_stripe,
+            args=(
+                sock,
+                output_filename,
+                window_size,
+                stripe,
+                streams,
+                ack_policy,
+                file_ends,
+                packet_size,
+            ),
+        )
+        for stripe, sock in enumerate(sockets)
+    ]
+    for process in processes:
+        process.start()
+    try:
+        ends = wait_for_stripes(processes, file_ends, timeout_s)
+    except RuntimeError:
+        # The other stripes cannot complete the file on their own
+        for process in processes:
+            process.terminate()
+        raise
+    finally:
+        for process in processes:
+            process.join()
+        for sock in sockets:
+            sock.close()
+
+    # The stripe holding the last packet ends furthest into the file, cut off what the
+    # sessions preallocated past it
+    with open(output_filename, "r+b") as output_file:
+        os.ftruncate(output_file.fileno(), max(ends))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("port", type=int)
+    parser.add_argument("output_filename")
+    parser.add_argument("window_size", type=int)
+    parser.add_argument("streams", type=int)
+    parser.add_argument(
+        "--ack-every",
+        type=int,
+        default=1,
+        help="Acknowledge every N in-order packets, only with senders that use --sack",
+    )
+    parser.add_argument(
+        "--ack-delay-ms",
+        type=float,
+        default=0.0,
+        help="Hold back an acknowledgment for at most this long, keep it below the sender timeout",
+    )
+    parser.add_argument(
+        "--packet-size",
+        type=int,
+        default=PACKET_SIZE,
+        help="The payload size the sender uses",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=STRIPE_TIMEOUT_S,
+        help="Give up if a stripe has not ended this many seconds after the first one",
+    )
+    args = parser.parse_args()
+
+    try:
+        receive_striped(
+            args.port,
+            args.output_filename,
+            args.window_size,
+            args.streams,
+            AckPolicy(args.ack_every, args.ack_delay_ms / 1000),
+            packet_size=args.packet_size,
+            timeout_s=args.timeout,
+        )
+    except RuntimeError as error:
+        sys.exit(str(error))
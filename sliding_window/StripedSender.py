@@ -0,0 +1,159 @@
+# Sends one file as several Selective Repeat sessions in parallel, one process per session.
+# Session i sends packets i, i + streams, i + 2 * streams, ... of the file to port + i,
+# so a single Python process no longer limits the throughput to one core.
+
+import argparse
+import multiprocessing
+import multiprocessing.connection
+import os
+import sys
+import threading
+import time
+from utils import packet_count, send_file, PACKET_SIZE, MAX_PACKET_SIZE
+from Sender4 import SlidingWindow
+
+
+def send_stripe(
+    host: str,
+    port: int,
+    filename: str,
+    window_size: int,
+    retry_timeout_s: float,
+    stripe: int,
+    stripes: int,
+    adaptive_timeout: bool = False,
+    sack: bool = False,
+    packet_size: int = PACKET_SIZE,
+):
+    """
+    Send one stripe of the file with Selective Repeat, returns once it was acknowledged.
+    Raises RuntimeError if the sender gave up, which fails the stripe's process
+    """
+    total_packets = packet_count(
+        os.path.getsize(filename), stripe, stripes, packet_size
+    )
+    sender = SlidingWindow(
+        host,
+        port,
+        window_size,
+        total_packets,
+        retry_timeout_s,
+        adaptive_timeout,
+        sack,
+    )
+    ack_thread = threading.Thread(target=sender.handle_acknowledgments)
+    resend_thread = threading.Thread(target=sender.resend_timedout_packets)
+    ack_thread.start()
+    resend_thread.start()
+
+    send_file(filename, sender, stripe, stripes, packet_size)
+
+    resend_thread.join()
+    ack_thread.join()
+    sender.sock.close()
+    if sender.done:
+        raise RuntimeError(f"Stripe {stripe} gave up after too many retransmissions")
+
+
+def send_striped(
+    host: str,
+    port: int,
+    filename: str,
+    window_size: int,
+    retry_timeout_s: float,
+    streams: int,
+    adaptive_timeout: bool = False,
+    sack: bool = False,
+    packet_size: int = PACKET_SIZE,
+):
+    """
+    Send the file as streams parallel sessions to the ports port, port + 1, ...
+    The receiver has to be given the same packet size.
+    Raises RuntimeError as soon as a stripe failed, the file cannot arrive without it
+    """
+    processes = [
+        multiprocessing.Process(
+            target=send_stripe,
+            args=(
+                host,
+                port + stripe,
+                filename,
+                window_size,
+                retry_timeout_s,
+                stripe,
+                streams,
+                adaptive_timeout,
+                sack,
+                packet_size,
+            ),
+        )
+        for stripe in range(streams)
+    ]
+    for process in processes:
+        process.start()
+    running = dict(enumerate(processes))
+    while running:
+        multiprocessing.connection.wait(
+            [process.sentinel for process in running.values()]
+        )
+        for stripe, process in list(running.items()):
+            if process.is_alive():
+                continue
+            del running[stripe]
+            if process.exitcode != 0:
+                for other in running.values():
+                    other.terminate()
+                    other.join()
+                raise RuntimeError(
+                    f"Stripe {stripe} failed with exit code {process.exitcode}"
+                )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("remote_host")
+    parser.add_argument("port", type=int)
+    parser.add_argument("filename")
+    parser.add_argument("retry_timeout_ms", type=int)
+    parser.add_argument("window_size", type=int)
+    parser.add_argument("streams", type=int)
+    parser.add_argument(
+        "--adaptive-timeout",
+        action="store_true",
+        help="Estimate the timeout from RTT samples, starting at retry_timeout_ms",
+    )
+    parser.add_argument(
+        "--sack",
+        action="store_true",
+        help="Ask the receivers for acknowledgments with a bitmap of the received packets",
+    )
+    parser.add_argument(
+        "--packet-size",
+        type=int,
+        default=PACKET_SIZE,
+        help=f"Payload bytes per packet, at most {MAX_PACKET_SIZE}. Give the receiver the same",
+    )
+    args = parser.parse_args()
+    if not 0 < args.packet_size <= MAX_PACKET_SIZE:
+        parser.error(f"--packet-size must be between 1 and {MAX_PACKET_SIZE}")
+    filename = args.filename
+
+    start_time = time.time()
+    try:
+        send_striped(
+            args.remote_host,
+            args.port,
+            filename,
+            args.window_size,
+            args.retry_timeout_ms / 1000,
+            args.streams,
+            args.adaptive_timeout,
+            args.sack,
+            args.packet_size,
+        )
+    except RuntimeError as error:
+        sys.exit(str(error))
+    time_taken = time.time() - start_time
+    # The aggregate throughput of all sessions
+    throughput = int(os.path.getsize(filename) / time_taken / 1024)
+    print(f"{throughput}")
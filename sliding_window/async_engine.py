@@ -0,0 +1,390 @@
+# Single threaded asyncio implementations of the Stop-and-Wait, Go-Back-N and Selective Repeat
+# senders. One event loop drives sending, ACK processing and retransmissions: the window is
+# refilled from the ACK callback and timeouts are scheduled with loop.call_at, so no locks
+# or helper threads are needed.
+import abc
+import asyncio
+import socket
+import struct
+import time
+from utils import (
+    log,
+    SequenceNumber,
+    packet_count,
+    map_file,
+    PACKET_SIZE,
+    HEADER_FORMAT,
+    EOF_FLAG,
+    SACK_FLAG,
+    ACK_FORMAT,
+    ACK_SIZE,
+    MAX_ACK_SIZE,
+    acked_indices,
+    timeout_estimator,
+    unwrap_seq_num,
+)
+from batch_io import send_batch
+from tracing import trace, RESEND, TIMEOUT, FAST_RETRANSMIT, GIVE_UP
+
+
+class AsyncSender(asyncio.DatagramProtocol, abc.ABC):
+    """
+    The parts shared by all asyncio senders. Subclasses keep track of the packets in flight
+    and implement window_open(), add_to_transit() and handle_ack().
+    """
+
+    def __init__(
+        self,
+        file_view: memoryview,
+        window_size: int,
+        retry_timeout_s: float,
+        adaptive_timeout: bool = False,
+        packet_size: int = PACKET_SIZE,
+    ):
+        """
+        Params:
+            file_view: The whole file, see utils.map_file
+            window_size: The maximum number of unacknowledged packets
+            retry_timeout_s: The (initial) retransmission timeout
+            adaptive_timeout: Estimate the timeout from RTT samples
+            packet_size: The payload size of every packet but the last
+        """
+        self.file_view = file_view
+        self.packet_size = packet_size
+        self.total_packets = packet_count(len(file_view), packet_size=packet_size)
+        self.window_size = window_size
+        self.rto = timeout_estimator(retry_timeout_s, adaptive_timeout)
+        self.seq_num = SequenceNumber()
+        self.loop = asyncio.get_running_loop()
+        # Resolved once every packet was acknowledged or we gave up
+        self.finished = self.loop.create_future()
+        self.transport = None
+        # The plain socket under the transport, so packets can be sent without joining the
+        # header and data. Set by run_transfer()
+        self.sock = None
+        self.done = False
+        self.total_retransmissions = 0
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.fill_window()
+
+    def datagram_received(self, data: bytes, addr):
+        # The transport reads one datagram per callback, so drain the rest of the queued ACKs
+        # ourselves and refill the window once for all of them
+        while not self.finished.done():
+            self.handle_ack(data)
+            try:
+                data = self.sock.recv(MAX_ACK_SIZE)
+            except BlockingIOError:
+                break
+            except ConnectionRefusedError:
+                self.give_up()
+        self.fill_window()
+
+    def error_received(self, exc: Exception):
+        # Does this only happen when the receiver finishes?
+        log(f"Error received: {exc}")
+        self.give_up()
+
+    def build_packet(self, index: int, flags: int = 0) -> list:
+        """Returns the header and data of the packet with the given logical index"""
+        start = index * self.packet_size
+        # The data references the mapped file, so keeping it for resends is free
+        data = self.file_view[start : start + self.packet_size]
+        if index + 1 == self.total_packets:
+            flags |= EOF_FLAG
+        return [struct.pack(HEADER_FORMAT, self.seq_num(), flags), data]
+
+    def send_packets(self, packets: list):
+        """Send packets with as few syscalls as possible, without blocking the event loop"""
+        try:
+            # Packets queued in the transport have to go out first
+            if self.transport.get_write_buffer_size() == 0:
+                try:
+                    send_batch(self.sock, packets)
+                    return
+                except BlockingIOError:
+                    # We do not know how many were sent, resending a few is harmless
+                    pass
+            # The transport sends them once the socket is writable again
+            for packet in packets:
+                self.transport.sendto(b"".join(packet))
+        except ConnectionRefusedError:
+            self.give_up()
+
+    def fill_window(self):
+        """Send new packets until the window is full"""
+        packets = []
+        while (
+            not self.finished.done()
+            and self.seq_num.index < self.total_packets
+            and self.window_open()
+        ):
+            packet = self.build_packet(self.seq_num.index)
+            self.add_to_transit(self.seq_num.index, packet)
+            packets.append(packet)
+            self.seq_num.next()
+        if packets:
+            self.send_packets(packets)
+
+    def finish(self):
+        if not self.finished.done():
+            self.finished.set_result(None)
+
+    def give_up(self):
+        trace(GIVE_UP, self.seq_num.index)
+        self.done = True
+        self.finish()
+
+    @abc.abstractmethod
+    def window_open(self) -> bool:
+        """Returns True if another new packet may be sent"""
+
+    @abc.abstractmethod
+    def add_to_transit(self, index: int, packet: list):
+        """Record a new packet that is about to be sent for the first time"""
+
+    @abc.abstractmethod
+    def handle_ack(self, ack_data: bytes):
+        """Process an acknowledgment from the receiver"""
+
+
+class GoBackNProtocol(AsyncSender):
+    """
+    Go-Back-N with a single timer for the oldest unacknowledged packet, see Sender3.GoBackN
+    """
+
+    def __init__(self, *args, dup_ack_threshold: int = 3, **kwargs):
+        """
+        Params:
+            dup_ack_threshold: Resend the window after this many duplicate ACKs, 0 to only
+                resend on timeouts
+        """
+        super().__init__(*args, **kwargs)
+        # Logical packet index of the oldest unacknowledged packet
+        self.base = 0
+        # Packets by their logical index
+        self.packets_in_transit = {}
+        # Send times of packets that were only sent once, used for RTT samples
+        self.send_times = {}
+        self.timer = None
+        # Timeouts in a row without any progress, when dropping the last ack we need to terminate
+        self.consecutive_retransmissions = 0
+        self.max_retransmissions = max(50, self.window_size * 5)
+        self.dup_ack_threshold = dup_ack_threshold
+        self.dup_acks = 0
+        self.total_fast_retransmits = 0
+
+    def start_timer(self):
+        self.stop_timer()
+        self.timer = self.loop.call_at(
+            self.loop.time() + self.rto.timeout(), self.timeout_event
+        )
+
+    def stop_timer(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+
+    def finish(self):
+        self.stop_timer()
+        super().finish()
+
+    def window_open(self) -> bool:
+        return self.seq_num.index < self.base + self.window_size
+
+    def add_to_transit(self, index: int, packet: list):
+        if index == self.base:
+            self.start_timer()
+        self.packets_in_transit[index] = packet
+        self.send_times[index] = self.loop.time()
+
+    def timeout_event(self):
+        # Resend all in-transit packets
+        trace(TIMEOUT, self.seq_num.index, self.base)
+        self.timer = None
+        if self.consecutive_retransmissions >= self.max_retransmissions:
+            self.give_up()
+            return
+        self.consecutive_retransmissions += 1
+        self.rto.backoff()
+        self.go_back()
+
+    def go_back(self):
+        """Resend the whole window"""
+        self.total_retransmissions += len(self.packets_in_transit)
+        # Karn's rule: the ACKs of resent packets are ambiguous
+        self.send_times.clear()
+        self.send_packets(list(self.packets_in_transit.values()))
+        if not self.finished.done():
+            self.start_timer()
+
+    def handle_ack(self, ack_data: bytes):
+        if len(ack_data) != ACK_SIZE:
+            return
+        (ack_seq_num,) = struct.unpack(ACK_FORMAT, ack_data)
+        ack_index = unwrap_seq_num(ack_seq_num, self.base)
+        if (
+            ack_index == self.base - 1
+            and self.seq_num.index > self.base
+            and self.dup_ack_threshold > 0
+        ):
+            # A packet after base arrived out of order, see Sender3.GoBackN.duplicate_ack
+            self.dup_acks += 1
+            if self.dup_acks == self.dup_ack_threshold:
+                trace(FAST_RETRANSMIT, self.seq_num.index, self.base)
+                self.total_fast_retransmits += 1
+                self.go_back()
+            return
+        # Ignore old acknowledgments and ones for packets we did not send
+        if ack_index < self.base or ack_index >= self.seq_num.index:
+            return
+        self.dup_acks = 0
+        if ack_index in self.send_times:
+            self.rto.sample(self.loop.time() - self.send_times[ack_index])
+        # A cumulative ACK may cover many packets
+        for index in range(self.base, ack_index + 1):
+            self.packets_in_transit.pop(index, None)
+            self.send_times.pop(index, None)
+        self.base = ack_index + 1
+        self.consecutive_retransmissions = 0
+
+        # End if all packets have been acknowledged
+        if self.base >= self.total_packets:
+            self.finish()
+            return
+        if self.seq_num.index == self.base:
+            self.stop_timer()
+        else:
+            self.start_timer()
+
+
+class StopAndWaitProtocol(GoBackNProtocol):
+    """
+    Stop-and-Wait is Go-Back-N with a window of one packet, see Sender2.StopAndWait
+    """
+
+    def __init__(
+        self,
+        file_view: memoryview,
+        retry_timeout_s: float,
+        adaptive_timeout: bool = False,
+    ):
+        # With a single packet in flight there are no duplicate ACKs to act on
+        super().__init__(
+            file_view, 1, retry_timeout_s, adaptive_timeout, dup_ack_threshold=0
+        )
+        self.max_retransmissions = 1000
+
+
+class SelectiveRepeatProtocol(AsyncSender):
+    """
+    Selective Repeat with a timer per packet, see Sender4.SlidingWindow
+    """
+
+    def __init__(self, *args, sack: bool = False, **kwargs):
+        """
+        Params:
+            sack: Ask the receiver for SACK acknowledgments
+        """
+        super().__init__(*args, **kwargs)
+        self.sack = sack
+        # (time_stamp, packet, retry_attempts, timer) by logical index, in the order they
+        # were first sent
+        self.packets_in_transit = {}
+        self.highest_ack = -1
+        # If a single packet needs to be retransmitted more often we assume something is wrong
+        self.max_retransmissions = 50
+
+    def base(self) -> int:
+        """Returns the logical index of the lowest not yet acknowledged packet"""
+        if len(self.packets_in_transit) == 0:
+            return self.highest_ack + 1
+        # Packets are inserted in index order and resending keeps their position
+        return next(iter(self.packets_in_transit))
+
+    def build_packet(self, index: int, flags: int = 0) -> list:
+        if self.sack:
+            flags |= SACK_FLAG
+        return super().build_packet(index, flags)
+
+    def window_open(self) -> bool:
+        return self.seq_num.index < self.base() + self.window_size
+
+    def add_to_transit(self, index: int, packet: list, retry_attempts: int = 0):
+        """Record a packet that is sent now and schedule its retransmission"""
+        time_stamp = self.loop.time()
+        # Each retransmission of a packet doubles its timeout
+        timer = self.loop.call_at(
+            time_stamp + self.rto.timeout(retry_attempts), self.timeout_event, index
+        )
+        self.packets_in_transit[index] = (time_stamp, packet, retry_attempts, timer)
+
+    def timeout_event(self, index: int):
+        _, packet, retry_attempts, _ = self.packets_in_transit[index]
+        if retry_attempts >= self.max_retransmissions:
+            self.give_up()
+            return
+        trace(RESEND, index, self.base())
+        self.total_retransmissions += 1
+        self.add_to_transit(index, packet, retry_attempts + 1)
+        self.send_packets([packet])
+
+    def finish(self):
+        for _, _, _, timer in self.packets_in_transit.values():
+            timer.cancel()
+        super().finish()
+
+    def handle_ack(self, ack_data: bytes):
+        newest = None
+        for ack_index in acked_indices(ack_data, self.base(), self.packets_in_transit):
+            entry = self.packets_in_transit.pop(ack_index, None)
+            # Old acknowledgment or duplicate ACK of a resent packet
+            if entry is None:
+                continue
+            entry[3].cancel()
+            self.highest_ack = max(self.highest_ack, ack_index)
+            if newest is None or entry[0] > newest[0]:
+                newest = entry
+        if newest is None:
+            return
+
+        # Karn's rule: only sample packets that were not retransmitted
+        time_stamp, _, retry_attempts, _ = newest
+        if retry_attempts == 0:
+            self.rto.sample(self.loop.time() - time_stamp)
+
+        # End if all packets have been acknowledged
+        if self.base() >= self.total_packets:
+            self.finish()
+
+
+async def run_transfer(host: str, port: int, filename: str, protocol_factory):
+    """
+    Send a file with an asyncio sender.
+    Params:
+        protocol_factory: Called with the mapped file, returns the sender protocol
+    Returns:
+        The sender protocol and the seconds until every packet was acknowledged
+    """
+    loop = asyncio.get_running_loop()
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.connect((host, port))
+    sock.setblocking(False)
+    protocol = protocol_factory(map_file(filename))
+    protocol.sock = sock
+
+    start_time = time.time()
+    transport, _ = await loop.create_datagram_endpoint(lambda: protocol, sock=sock)
+    try:
+        await protocol.finished
+    finally:
+        transport.close()
+    return protocol, time.time() - start_time
+
+
+def send_file_async(host: str, port: int, filename: str, protocol_factory):
+    """Runs run_transfer() on a new event loop"""
+    return asyncio.run(run_transfer(host, port, filename, protocol_factory))
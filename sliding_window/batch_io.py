@@ -0,0 +1,243 @@
+# Batched datagram IO using the Linux sendmmsg/recvmmsg syscalls.
+# When they are not available we fall back to one syscall per datagram.
+import ctypes
+import ctypes.util
+import errno
+import select
+import socket
+import struct
+import sys
+from utils import MAX_PACKET_SIZE, HEADER_SIZE
+
+MSG_WAITFORONE = 0x10000
+# The kernel handles at most this many messages per call (UIO_MAXIOV)
+MAX_BATCH_SIZE = 1024
+# Socket receive buffer we ask for, the default only holds a few large packets.
+# The kernel caps it at net.core.rmem_max
+RECEIVE_BUFFER_SIZE = 4 * 1024 * 1024
+
+
+class IOVec(ctypes.Structure):
+    _fields_ = [("iov_base", ctypes.c_void_p), ("iov_len", ctypes.c_size_t)]
+
+
+class MsgHdr(ctypes.Structure):
+    _fields_ = [
+        ("msg_name", ctypes.c_void_p),
+        ("msg_namelen", ctypes.c_uint32),
+        ("msg_iov", ctypes.POINTER(IOVec)),
+        ("msg_iovlen", ctypes.c_size_t),
+        ("msg_control", ctypes.c_void_p),
+        ("msg_controllen", ctypes.c_size_t),
+        ("msg_flags", ctypes.c_int),
+    ]
+
+
+class MMsgHdr(ctypes.Structure):
+    _fields_ = [("msg_hdr", MsgHdr), ("msg_len", ctypes.c_uint)]
+
+
+class SockAddrIn(ctypes.Structure):
+    _fields_ = [
+        ("sin_family", ctypes.c_ushort),
+        ("sin_port", ctypes.c_uint16),  # Network byte order
+        ("sin_addr", ctypes.c_uint8 * 4),
+        ("sin_zero", ctypes.c_uint8 * 8),
+    ]
+
+
+def load_libc():
+    """
+    Returns libc if it provides sendmmsg and recvmmsg, None otherwise
+    """
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        libc.sendmmsg.argtypes = [
+            ctypes.c_int,
+            ctypes.c_void_p,
+            ctypes.c_uint,
+            ctypes.c_int,
+        ]
+        libc.recvmmsg.argtypes = [
+            ctypes.c_int,
+            ctypes.c_void_p,
+            ctypes.c_uint,
+            ctypes.c_int,
+            ctypes.c_void_p,
+        ]
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+LIBC = load_libc()
+BATCHING_AVAILABLE = LIBC is not None
+
+
+def raise_errno():
+    err = ctypes.get_errno()
+    # OSError picks the matching subclass, e.g. ConnectionRefusedError
+    raise OSError(err, f"{errno.errorcode.get(err, err)}")
+
+
+def buffer_address(buffer, keep_alive: list) -> int:
+    """
+    Returns the address of a bytes object or a writable buffer without copying it.
+    Params:
+        keep_alive: Objects that need to stay alive until the syscall returns are appended to it
+    """
+    if isinstance(buffer, bytes):
+        pointer = ctypes.c_char_p(buffer)
+        keep_alive.append(pointer)
+        return ctypes.cast(pointer, ctypes.c_void_p).value
+    array = (ctypes.c_char * len(buffer)).from_buffer(buffer)
+    keep_alive.append(array)
+    return ctypes.addressof(array)
+
+
+def send_batch(sock: socket.socket, packets: list):
+    """
+    Send every packet as its own datagram on a connected socket, using as few syscalls as possible.
+    Params:
+        packets: Each packet is a list of buffers that are gathered into one datagram
+    """
+    if not BATCHING_AVAILABLE:
+        for packet in packets:
+            sock.sendmsg(packet)
+        return
+
+    for start in range(0, len(packets), MAX_BATCH_SIZE):
+        batch = packets[start : start + MAX_BATCH_SIZE]
+        keep_alive = []
+        messages = (MMsgHdr * len(batch))()
+        for message, packet in zip(messages, batch):
+            iovecs = (IOVec * len(packet))()
+            for iovec, buffer in zip(iovecs, packet):
+                iovec.iov_len = len(buffer)
+                if len(buffer) > 0:
+                    iovec.iov_base = buffer_address(buffer, keep_alive)
+            keep_alive.append(iovecs)
+            message.msg_hdr.msg_iov = iovecs
+            message.msg_hdr.msg_iovlen = len(packet)
+
+        sent = 0
+        while sent < len(batch):
+            result = LIBC.sendmmsg(
+                sock.fileno(),
+                ctypes.addressof(messages) + sent * ctypes.sizeof(MMsgHdr),
+                len(batch) - sent,
+                0,
+            )
+            if result < 0:
+                if ctypes.get_errno() == errno.EINTR:
+                    continue
+                raise_errno()
+            sent += result
+
+
+class BatchReceiver:
+    """
+    Receives many datagrams per syscall from an unconnected IPv4 socket.
+    Datagrams are received into a pool of preallocated buffers and returned as views into them,
+    so a datagram is only valid until the next call to receive()
+    """
+
+    def __init__(
+        self,
+        sock: socket.socket,
+        batch_size: int = 64,
+        buffer_size: int = MAX_PACKET_SIZE + HEADER_SIZE,
+    ):
+        """
+        Params:
+            sock: The socket to receive from
+            batch_size: The maximum number of datagrams returned by one receive() call
+            buffer_size: The maximum size of a datagram, by default any packet size a sender
+                may choose fits
+        """
+        self.sock = sock
+        self.buffer_size = buffer_size
+        if sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF) < RECEIVE_BUFFER_SIZE:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECEIVE_BUFFER_SIZE)
+        if not BATCHING_AVAILABLE:
+            self.buffer = bytearray(buffer_size)
+            self.view = memoryview(self.buffer)
+            return
+
+        self.batch_size = min(batch_size, MAX_BATCH_SIZE)
+        self.buffers = [
+            ctypes.create_string_buffer(buffer_size) for _ in range(self.batch_size)
+        ]
+        self.views = [memoryview(buffer).cast("B") for buffer in self.buffers]
+        self.addresses = (SockAddrIn * self.batch_size)()
+        self.iovecs = (IOVec * self.batch_size)()
+        self.messages = (MMsgHdr * self.batch_size)()
+        # Reading the results through raw views is a lot cheaper than through ctypes fields
+        self.message_bytes = memoryview(self.messages).cast("B")
+        self.address_bytes = memoryview(self.addresses).cast("B")
+        # Parsed (host, port) tuples by their raw sockaddr_in bytes
+        self.address_cache = {}
+        self.received = self.batch_size
+        for i in range(self.batch_size):
+            self.iovecs[i].iov_base = ctypes.addressof(self.buffers[i])
+            self.iovecs[i].iov_len = buffer_size
+            header = self.messages[i].msg_hdr
+            header.msg_name = ctypes.addressof(self.addresses[i])
+            header.msg_iov = ctypes.pointer(self.iovecs[i])
+            header.msg_iovlen = 1
+
+    def receive(self, timeout: float = None) -> list:
+        """
+        Blocks until at least one datagram arrives, or the timeout expires.
+        Params:
+            timeout: The seconds to wait for, defaults to the socket timeout
+        Returns:
+            A list of (packet, address) tuples, the packets are memoryviews
+        """
+        if timeout is None:
+            timeout = self.sock.gettimeout()
+        # Sockets with a timeout are non-blocking, so wait for data ourselves
+        if timeout is not None:
+            ready, _, _ = select.select([self.sock], [], [], timeout)
+            if not ready:
+                raise socket.timeout("timed out")
+
+        if not BATCHING_AVAILABLE:
+            size, addr = self.sock.recvfrom_into(self.buffer)
+            return [(self.view[:size], addr)]
+
+        # The kernel overwrote the address lengths of the messages received last time
+        for i in range(self.received):
+            self.messages[i].msg_hdr.msg_namelen = ctypes.sizeof(SockAddrIn)
+        self.received = 0
+        count = LIBC.recvmmsg(
+            self.sock.fileno(),
+            ctypes.addressof(self.messages),
+            self.batch_size,
+            MSG_WAITFORONE,
+            None,
+        )
+        if count < 0:
+            if ctypes.get_errno() in (errno.EAGAIN, errno.EINTR):
+                return []
+            raise_errno()
+
+        self.received = count
+        packets = []
+        message_size = ctypes.sizeof(MMsgHdr)
+        address_size = ctypes.sizeof(SockAddrIn)
+        for i in range(count):
+            raw_address = self.address_bytes[i * address_size : (i + 1) * address_size]
+            raw_address = raw_address.tobytes()
+            addr = self.address_cache.get(raw_address)
+            if addr is None:
+                port, host = struct.unpack_from("!2xH4s", raw_address)
+                addr = (socket.inet_ntoa(host), port)
+                self.address_cache[raw_address] = addr
+            (length,) = struct.unpack_from(
+                "I", self.message_bytes, i * message_size + MMsgHdr.msg_len.offset
+            )
+            packets.append((self.views[i][:length], addr))
+        return packets
@@ -0,0 +1,93 @@
+# Microbenchmark of the receive path: memory allocated and time spent per packet when
+# receiving with recvfrom and slicing, compared to recvfrom_into a buffer pool
+
+import argparse
+import os
+import socket
+import struct
+import time
+import tracemalloc
+from utils import PACKET_SIZE, HEADER_SIZE, HEADER_FORMAT
+from batch_io import BatchReceiver
+
+# Packets sent per round, small enough to fit into the socket receive buffer
+ROUND_SIZE = 64
+
+
+def receive_with_recvfrom(receiver: BatchReceiver, file):
+    """The receive path the receivers used before, returns the number of packets handled"""
+    packet, _ = receiver.sock.recvfrom(PACKET_SIZE + HEADER_SIZE)
+    _, eof_flag = struct.unpack(HEADER_FORMAT, packet[:HEADER_SIZE])
+    file.write(packet[HEADER_SIZE:])
+    return 1
+
+
+def receive_with_pool(receiver: BatchReceiver, file):
+    """The receive path the receivers use now, returns the number of packets handled"""
+    packets = receiver.receive()
+    for packet, _ in packets:
+        _, eof_flag = struct.unpack_from(HEADER_FORMAT, packet)
+        file.write(packet[HEADER_SIZE:])
+    return len(packets)
+
+
+def run(receive, total_packets: int, trace: bool) -> float:
+    """
+    Send total_packets packets to ourselves and receive them with receive().
+    Returns the bytes allocated per packet if trace is set, otherwise the seconds per packet.
+    """
+    receiver_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    receiver_sock.bind(("127.0.0.1", 0))
+    sender_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sender_sock.connect(receiver_sock.getsockname())
+    packet = struct.pack(HEADER_FORMAT, 0, False) + os.urandom(PACKET_SIZE)
+    receiver = BatchReceiver(receiver_sock)
+
+    allocated = 0
+    receive_time = 0.0
+    received = 0
+    with open(os.devnull, "wb", buffering=0) as file:
+        if trace:
+            tracemalloc.start()
+        while received < total_packets:
+            for _ in range(ROUND_SIZE):
+                sender_sock.send(packet)
+            round_received = 0
+            while round_received < ROUND_SIZE:
+                if trace:
+                    # The peak above the current usage is what this call allocated at once
+                    current, _ = tracemalloc.get_traced_memory()
+                    tracemalloc.reset_peak()
+                    round_received += receive(receiver, file)
+                    _, peak = tracemalloc.get_traced_memory()
+                    allocated += peak - current
+                else:
+                    start = time.perf_counter()
+                    round_received += receive(receiver, file)
+                    receive_time += time.perf_counter() - start
+            received += round_received
+        if trace:
+            tracemalloc.stop()
+
+    sender_sock.close()
+    receiver_sock.close()
+    if trace:
+        return allocated / received
+    return receive_time / received
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--packets", type=int, default=20000)
+    args = parser.parse_args()
+
+    for name, receive in [
+        ("recvfrom", receive_with_recvfrom),
+        ("recvfrom_into pool", receive_with_pool),
+    ]:
+        allocated = run(receive, args.packets, trace=True)
+        seconds = run(receive, args.packets, trace=False)
+        print(
+            f"{name}: {allocated:.0f} bytes allocated per packet, "
+            f"{seconds * 1e6:.1f} us per packet"
+        )
@@ -0,0 +1,389 @@
+# Benchmark runner for the protocol senders, replacing the bash sweep scripts. Every run
+# transfers a file with the actual Sender and Receiver classes through a NetworkEmulator on
+# loopback and checks that it arrived intact. The runs of each configuration are summarised
+# with mean, median, p95 and a 95% confidence interval of the mean, written as JSON or CSV,
+# and compared against a baseline so that CI fails when throughput regresses.
+#
+# The sweeps of the bash scripts are available as presets:
+#   test.bash                    --preset stop_and_wait
+#   test_go_back_n.bash          --preset go_back_n
+#   test_selective_repeat.bash   --preset selective_repeat
+#   test_small_delay.bash        --preset small_delay
+
+import argparse
+import csv
+import itertools
+import json
+import math
+import os
+import socket
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from utils import packet_count, send_file, AckPolicy
+import Receiver2
+import Receiver3
+import Receiver4
+from Sender2 import StopAndWait
+from Sender3 import GoBackN
+from Sender4 import SlidingWindow
+from NetworkEmulator import Link, NetworkEmulator, parse_rate
+
+PROTOCOLS = ["stop_and_wait", "go_back_n", "selective_repeat", "selective_repeat_sack"]
+# The parameters a configuration is made of, in the order they are swept
+PARAMETERS = ["protocol", "window", "delay_ms", "loss", "timeout_ms"]
+# The sweeps of the bash scripts. A timeout of None is 2 * delay + 10 ms like they use
+PRESETS = {
+    "stop_and_wait": dict(
+        protocol=["stop_and_wait"],
+        window=[1],
+        delay_ms=[0],
+        loss=[0],
+        timeout_ms=[5, 10, 15, 20, 25, 30, 40, 50, 75, 100],
+    ),
+    "go_back_n": dict(
+        protocol=["go_back_n"],
+        window=[2**i for i in range(9)],
+        delay_ms=[5, 25, 100],
+        loss=[5],
+        timeout_ms=[None],
+        rate="10mbit",
+    ),
+    "selective_repeat": dict(
+        protocol=["selective_repeat"],
+        window=[1, 2, 4, 8, 16, 32],
+        delay_ms=[25],
+        loss=[5],
+        timeout_ms=[60],
+        rate="10mbit",
+    ),
+    "small_delay": dict(
+        protocol=["go_back_n", "selective_repeat"],
+        window=[1, 8, 64],
+        delay_ms=[0, 1, 2, 5],
+        loss=[0],
+        timeout_ms=[None],
+    ),
+}
+# Two-sided 97.5% quantiles of Student's t distribution by degrees of freedom
+T_QUANTILES = {
+    1: 12.706, 2: 4.303, 3: 3.182, 4: 2.776, 5: 2.571, 6: 2.447, 7: 2.365, 8: 2.306,
+    9: 2.262, 10: 2.228, 12: 2.179, 15: 2.131, 20: 2.086, 30: 2.042, 60: 2.000,
+}  # fmt: skip
+# How long the receiver may take to finish after the sender, before the run counts as failed
+RUN_TIMEOUT_S = 120
+
+
+def t_quantile(df: int) -> float:
+    """Returns the t quantile for a 95% confidence interval, rounded towards the wider one"""
+    for known in sorted(T_QUANTILES, reverse=True):
+        if df >= known:
+            return T_QUANTILES[known]
+    raise ValueError("A confidence interval needs at least two values")
+
+
+def percentile(values: list, p: float) -> float:
+    """Returns the p-th percentile of the values, interpolating between the closest ranks"""
+    values = sorted(values)
+    rank = (len(values) - 1) * p / 100
+    low = math.floor(rank)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (rank - low)
+
+
+def summarise(values: list) -> dict:
+    """Returns the statistics of the values of one configuration"""
+    if not values:
+        return {}
+    mean = statistics.fmean(values)
+    summary = {
+        "mean": mean,
+        "median": statistics.median(values),
+        "p95": percentile(values, 95),
+        "stdev": None,
+        "ci95_low": None,
+        "ci95_high": None,
+    }
+    # A single run says nothing about the variance
+    if len(values) > 1:
+        stdev = statistics.stdev(values)
+        margin = t_quantile(len(values) - 1) * stdev / math.sqrt(len(values))
+        summary.update(stdev=stdev, ci95_low=mean - margin, ci95_high=mean + margin)
+    return summary
+
+
+def free_port() -> int:
+    """Returns a port that was free a moment ago, for receivers that bind their own socket"""
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_receiver(protocol: str, window: int, output_file):
+    """Run the receiver of the protocol in a thread, returns its port and the thread"""
+    if protocol == "stop_and_wait":
+        port = free_port()
+        target, args = Receiver2.receive_packets, (port, output_file)
+    else:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+        if protocol == "go_back_n":
+            receiver = Receiver3.GoBackNReceiver(sock, output_file, AckPolicy())
+            target = Receiver3.receive_packets
+        else:
+            receiver = Receiver4.SelectiveRepeatReceiver(sock, output_file, window)
+            target = Receiver4.receive_packets
+        args = (receiver,)
+    # A receiver whose sender gave up waits forever, so do not wait for it on exit
+    thread = threading.Thread(target=target, args=args, daemon=True)
+    thread.start()
+    return port, thread
+
+
+def send(protocol: str, port: int, filename: str, window: int, timeout_ms: int):
+    """Send the file with the sender of the protocol, returns it once it is done"""
+    if protocol == "stop_and_wait":
+        sender = StopAndWait("127.0.0.1", port, timeout_ms)
+        send_file(filename, sender)
+        sender.sock.close()
+        return sender
+
+    total_packets = packet_count(os.path.getsize(filename))
+    if protocol == "go_back_n":
+        sender = GoBackN("127.0.0.1", port, timeout_ms, window, total_packets)
+        threads = [threading.Thread(target=sender.handle_acknowledgments)]
+    else:
+        sender = SlidingWindow(
+            "127.0.0.1",
+            port,
+            window,
+            total_packets,
+            timeout_ms / 1000,
+            sack=protocol == "selective_repeat_sack",
+        )
+        threads = [
+            threading.Thread(target=sender.handle_acknowledgments),
+            threading.Thread(target=sender.resend_timedout_packets),
+        ]
+    for thread in threads:
+        thread.start()
+    send_file(filename, sender)
+    for thread in threads:
+        thread.join()
+    sender.sock.close()
+    return sender
+
+
+def run(config: dict, filename: str, rate_bps: float, seed: int) -> dict:
+    """Transfer the file once with the configuration, returns the measurements"""
+    delay_s = config["delay_ms"] / 1000
+    loss = config["loss"] / 100
+    # Both directions, like netem on the loopback device
+    forward = Link(loss, delay_s, rate_bps=rate_bps, seed=2 * seed)
+    reverse = Link(loss, delay_s, rate_bps=rate_bps, seed=2 * seed + 1)
+    with tempfile.TemporaryDirectory() as directory:
+        output_path = os.path.join(directory, "output")
+        output_file = open(output_path, "wb")
+        port, receiver = start_receiver(
+            config["protocol"], config["window"], output_file
+        )
+        emulator = NetworkEmulator(0, "127.0.0.1", port, forward, reverse)
+        emulator.start()
+        start_time = time.monotonic()
+        sender = send(
+            config["protocol"],
+            emulator.port,
+            filename,
+            config["window"],
+            config["timeout_ms"],
+        )
+        time_taken = time.monotonic() - start_time
+        receiver.join(timeout=RUN_TIMEOUT_S)
+        emulator.close()
+        intact = not receiver.is_alive()
+        # Receiver2 leaves it open
+        output_file.close()
+        if intact:
+            with open(filename, "rb") as f, open(output_path, "rb") as g:
+                intact = f.read() == g.read()
+    return {
+        **config,
+        "seed": seed,
+        "seconds": time_taken,
+        "throughput": os.path.getsize(filename) / time_taken / 1024,
+        "retransmissions": sender.total_retransmissions,
+        "intact": intact,
+    }
+
+
+def configurations(sweep: dict) -> list:
+    """Returns every combination of the swept parameters"""
+    configs = []
+    for values in itertools.product(*(sweep[name] for name in PARAMETERS)):
+        config = dict(zip(PARAMETERS, values))
+        if config["timeout_ms"] is None:
+            config["timeout_ms"] = 2 * config["delay_ms"] + 10
+        # Stop-and-Wait has no window
+        if config["protocol"] == "stop_and_wait":
+            config["window"] = 1
+        if config not in configs:
+            configs.append(config)
+    return configs
+
+
+def benchmark(configs: list, filename: str, iterations: int, rate_bps, seed=0) -> dict:
+    """Run every configuration the given number of times, returns the results as JSON"""
+    runs = []
+    summary = []
+    for config in configs:
+        config_runs = []
+        for i in range(iterations):
+            result = run(config, filename, rate_bps, seed + i)
+            print(
+                " ".join(f"{key}={value}" for key, value in config.items()),
+                f"run {i}: {result['throughput']:.0f} KB/s",
+                f"{result['retransmissions']} retx",
+                "" if result["intact"] else "CORRUPT",
+                file=sys.stderr,
+            )
+            config_runs.append(result)
+        runs += config_runs
+        intact_runs = [result for result in config_runs if result["intact"]]
+        summary.append(
+            {
+                **config,
+                "runs": len(config_runs),
+                "failures": len(config_runs) - len(intact_runs),
+                "throughput": summarise([r["throughput"] for r in intact_runs]),
+                "retransmissions": summarise(
+                    [r["retransmissions"] for r in intact_runs]
+                ),
+            }
+        )
+    return {
+        "file": filename,
+        "file_size": os.path.getsize(filename),
+        "iterations": iterations,
+        "rate_bps": rate_bps,
+        "runs": runs,
+        "summary": summary,
+    }
+
+
+def write_csv(results: dict, f):
+    """One row per configuration, with the statistics flattened into columns"""
+    rows = []
+    for entry in results["summary"]:
+        row = {name: entry[name] for name in PARAMETERS + ["runs", "failures"]}
+        for metric in ("throughput", "retransmissions"):
+            for stat, value in entry[metric].items():
+                row[f"{metric}_{stat}"] = value
+        rows.append(row)
+    fieldnames = []
+    for row in rows:
+        fieldnames += [name for name in row if name not in fieldnames]
+    writer = csv.DictWriter(f, fieldnames)
+    writer.writeheader()
+    writer.writerows(rows)
+
+
+def regressions(results: dict, baseline: dict, max_regression: float) -> list:
+    """
+    Returns a message for every configuration that lost a transfer, or whose mean
+    throughput is more than max_regression percent below the same configuration in the baseline
+    """
+
+    def key(entry: dict) -> tuple:
+        return tuple(entry[name] for name in PARAMETERS)
+
+    baseline_means = {
+        key(entry): entry["throughput"].get("mean") for entry in baseline["summary"]
+    }
+    messages = []
+    for entry in results["summary"]:
+        name = " ".join(f"{p}={v}" for p, v in zip(PARAMETERS, key(entry)))
+        if entry["failures"]:
+            messages.append(f"{name}: {entry['failures']} corrupt or stuck transfers")
+            continue
+        expected = baseline_means.get(key(entry))
+        if not expected:
+            continue
+        mean = entry["throughput"]["mean"]
+        if mean < expected * (1 - max_regression / 100):
+            messages.append(
+                f"{name}: {mean:.0f} KB/s, {100 * (1 - mean / expected):.1f}% below "
+                f"the baseline of {expected:.0f} KB/s"
+            )
+    return messages
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--preset", choices=sorted(PRESETS), help="Sweep like a bash script"
+    )
+    parser.add_argument("--protocols", nargs="+", choices=PROTOCOLS)
+    parser.add_argument("--windows", nargs="+", type=int)
+    parser.add_argument("--delays", nargs="+", type=float, help="One way delays in ms")
+    parser.add_argument("--losses", nargs="+", type=float, help="Loss percentages")
+    parser.add_argument(
+        "--timeouts",
+        nargs="+",
+        type=int,
+        help="Retry timeouts in ms, 2 * delay + 10 if not given",
+    )
+    parser.add_argument("--rate", help="Link rate like 10mbit, unlimited if not given")
+    parser.add_argument("--iterations", type=int, default=5)
+    parser.add_argument("--file", default="test.jpg")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the first run")
+    parser.add_argument("--json", help="Write the runs and their statistics here")
+    parser.add_argument("--csv", help="Write the statistics per configuration here")
+    parser.add_argument(
+        "--baseline",
+        help="A JSON file of an earlier run to compare the throughput with",
+    )
+    parser.add_argument(
+        "--max-regression",
+        type=float,
+        default=10.0,
+        help="Fail if the mean throughput is this many percent below the baseline",
+    )
+    args = parser.parse_args()
+
+    sweep = dict(PRESETS.get(args.preset, {}))
+    for name, value, default in [
+        ("protocol", args.protocols, PROTOCOLS),
+        ("window", args.windows, [16]),
+        ("delay_ms", args.delays, [0]),
+        ("loss", args.losses, [0]),
+        ("timeout_ms", args.timeouts, [None]),
+    ]:
+        if value is not None or name not in sweep:
+            sweep[name] = value or default
+    rate = args.rate or sweep.get("rate")
+    rate_bps = parse_rate(rate) if rate else None
+
+    results = benchmark(
+        configurations(sweep), args.file, args.iterations, rate_bps, args.seed
+    )
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.csv:
+        with open(args.csv, "w", newline="") as f:
+            write_csv(results, f)
+    if not args.json and not args.csv:
+        write_csv(results, sys.stdout)
+
+    # Without a baseline only lost transfers fail the benchmark
+    baseline = {"summary": []}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    messages = regressions(results, baseline, args.max_regression)
+    for message in messages:
+        print(message, file=sys.stderr)
+    sys.exit(1 if messages else 0)
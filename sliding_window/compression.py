@@ -0,0 +1,113 @@
+# Optional compression between the file and the protocol senders. The file is compressed as
+# one stream while it is sent and the stream is cut into packets, so the number of packets is
+# only known once the compressor is done. Every packet of a compressed transfer carries the
+# COMPRESSED flag, which is how the receiver knows to decompress as it writes in order.
+import lzma
+import zlib
+from utils import log, map_file, send_payloads, PACKET_SIZE
+
+# Compressed streams by the command line name of their method
+COMPRESSORS = {
+    "zlib": lambda: zlib.compressobj(6),
+    "lzma": lambda: lzma.LZMACompressor(preset=1),
+}
+# The start of an xz stream, zlib streams never start with it
+LZMA_MAGIC = b"\xfd7zXZ\x00"
+# Bytes handed to the compressor at a time
+CHUNK_SIZE = 64 * 1024
+# How much of the file is compressed up front to decide whether it is worth it
+SAMPLE_SIZE = 256 * 1024
+# Compression that saves less than this is not worth the CPU time
+MIN_SAVING = 0.1
+
+
+def worth_compressing(file_view: memoryview, method: str) -> bool:
+    """Compresses the start of the file and returns True if that saved enough"""
+    sample = file_view[:SAMPLE_SIZE]
+    if len(sample) == 0:
+        return False
+    compressor = COMPRESSORS[method]()
+    size = len(compressor.compress(sample)) + len(compressor.flush())
+    log(f"Compressed sample: {size} of {len(sample)}")
+    return size <= (1 - MIN_SAVING) * len(sample)
+
+
+def compressed_payloads(file_view: memoryview, method: str, packet_size: int):
+    """
+    Yields the compressed stream of the file in packets of packet_size bytes.
+    They are writable like the mapped file, send_batch() needs that for resends
+    """
+    compressor = COMPRESSORS[method]()
+    pending = bytearray()
+    for start in range(0, len(file_view), CHUNK_SIZE):
+        pending += compressor.compress(file_view[start : start + CHUNK_SIZE])
+        while len(pending) >= packet_size:
+            yield pending[:packet_size]
+            del pending[:packet_size]
+    pending += compressor.flush()
+    while len(pending) > packet_size:
+        yield pending[:packet_size]
+        del pending[:packet_size]
+    yield pending
+
+
+def send_compressed(
+    filename: str,
+    sender,
+    method: str,
+    packet_size: int = PACKET_SIZE,
+    offset: int = 0,
+):
+    """
+    Like utils.send_file, but sends the file compressed with method.
+    The sender has to set the COMPRESSED flag on its packets and is told its total_packets
+    once the last packet is known, see utils.send_payloads.
+    """
+    send_payloads(
+        compressed_payloads(map_file(filename)[offset:], method, packet_size), sender
+    )
+
+
+class DecompressingWriter:
+    """
+    Wraps the output file of a receiver and decompresses what is written to it.
+    Only works for data written in order.
+    """
+
+    def __init__(self, output_file):
+        self.output_file = output_file
+        self.decompressor = None
+        # The start of the stream until it tells us the method
+        self.start = b""
+
+    def write(self, data: memoryview):
+        if self.decompressor is None:
+            # The sender does not tell us the method, but the stream does
+            self.start += data
+            if len(self.start) < len(LZMA_MAGIC):
+                return
+            if self.start.startswith(LZMA_MAGIC):
+                self.decompressor = lzma.LZMADecompressor()
+            else:
+                self.decompressor = zlib.decompressobj()
+            data = self.start
+        self.output_file.write(self.decompressor.decompress(data))
+
+    def close(self):
+        # lzma decompressors hold nothing back, zlib ones might
+        if self.decompressor is not None and hasattr(self.decompressor, "flush"):
+            self.output_file.write(self.decompressor.flush())
+        self.output_file.close()
+
+    def flush(self):
+        self.output_file.flush()
+
+    def tell(self) -> int:
+        return self.output_file.tell()
+
+    def fileno(self) -> int:
+        return self.output_file.fileno()
+
+    @property
+    def closed(self) -> bool:
+        return self.output_file.closed
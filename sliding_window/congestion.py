@@ -0,0 +1,175 @@
+# Congestion control and pacing for the windowed senders. A controller decides how many packets
+# may be in flight, the window size given by the user only caps it. None of these are thread
+# safe, the senders call them with their lock held.
+import time
+
+# Initial window of the loss based controllers in packets, as in RFC 3390 for 1 KB packets
+INITIAL_WINDOW = 4
+# Smoothing of the RTT used for pacing, as for the retransmission timeout
+RTT_ALPHA = 1 / 8
+# Pace faster than the window per RTT so that the pacer never limits the window (as Linux does)
+SLOW_START_PACING_GAIN = 2.0
+PACING_GAIN = 1.2
+
+
+class FixedWindow:
+    """
+    Always allows the whole window, which is what the senders did without congestion control.
+    Also the base of the other controllers.
+    """
+
+    def __init__(self, max_window: int):
+        """
+        Params:
+            max_window: The window size given by the user
+        """
+        self.max_window = max_window
+        self.cwnd = float(max_window)
+        self.ssthresh = float(max_window)
+        self.srtt = None
+
+    def window(self) -> int:
+        """Returns the number of packets that may be in flight"""
+        return max(1, min(self.max_window, int(self.cwnd)))
+
+    def pacing_rate(self):
+        """Returns the packets per second to pace at, None before the first RTT sample"""
+        if self.srtt is None:
+            return None
+        gain = SLOW_START_PACING_GAIN if self.cwnd < self.ssthresh else PACING_GAIN
+        return gain * self.window() / max(self.srtt, 1e-6)
+
+    def on_ack(self, acked: int, rtt_s: float = None):
+        """
+        Params:
+            acked: The number of packets newly acknowledged
+            rtt_s: An RTT sample, only for packets that were not retransmitted
+        """
+        if rtt_s is not None:
+            if self.srtt is None:
+                self.srtt = rtt_s
+            else:
+                self.srtt += RTT_ALPHA * (rtt_s - self.srtt)
+        self.increase(acked, rtt_s)
+
+    def increase(self, acked: int, rtt_s: float = None):
+        pass
+
+    def on_loss(self):
+        """A packet was lost, but others still get through"""
+        pass
+
+    def on_timeout(self):
+        """Nothing was acknowledged for a whole retransmission timeout"""
+        pass
+
+
+class Reno(FixedWindow):
+    """
+    AIMD as in TCP Reno (RFC 5681): slow start doubles the window every round trip up to
+    ssthresh, then it grows by one packet per round trip. A loss halves the window and a
+    timeout starts over from a single packet.
+    """
+
+    def __init__(self, max_window: int):
+        super().__init__(max_window)
+        self.cwnd = float(min(INITIAL_WINDOW, max_window))
+
+    def increase(self, acked: int, rtt_s: float = None):
+        for _ in range(acked):
+            if self.cwnd < self.ssthresh:
+                self.cwnd += 1
+            else:
+                self.cwnd += 1 / self.cwnd
+        # Growing past the cap would only delay the reaction to the next loss
+        self.cwnd = min(self.cwnd, float(self.max_window))
+
+    def on_loss(self):
+        self.ssthresh = max(self.cwnd / 2, 2.0)
+        self.cwnd = self.ssthresh
+
+    def on_timeout(self):
+        self.ssthresh = max(self.cwnd / 2, 2.0)
+        self.cwnd = 1.0
+
+
+class Vegas(Reno):
+    """
+    Delay based congestion avoidance (TCP Vegas). Once per round trip it estimates how many
+    packets are queued at the bottleneck from how much the RTT grew above the lowest one seen.
+    The window grows by one packet while fewer than ALPHA packets are queued and shrinks by one
+    while more than BETA are, so it backs off before the queue overflows. Losses are handled
+    like Reno.
+    """
+
+    ALPHA = 2
+    BETA = 4
+
+    def __init__(self, max_window: int):
+        super().__init__(max_window)
+        self.base_rtt = None
+        self.round_rtt = None
+        self.acked_this_round = 0
+
+    def increase(self, acked: int, rtt_s: float = None):
+        if rtt_s is not None:
+            self.base_rtt = (
+                rtt_s if self.base_rtt is None else min(self.base_rtt, rtt_s)
+            )
+            self.round_rtt = (
+                rtt_s if self.round_rtt is None else min(self.round_rtt, rtt_s)
+            )
+        if self.cwnd < self.ssthresh:
+            super().increase(acked, rtt_s)
+
+        # Only adjust once per round trip
+        self.acked_this_round += acked
+        if self.acked_this_round < self.cwnd or self.round_rtt is None:
+            return
+        queued = self.cwnd * (1 - self.base_rtt / self.round_rtt)
+        self.acked_this_round = 0
+        self.round_rtt = None
+        if self.cwnd < self.ssthresh:
+            # Leave slow start as soon as a queue builds up
+            if queued > self.BETA:
+                self.ssthresh = self.cwnd
+        elif queued < self.ALPHA:
+            self.cwnd = min(self.cwnd + 1, float(self.max_window))
+        elif queued > self.BETA:
+            self.cwnd = max(self.cwnd - 1, 2.0)
+
+
+CONTROLLERS = {"fixed": FixedWindow, "reno": Reno, "vegas": Vegas}
+
+
+class TokenBucket:
+    """
+    Spaces sends out at a rate in packets per second, allowing bursts of up to burst packets
+    """
+
+    def __init__(self, burst: int = 2):
+        self.burst = burst
+        self.tokens = float(burst)
+        self.last_refill = time.monotonic()
+
+    def delay(self, rate) -> float:
+        """
+        Returns how long to wait before the next packet may be sent.
+        Params:
+            rate: The packets per second to pace at, None to not pace at all
+        """
+        now = time.monotonic()
+        if rate is None:
+            self.tokens = float(self.burst)
+            self.last_refill = now
+            return 0.0
+        self.tokens = min(
+            float(self.burst), self.tokens + (now - self.last_refill) * rate
+        )
+        self.last_refill = now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / rate
+
+    def consume(self):
+        self.tokens -= 1
@@ -0,0 +1,201 @@
+# Forward error correction with XOR parity. The sender splits the packets into groups of k
+# and sends m parity packets after each group, parity packet j is the XOR of the packets
+# j, j + m, j + 2m, ... of the group. The receiver rebuilds a lost packet from its parity and
+# the other packets it covers, so up to m losses per group are repaired without waiting for a
+# retransmission, as long as they are covered by different parity packets.
+#
+# A parity packet carries the sequence number of the first packet of its group, the FEC flag
+# and the flags of the data packets, it is neither acknowledged nor retransmitted and does
+# not take up the window. The data packets carry the FEC_DATA flag, so the receiver keeps
+# them for repairs from the first packet on instead of only once it saw parity.
+import struct
+from utils import (
+    log,
+    HEADER_SIZE,
+    HEADER_FORMAT,
+    EOF_FLAG,
+    FEC_FLAG,
+    FEC_DATA_FLAG,
+    wire_seq_num,
+    unwrap_seq_num,
+)
+from tracing import trace, FEC_REBUILT
+
+# Packets in the group, parity packets of the group, which one this is, whether the group
+# ends the file and the XOR of the payload lengths
+FEC_FORMAT = "!BBBBH"
+FEC_SIZE = struct.calcsize(FEC_FORMAT)
+# Bounds of the adaptive group size and parity count
+MIN_GROUP_SIZE = 4
+MAX_GROUP_SIZE = 64
+MAX_PARITY = 4
+# Groups without retransmissions before the redundancy is lowered again
+CLEAN_GROUPS = 8
+
+
+def xor_parity(payloads: list):
+    """Returns the XOR of the payloads, padded with zeros to the longest one"""
+    parity = 0
+    size = 0
+    for payload in payloads:
+        # Little endian, so the shorter payloads are padded at their end
+        parity ^= int.from_bytes(payload, "little")
+        size = max(size, len(payload))
+    return parity.to_bytes(size, "little")
+
+
+class FecSender:
+    """
+    Wraps GoBackN or SlidingWindow and sends parity packets along with the data. It has the
+    same send() so it can be passed to send_file() instead of the sender.
+    """
+
+    def __init__(self, sender, group_size: int = None, parity: int = None):
+        """
+        Params:
+            sender: The sender to wrap, only used through send(), seq_num, sock, flags and
+                total_retransmissions
+            group_size, parity: Send parity packets for every group_size packets. If they
+                are None they are tuned from the retransmissions the sender still needs
+        """
+        self.sender = sender
+        # Tell the receiver to keep the data packets for repairs
+        sender.flags |= FEC_DATA_FLAG
+        self.adaptive = group_size is None or parity is None
+        self.group_size = group_size or 16
+        self.parity = parity or 1
+        # (logical index, payload) of the packets of the current group
+        self.group = []
+        self.total_parity_packets = 0
+        self.last_retransmissions = 0
+        self.clean_groups = 0
+
+    @property
+    def total_packets(self) -> int:
+        return self.sender.total_packets
+
+    @total_packets.setter
+    def total_packets(self, total_packets: int):
+        # Set by send_payloads() once the last packet is known
+        self.sender.total_packets = total_packets
+
+    def send(self, data: memoryview, eof_flag: bool) -> bool:
+        index = self.sender.seq_num.index
+        if not self.sender.send(data, eof_flag):
+            return False
+        self.group.append((index, data))
+        if len(self.group) >= self.group_size or eof_flag:
+            self.send_parity(eof_flag)
+        return True
+
+    def send_parity(self, eof_flag: bool):
+        """Send the parity packets of the current group and start the next one"""
+        start = self.group[0][0]
+        parity = min(self.parity, len(self.group))
+        header = struct.pack(
+            HEADER_FORMAT, wire_seq_num(start), FEC_FLAG | self.sender.flags
+        )
+        for j in range(parity):
+            payloads = [data for _, data in self.group[j::parity]]
+            length_xor = 0
+            for payload in payloads:
+                length_xor ^= len(payload)
+            fec_header = struct.pack(
+                FEC_FORMAT, len(self.group), parity, j, eof_flag, length_xor
+            )
+            try:
+                self.sender.sock.sendmsg([header, fec_header, xor_parity(payloads)])
+            except ConnectionRefusedError:
+                # The sender notices this itself
+                break
+            self.total_parity_packets += 1
+        self.group = []
+        if self.adaptive:
+            self.tune()
+
+    def tune(self):
+        """
+        Retransmissions mean the parity did not repair every loss, so add redundancy right
+        away. After a while without any, take some away again.
+        """
+        retransmissions = self.sender.total_retransmissions
+        if retransmissions > self.last_retransmissions:
+            self.clean_groups = 0
+            if self.group_size > MIN_GROUP_SIZE:
+                self.group_size = max(MIN_GROUP_SIZE, self.group_size // 2)
+            else:
+                self.parity = min(MAX_PARITY, self.parity + 1)
+            log(f"FEC: {self.group_size} {self.parity}")
+        else:
+            self.clean_groups += 1
+            if self.clean_groups >= CLEAN_GROUPS:
+                self.clean_groups = 0
+                if self.parity > 1:
+                    self.parity -= 1
+                else:
+                    self.group_size = min(MAX_GROUP_SIZE, self.group_size + 4)
+                log(f"FEC: {self.group_size} {self.parity}")
+        self.last_retransmissions = retransmissions
+
+
+class FecDecoder:
+    """
+    Keeps the recently received packets of a receiver and rebuilds lost ones from parity.
+    Packets are only kept if the sender flagged them as covered by parity.
+    """
+
+    def __init__(self):
+        # Packets by logical index, copied as the receive buffers are reused
+        self.packets = {}
+        # Flags of the data packets, the same for every packet but the EOF packet
+        self.flags = 0
+
+    def add_data(self, index: int, packet: memoryview, base: int):
+        """
+        Remember a received data packet.
+        Params:
+            base: The receiver's base, a group never reaches further back than MAX_GROUP_SIZE
+        """
+        _, flags = struct.unpack_from(HEADER_FORMAT, packet)
+        if not flags & FEC_DATA_FLAG:
+            return
+        self.flags = flags & ~EOF_FLAG
+        self.packets[index] = bytes(packet)
+        if len(self.packets) > 4 * MAX_GROUP_SIZE:
+            for old in [i for i in self.packets if i < base - MAX_GROUP_SIZE]:
+                del self.packets[old]
+
+    def add_parity(self, packet: memoryview, base: int) -> list:
+        """
+        Returns the packets that could be rebuilt with the parity packet, as (index, packet)
+        """
+        if len(packet) < HEADER_SIZE + FEC_SIZE:
+            return []
+        seq_num, parity_flags = struct.unpack_from(HEADER_FORMAT, packet)
+        count, parity, j, eof_flag, length_xor = struct.unpack_from(
+            FEC_FORMAT, packet, HEADER_SIZE
+        )
+        start = unwrap_seq_num(seq_num, base)
+        covered = range(start + j, start + count, parity)
+        missing = [index for index in covered if index not in self.packets]
+        # Already complete, or more lost than one parity packet can repair
+        if len(missing) != 1 or missing[0] < base:
+            return []
+        (index,) = missing
+
+        payloads = [packet[HEADER_SIZE + FEC_SIZE :]]
+        for other in covered:
+            if other != index:
+                payload = memoryview(self.packets[other])[HEADER_SIZE:]
+                payloads.append(payload)
+                length_xor ^= len(payload)
+        data = xor_parity(payloads)[:length_xor]
+        # The parity knows the flags of the sender even if no data packet arrived yet,
+        # the data packets may add some of their own like SACK
+        flags = self.flags | (parity_flags & ~FEC_FLAG)
+        if eof_flag and index == start + count - 1:
+            flags |= EOF_FLAG
+        trace(FEC_REBUILT, index, base)
+        rebuilt = struct.pack(HEADER_FORMAT, wire_seq_num(index), flags) + data
+        self.packets[index] = rebuilt
+        return [(index, rebuilt)]
@@ -0,0 +1,125 @@
+# Per-transfer metrics of the senders, to tell why a transfer was slow: retransmission
+# timeouts, a window that stays full, or a sender blocked waiting for acknowledgments.
+# Every sender records into a TransferMetrics as it goes. The timeline is only sampled every
+# interval_s, so the cost per acknowledgment is a clock read and a comparison.
+import csv
+import json
+import time
+
+# Columns of the timeline
+TIMELINE_FIELDS = [
+    "time_s",
+    "acked_packets",
+    "acked_bytes",
+    "in_flight",
+    "window",
+    "goodput_kbps",
+]
+
+
+class TransferMetrics:
+    def __init__(self, interval_s: float = 0.01):
+        """
+        Params:
+            interval_s: How often the timeline is sampled at most
+        """
+        self.interval_s = interval_s
+        self.start = time.monotonic()
+        self.next_sample = self.start
+        # (seconds since the start, RTT in seconds)
+        self.rtt_samples = []
+        # Retransmissions by logical packet index, packets sent once are not listed
+        self.retransmissions = {}
+        # Total time send() waited for the window, the pacer or an acknowledgment
+        self.blocked_s = 0.0
+        # (seconds since the start, acknowledged packets and bytes, packets in flight, window)
+        self.timeline = []
+        # The same for the latest acknowledgment, which may not have been sampled
+        self.latest = (0.0, 0, 0, 0, 0)
+
+    def rtt(self, rtt_s: float):
+        self.rtt_samples.append((time.monotonic() - self.start, rtt_s))
+
+    def retransmit(self, index: int):
+        self.retransmissions[index] = self.retransmissions.get(index, 0) + 1
+
+    def blocked(self, seconds: float):
+        self.blocked_s += seconds
+
+    def acknowledged(self, packets: int, size: int, in_flight: int, window: int):
+        """
+        Record newly acknowledged packets and the state of the window afterwards
+        Params:
+            packets, size: How many packets and payload bytes were acknowledged
+        """
+        now = time.monotonic()
+        _, acked_packets, acked_bytes, _, _ = self.latest
+        self.latest = (
+            now - self.start,
+            acked_packets + packets,
+            acked_bytes + size,
+            in_flight,
+            window,
+        )
+        if now >= self.next_sample:
+            self.next_sample = now + self.interval_s
+            self.timeline.append(self.latest)
+
+    def goodput_timeline(self) -> list:
+        """Returns the timeline with the goodput in KB/s since the previous sample"""
+        timeline = self.timeline
+        if self.latest[1] > 0 and (not timeline or timeline[-1] != self.latest):
+            timeline = timeline + [self.latest]
+        rows = []
+        last_time, last_bytes = 0.0, 0
+        for time_s, acked_packets, acked_bytes, in_flight, window in timeline:
+            elapsed = time_s - last_time
+            goodput = (
+                (acked_bytes - last_bytes) / elapsed / 1024 if elapsed > 0 else 0.0
+            )
+            rows.append(
+                (time_s, acked_packets, acked_bytes, in_flight, window, goodput)
+            )
+            last_time, last_bytes = time_s, acked_bytes
+        return rows
+
+    def summary(self) -> dict:
+        # The transfer ended with its last acknowledgment
+        duration_s, acked_packets, acked_bytes, _, _ = self.latest
+        rtts = sorted(rtt for _, rtt in self.rtt_samples)
+        return {
+            "duration_s": duration_s,
+            "acked_packets": acked_packets,
+            "acked_bytes": acked_bytes,
+            "goodput_kbps": acked_bytes / duration_s / 1024 if duration_s > 0 else 0.0,
+            "retransmissions": sum(self.retransmissions.values()),
+            "retransmitted_packets": len(self.retransmissions),
+            "max_retransmissions": max(self.retransmissions.values(), default=0),
+            "blocked_s": self.blocked_s,
+            "rtt_samples": len(rtts),
+            "rtt_min_s": rtts[0] if rtts else None,
+            "rtt_median_s": rtts[len(rtts) // 2] if rtts else None,
+            "rtt_max_s": rtts[-1] if rtts else None,
+        }
+
+    def to_dict(self) -> dict:
+        return {
+            "summary": self.summary(),
+            "rtt_samples": self.rtt_samples,
+            # JSON keys are strings anyway
+            "retransmissions": {str(i): n for i, n in self.retransmissions.items()},
+            "timeline": [
+                dict(zip(TIMELINE_FIELDS, row)) for row in self.goodput_timeline()
+            ],
+        }
+
+    def write_json(self, path: str):
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    def write_csv(self, path: str):
+        """Write the timeline, one row per sample"""
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(TIMELINE_FIELDS)
+            writer.writerows(self.goodput_timeline())
@@ -0,0 +1,122 @@
+# Path MTU probing: finds the largest packet that reaches the receiver in a single datagram.
+# Probes are sent with the don't fragment bit set, a probe that is too large for the path is
+# either rejected by our kernel (EMSGSIZE) or dropped on the way, so it is never answered.
+# The receivers answer every packet with the PROBE flag by echoing its header.
+import errno
+import socket
+import struct
+import sys
+import time
+from utils import (
+    log,
+    PACKET_SIZE,
+    MAX_PACKET_SIZE,
+    HEADER_SIZE,
+    HEADER_FORMAT,
+    PROBE_FLAG,
+)
+
+# From <linux/in.h>, Python does not export them
+IP_MTU_DISCOVER = 10
+IP_PMTUDISC_DO = 2
+IP_MTU = 14
+PMTUDISC_AVAILABLE = sys.platform.startswith("linux")
+# IPv4 and UDP headers
+IP_UDP_OVERHEAD = 28
+
+
+def answer_probe(sock: socket.socket, packet: memoryview, addr) -> bool:
+    """
+    Answers the packet if it is a probe. Returns True if it was one, receivers drop it then
+    """
+    if len(packet) < HEADER_SIZE:
+        return False
+    _, flags = struct.unpack_from(HEADER_FORMAT, packet)
+    if not flags & PROBE_FLAG:
+        return False
+    sock.sendto(packet[:HEADER_SIZE], addr)
+    return True
+
+
+def path_mtu(sock: socket.socket):
+    """Returns the path MTU the kernel knows for a connected socket, None if it cannot tell"""
+    if not PMTUDISC_AVAILABLE:
+        return None
+    try:
+        return sock.getsockopt(socket.IPPROTO_IP, IP_MTU)
+    except OSError:
+        return None
+
+
+class Prober:
+    def __init__(self, sock: socket.socket, timeout_s: float, attempts: int):
+        self.sock = sock
+        self.timeout_s = timeout_s
+        self.attempts = attempts
+        self.probe_id = 0
+        self.padding = memoryview(bytes(MAX_PACKET_SIZE))
+
+    def probe(self, size: int) -> bool:
+        """Returns True if a probe with size bytes of padding was answered"""
+        for _ in range(self.attempts):
+            header = struct.pack(HEADER_FORMAT, self.probe_id, PROBE_FLAG)
+            self.probe_id = (self.probe_id + 1) % 2**16
+            try:
+                self.sock.sendmsg([header, self.padding[:size]])
+            except OSError as e:
+                if e.errno == errno.EMSGSIZE:
+                    return False
+                raise
+            deadline = time.monotonic() + self.timeout_s
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.sock.settimeout(remaining)
+                try:
+                    reply = self.sock.recv(HEADER_SIZE)
+                except socket.timeout:
+                    break
+                # Answers to earlier attempts arrive late, only this one counts
+                if reply == header:
+                    return True
+        return False
+
+
+def probe_packet_size(
+    host: str,
+    port: int,
+    max_packet_size: int = MAX_PACKET_SIZE,
+    timeout_s: float = 0.1,
+    attempts: int = 3,
+) -> int:
+    """
+    Binary search for the largest packet size up to max_packet_size that gets through.
+    PACKET_SIZE is assumed to always get through, as the kernel fragments what does not fit.
+    Params:
+        timeout_s: How long to wait for the answer to a probe
+        attempts: How often a probe is sent before we assume its size does not get through
+    Returns:
+        The payload size to use for the transfer
+    """
+    # A socket of its own, so no late answer can be mistaken for an acknowledgment
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.connect((host, port))
+        if PMTUDISC_AVAILABLE:
+            sock.setsockopt(socket.IPPROTO_IP, IP_MTU_DISCOVER, IP_PMTUDISC_DO)
+        prober = Prober(sock, timeout_s, attempts)
+        low = min(PACKET_SIZE, max_packet_size)
+        high = max_packet_size
+        while low < high:
+            size = (low + high + 1) // 2
+            if prober.probe(size):
+                low = size
+                continue
+            high = size - 1
+            # An ICMP fragmentation needed message tells the kernel the path MTU
+            mtu = path_mtu(sock)
+            if mtu is not None:
+                high = max(1, min(high, mtu - IP_UDP_OVERHEAD - HEADER_SIZE))
+                low = min(low, high)
+    log(f"Probed packet size: {low}")
+    return low
@@ -0,0 +1,144 @@
+# Resumable transfers. The receiver records in a checkpoint file how many bytes at the start
+# of the output file are complete. When it is restarted with the same output file it keeps
+# those bytes, and a sender that asks with a RESUME packet only sends the rest of the file,
+# as a new transfer whose packet 0 starts at that offset.
+import os
+import socket
+import struct
+import time
+from utils import log, HEADER_SIZE, HEADER_FORMAT, RESUME_FLAG
+
+CHECKPOINT_MAGIC = b"SWCK"
+# Magic and the number of complete bytes
+CHECKPOINT_FORMAT = "!4sQ"
+# The answer to a RESUME packet is its header followed by the offset to resume from
+RESUME_FORMAT = "!Q"
+RESUME_SIZE = struct.calcsize(RESUME_FORMAT)
+
+
+class Checkpoint:
+    """
+    The checkpoint file of a receiver. It only records the contiguous prefix that is complete,
+    so a resumed transfer sends at most a window of packets again that was already written.
+    """
+
+    def __init__(self, path: str, interval_s: float = 1.0):
+        """
+        Params:
+            path: Where to keep the checkpoint
+            interval_s: How often progress is saved while receiving
+        """
+        self.path = path
+        self.interval_s = interval_s
+        self.saved_offset = None
+        self.next_save = None
+
+    def load(self):
+        """Returns the number of complete bytes, None if there is no valid checkpoint"""
+        try:
+            with open(self.path, "rb") as f:
+                magic, offset = struct.unpack(CHECKPOINT_FORMAT, f.read())
+        except (OSError, struct.error):
+            return None
+        if magic != CHECKPOINT_MAGIC:
+            return None
+        self.saved_offset = offset
+        return offset
+
+    def open_output(self, filename: str):
+        """
+        Opens the output file, keeping what the checkpoint says is complete.
+        Returns the file and the offset the transfer resumes from
+        """
+        offset = self.load()
+        if offset is None or not os.path.exists(filename):
+            return open(filename, "wb"), 0
+        output_file = open(filename, "r+b")
+        # Whatever comes after the checkpoint may be incomplete
+        offset = min(offset, os.fstat(output_file.fileno()).st_size)
+        output_file.truncate(offset)
+        output_file.seek(offset)
+        log(f"Resuming at {offset}")
+        return output_file, offset
+
+    def save(self, output_file, offset: int):
+        """Record that the first offset bytes of the output file are complete"""
+        if offset == self.saved_offset:
+            return
+        # The data has to be on disk before the checkpoint says so
+        output_file.flush()
+        os.fsync(output_file.fileno())
+        temporary = self.path + ".tmp"
+        with open(temporary, "wb") as f:
+            f.write(struct.pack(CHECKPOINT_FORMAT, CHECKPOINT_MAGIC, offset))
+        os.replace(temporary, self.path)
+        self.saved_offset = offset
+
+    def update(self, receiver):
+        """Save the progress of a receiver if the interval has passed since the last save"""
+        now = time.monotonic()
+        if self.next_save is None:
+            self.next_save = now + self.interval_s
+        elif now >= self.next_save:
+            self.save(receiver.output_file, receiver.delivered())
+            self.next_save = None
+
+    def timeout(self):
+        """Returns the seconds until progress is due to be saved, None if nothing is pending"""
+        if self.next_save is None:
+            return None
+        return max(0.0, self.next_save - time.monotonic())
+
+    def close(self, receiver, done: bool):
+        """Forget the checkpoint of a complete transfer, save it otherwise"""
+        if done:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+        elif not receiver.output_file.closed:
+            self.save(receiver.output_file, receiver.delivered())
+
+
+def answer_resume(sock: socket.socket, packet: memoryview, addr, offset: int) -> bool:
+    """
+    Answers the packet with the offset to resume from if it is a RESUME packet.
+    Returns True if it was one, receivers drop it then
+    """
+    if len(packet) < HEADER_SIZE:
+        return False
+    _, flags = struct.unpack_from(HEADER_FORMAT, packet)
+    if not flags & RESUME_FLAG:
+        return False
+    sock.sendto(bytes(packet[:HEADER_SIZE]) + struct.pack(RESUME_FORMAT, offset), addr)
+    return True
+
+
+def query_resume_offset(
+    host: str, port: int, timeout_s: float = 0.1, attempts: int = 10
+) -> int:
+    """
+    Asks the receiver how many bytes of the file it already has.
+    Returns 0 if it does not answer, the transfer then starts over
+    """
+    # A socket of its own, so no late answer can be mistaken for an acknowledgment
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.connect((host, port))
+        sock.settimeout(timeout_s)
+        header = struct.pack(HEADER_FORMAT, 0, RESUME_FLAG)
+        for _ in range(attempts):
+            try:
+                sock.send(header)
+                reply = sock.recv(HEADER_SIZE + RESUME_SIZE)
+            except socket.timeout:
+                continue
+            except ConnectionRefusedError:
+                break
+            if (
+                len(reply) == HEADER_SIZE + RESUME_SIZE
+                and reply[:HEADER_SIZE] == header
+            ):
+                (offset,) = struct.unpack_from(RESUME_FORMAT, reply, HEADER_SIZE)
+                log(f"Resuming at {offset}")
+                return offset
+    return 0
@@ -0,0 +1,129 @@
+# Transfers from and to data that is not a file on disk. A source is an iterable of bytes-like
+# chunks, or a binary file object or pipe that is read until it runs dry. Its length does not
+# have to be known up front: the sender is created with UNKNOWN_PACKET_COUNT, the last packet
+# carries the EOF flag as always and the sender is told its total_packets once the source is
+# exhausted.
+#
+# On the receiving side a sink takes the place of the output file of Receiver3 and Receiver4.
+# CallbackSink hands the data to a function as it is written in order, AsyncSink lets a
+# coroutine iterate over it with "async for" while the receiver runs in a thread. Sinks have
+# no file descriptor, so they do not work in pwrite mode or with a checkpoint.
+import asyncio
+import threading
+from utils import send_payloads, PACKET_SIZE
+
+# Bytes read from a file object at a time
+READ_SIZE = 64 * 1024
+# Chunks an AsyncSink holds before the receiver waits for the consumer
+MAX_PENDING_CHUNKS = 1024
+
+
+def chunks(source):
+    """Returns an iterator over the chunks of a source"""
+    if hasattr(source, "read"):
+        # read1() returns what a pipe has so far instead of waiting for a full READ_SIZE
+        read = getattr(source, "read1", source.read)
+        return iter(lambda: read(READ_SIZE), b"")
+    return iter(source)
+
+
+def packets(source, packet_size: int = PACKET_SIZE):
+    """
+    Yields the data of a source in packets of packet_size bytes. Only the last one is shorter,
+    and only empty if the source was. They are writable, send_batch() needs that for resends
+    """
+    pending = bytearray()
+    for chunk in chunks(source):
+        pending += chunk
+        # Keep a full packet back, it is the last one if the source ends here
+        while len(pending) > packet_size:
+            yield pending[:packet_size]
+            del pending[:packet_size]
+    yield pending
+
+
+def send_stream(source, sender, packet_size: int = PACKET_SIZE) -> int:
+    """
+    Like utils.send_file, but sends whatever a source yields until it is exhausted.
+    The sender should be created with UNKNOWN_PACKET_COUNT as its total_packets.
+    Returns the number of bytes sent
+    """
+    return send_payloads(packets(source, packet_size), sender)
+
+
+class CallbackSink:
+    """
+    Output file of a receiver that hands the data to a function as it is written in order.
+    The data may be a view into the receive buffer, which is only valid during the call
+    """
+
+    def __init__(self, callback, on_close=None):
+        """
+        Params:
+            callback: Called with every chunk of data
+            on_close: Called once the receiver is done
+        """
+        self.callback = callback
+        self.on_close = on_close
+        self.size = 0
+        self.closed = False
+
+    def write(self, data: memoryview):
+        self.size += len(data)
+        self.callback(data)
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            if self.on_close is not None:
+                self.on_close()
+
+    def flush(self):
+        pass
+
+    def tell(self) -> int:
+        return self.size
+
+
+class AsyncSink(CallbackSink):
+    """
+    Output file of a receiver running in another thread, iterate over it with "async for" to
+    get the data as bytes. Has to be created in the thread of the event loop. The receiver
+    waits once max_pending chunks are not consumed yet, so stop consuming only after the end
+    """
+
+    def __init__(self, max_pending: int = MAX_PENDING_CHUNKS):
+        super().__init__(self.put, self.put_end)
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue()
+        self.slots = threading.Semaphore(max_pending)
+
+    def put(self, data: memoryview):
+        self.slots.acquire()
+        # The receiver reuses its buffers, copy before handing the data to the other thread
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, bytes(data))
+
+    def put_end(self):
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, None)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> bytes:
+        data = await self.queue.get()
+        if data is None:
+            raise StopAsyncIteration
+        self.slots.release()
+        return data
+
+    async def receive(self, receive_packets, receiver):
+        """
+        Runs receive_packets(receiver) in a thread and yields what it writes to this sink,
+        which has to be the output file of the receiver. Raises what the receiver raised
+        """
+        thread = asyncio.ensure_future(asyncio.to_thread(receive_packets, receiver))
+        # Ends the iteration if the receiver failed before closing its output file
+        thread.add_done_callback(lambda _: self.close())
+        async for data in self:
+            yield data
+        await thread
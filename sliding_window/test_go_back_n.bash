@@ -6,19 +6,22 @@ iterations=5
 
 # Define window sizes as powers of 2 from 1 to 256
 window_sizes=(1 2 4 8 16 32 64 128 256)
+# Extra sender options, e.g. "--dup-ack-threshold 0" to only resend on timeouts
+sender_args=${SENDER_ARGS:-}
 
 for value in "${test_values[@]}"; do
     echo "----------------------------"
     echo "Testing with parameter value: $value"
     
-    # Set up the network conditions
-    sudo tc qdisc del dev lo root
-    sudo tc qdisc add dev lo root netem loss 5% delay $value rate 10mbit
+    # Set up the network conditions, the sender sends through the emulator
+    python3 NetworkEmulator.py 12346 localhost 12345 --loss 5 --delay $value --rate 10mbit &
+    emulator_pid=$!
 
     for window_size in "${window_sizes[@]}"; do
         echo ">> Testing with window size: $window_size"
         
         total_total_throughput=0
+        total_fast_retransmits=0
         
         for i in $(seq 1 $iterations); do
             echo "  Iteration $i for value $value with window size $window_size"
@@ -31,7 +34,7 @@ for value in "${test_values[@]}"; do
             sleep 0.5
 
             # Run Sender3.py in the background and redirect its output to a temporary file
-            python3 Sender3.py localhost 12345 test.jpg $((2 * value + 10)) $window_size > sender_output.txt &
+            python3 Sender3.py localhost 12346 test.jpg $((2 * value + 10)) $window_size $sender_args > sender_output.txt &
             sender_pid=$!
 
             # Wait for both processes to finish
@@ -49,9 +52,11 @@ for value in "${test_values[@]}"; do
             # Extract total_retransmissions and throughput from the output
             echo "$output"
             throughput=$(echo "$output" | awk '{print $1}')
+            fast_retransmits=$(echo "$output" | awk '{print $3}')
             
             echo "    Throughput: $throughput"
             total_total_throughput=$(( total_total_throughput + throughput ))
+            total_fast_retransmits=$(( total_fast_retransmits + fast_retransmits ))
             
             # Check for differences between the files
             if diff abc.png test.jpg > /dev/null; then
@@ -65,9 +70,12 @@ for value in "${test_values[@]}"; do
         
         # Calculate and display averages for the current window size
         avg_throughput=$(( total_total_throughput / iterations ))
+        avg_fast_retransmits=$(( total_fast_retransmits / iterations ))
         
         echo "For parameter value $value and window size $window_size:"
         echo "  Average total throughput: $avg_throughput"
+        echo "  Average fast retransmits: $avg_fast_retransmits"
         echo ""
     done
+    kill $emulator_pid
 done
@@ -3,15 +3,19 @@
 # Define test values and number of iterations per test value
 test_values=(1 2 4 8 16 32)
 iterations=5
+# Extra sender options, e.g. "--congestion-control reno --pacing"
+sender_args=${SENDER_ARGS:-}
 
-sudo tc qdisc del dev lo root
-sudo tc qdisc add dev lo root netem loss 5% delay 25 rate 10mbit
+# Set up the network conditions, the sender sends through the emulator
+python3 NetworkEmulator.py 12346 localhost 12345 --loss 5 --delay 25 --rate 10mbit &
+emulator_pid=$!
 
 for value in "${test_values[@]}"; do
     echo "----------------------------"
     echo "Testing with parameter value: $value"
     
     total_total_throughput=0
+    total_retransmissions=0
     
     for i in $(seq 1 $iterations); do
         echo "Iteration $i for value $value"
@@ -24,7 +28,7 @@ for value in "${test_values[@]}"; do
         sleep 0.5
 
         # Run Sender2.py in the background and redirect its output to a temporary file
-        python3 Sender4.py localhost 12345 test.jpg 60 $value > sender_output.txt &
+        python3 Sender4.py localhost 12346 test.jpg 60 $value $sender_args > sender_output.txt &
         sender_pid=$!
 
         # Wait for both processes to finish
@@ -41,9 +45,12 @@ for value in "${test_values[@]}"; do
 
         # Extract total_retransmissions and throughput from the output
         throughput=$(echo "$output" | awk '{print $1}')
+        retransmissions=$(echo "$output" | awk '{print $2}')
         
         echo "Throughput: $throughput"
+        echo "Retransmissions: $retransmissions"
         total_total_throughput=$(( total_total_throughput + throughput ))
+        total_retransmissions=$(( total_retransmissions + retransmissions ))
         
         # Check for differences between the files
         if diff abc.png test.jpg > /dev/null; then
@@ -57,7 +64,11 @@ for value in "${test_values[@]}"; do
     
     # Calculate and display averages for the current test value
     avg_throughput=$(( total_total_throughput / iterations ))
+    avg_retransmissions=$(( total_retransmissions / iterations ))
     
     echo "For parameter value $value:"
     echo "  Average total throughput: $avg_throughput"
+    echo "  Average retransmissions: $avg_retransmissions"
 done
+
+kill $emulator_pid
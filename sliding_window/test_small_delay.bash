@@ -0,0 +1,71 @@
+#!/bin/bash
+
+# Goodput of Go-Back-N and Selective Repeat at small delays, where waiting
+# for the window to open dominates the transfer time
+
+# Define test values and number of iterations per test value
+test_values=(0 1 2 5)
+iterations=5
+
+# Define window sizes to test
+window_sizes=(1 8 64)
+
+for value in "${test_values[@]}"; do
+    echo "----------------------------"
+    echo "Testing with delay: $value"
+
+    # Set up the network conditions, the sender sends through the emulator
+    python3 NetworkEmulator.py 12346 localhost 12345 --delay $value &
+    emulator_pid=$!
+
+    for window_size in "${window_sizes[@]}"; do
+        for protocol in 3 4; do
+            echo ">> Testing Sender$protocol.py with window size: $window_size"
+
+            total_total_throughput=0
+
+            for i in $(seq 1 $iterations); do
+                rm -f abc.png
+
+                # Run the receiver in the background
+                if [ $protocol -eq 3 ]; then
+                    python3 Receiver3.py 12345 abc.png &
+                else
+                    python3 Receiver4.py 12345 abc.png $window_size &
+                fi
+                receiver_pid=$!
+
+                sleep 0.5
+
+                # Run the sender and redirect its output to a temporary file
+                python3 Sender$protocol.py localhost 12346 test.jpg $((2 * value + 10)) $window_size > sender_output.txt &
+                sender_pid=$!
+
+                # Wait for both processes to finish
+                wait $receiver_pid
+                wait $sender_pid
+
+                # Read the sender output from the file
+                output=$(cat sender_output.txt)
+                rm sender_output.txt
+
+                throughput=$(echo "$output" | awk '{print $1}')
+                echo "    Iteration $i throughput: $throughput"
+                total_total_throughput=$(( total_total_throughput + throughput ))
+
+                # Check for differences between the files
+                if ! diff abc.png test.jpg > /dev/null; then
+                    echo "    Differences found between abc.png and test.jpg"
+                fi
+            done
+
+            # Calculate and display averages for the current window size
+            avg_throughput=$(( total_total_throughput / iterations ))
+
+            echo "For delay $value, Sender$protocol.py and window size $window_size:"
+            echo "  Average total throughput: $avg_throughput"
+            echo ""
+        done
+    done
+    kill $emulator_pid
+done
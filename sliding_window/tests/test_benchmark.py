@@ -0,0 +1,85 @@
+import os
+import pytest
+from benchmark import (
+    benchmark,
+    configurations,
+    percentile,
+    regressions,
+    summarise,
+    write_csv,
+)
+
+
+def test_percentile():
+    assert percentile([3, 1, 2], 50) == 2
+    assert percentile([1, 2, 3, 4, 5], 95) == pytest.approx(4.8)
+    assert percentile([7], 95) == 7
+
+
+def test_summarise():
+    summary = summarise([10, 12, 14])
+    assert summary["mean"] == 12
+    assert summary["median"] == 12
+    assert summary["stdev"] == 2
+    # t = 4.303 for two degrees of freedom
+    assert summary["ci95_low"] == pytest.approx(12 - 4.303 * 2 / 3**0.5)
+    assert summary["ci95_high"] == pytest.approx(12 + 4.303 * 2 / 3**0.5)
+    # One run has no variance to speak of
+    assert summarise([5])["ci95_low"] is None
+    assert summarise([]) == {}
+
+
+def test_configurations():
+    configs = configurations(
+        dict(
+            protocol=["stop_and_wait", "go_back_n"],
+            window=[4, 8],
+            delay_ms=[5],
+            loss=[0],
+            timeout_ms=[None],
+        )
+    )
+    # Stop-and-Wait ignores the window, so it is only run once
+    assert configs == [
+        dict(protocol="stop_and_wait", window=1, delay_ms=5, loss=0, timeout_ms=20),
+        dict(protocol="go_back_n", window=4, delay_ms=5, loss=0, timeout_ms=20),
+        dict(protocol="go_back_n", window=8, delay_ms=5, loss=0, timeout_ms=20),
+    ]
+
+
+def entry(mean, failures=0):
+    config = dict(protocol="go_back_n", window=4, delay_ms=5, loss=0, timeout_ms=20)
+    return {**config, "failures": failures, "throughput": {"mean": mean}}
+
+
+def test_regressions():
+    baseline = {"summary": [entry(1000)]}
+    assert regressions({"summary": [entry(950)]}, baseline, 10) == []
+    assert len(regressions({"summary": [entry(850)]}, baseline, 10)) == 1
+    # A lost transfer fails even without a baseline
+    assert len(regressions({"summary": [entry(1000, 1)]}, {"summary": []}, 10)) == 1
+
+
+def test_benchmark(tmp_path):
+    input_file = tmp_path / "input.bin"
+    input_file.write_bytes(os.urandom(100 * 1024))
+    configs = configurations(
+        dict(
+            protocol=["stop_and_wait", "selective_repeat_sack"],
+            window=[8],
+            delay_ms=[1],
+            loss=[5],
+            timeout_ms=[None],
+        )
+    )
+
+    results = benchmark(configs, str(input_file), 2, None)
+
+    assert len(results["runs"]) == 4
+    assert all(run["intact"] for run in results["runs"])
+    assert all(entry["throughput"]["mean"] > 0 for entry in results["summary"])
+    with open(tmp_path / "results.csv", "w", newline="") as f:
+        write_csv(results, f)
+    header, *rows = (tmp_path / "results.csv").read_text().splitlines()
+    assert "throughput_p95" in header.split(",")
+    assert len(rows) == 2
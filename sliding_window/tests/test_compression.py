@@ -0,0 +1,55 @@
+import io
+import os
+import zlib
+import pytest
+from compression import (
+    DecompressingWriter,
+    compressed_payloads,
+    worth_compressing,
+    SAMPLE_SIZE,
+)
+
+
+class ClosingBytesIO(io.BytesIO):
+    """Keeps the data around after close()"""
+
+    def close(self):
+        self.data = self.getvalue()
+        super().close()
+
+
+def test_worth_compressing():
+    assert worth_compressing(memoryview(b"abc" * SAMPLE_SIZE), "zlib")
+    assert not worth_compressing(memoryview(os.urandom(SAMPLE_SIZE)), "zlib")
+    assert not worth_compressing(memoryview(b""), "zlib")
+
+
+@pytest.mark.parametrize("method", ["zlib", "lzma"])
+@pytest.mark.parametrize("packet_size", [1, 100, 65507])
+def test_payloads_decompress_in_order(method, packet_size):
+    data = b"".join(f"line {i}\n".encode() for i in range(20000))
+    payloads = list(compressed_payloads(memoryview(data), method, packet_size))
+    # Only the last packet may be short, and it is never empty
+    assert all(len(payload) == packet_size for payload in payloads[:-1])
+    assert 0 < len(payloads[-1]) <= packet_size
+    # Go-Back-N resends them with send_batch(), which needs writable buffers
+    assert all(isinstance(payload, bytearray) for payload in payloads)
+
+    output_file = ClosingBytesIO()
+    writer = DecompressingWriter(output_file)
+    for payload in payloads:
+        writer.write(memoryview(payload))
+    writer.close()
+
+    assert writer.closed
+    assert output_file.data == data
+
+
+def test_writer_detects_zlib():
+    data = b"x" * 1000
+    output_file = ClosingBytesIO()
+    writer = DecompressingWriter(output_file)
+    writer.write(memoryview(zlib.compress(data)))
+    writer.close()
+
+    assert output_file.data == data
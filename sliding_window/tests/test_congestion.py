@@ -0,0 +1,55 @@
+import pytest
+from congestion import FixedWindow, Reno, Vegas, TokenBucket, INITIAL_WINDOW
+
+
+def test_fixed_window():
+    congestion = FixedWindow(16)
+    congestion.on_ack(1, 0.01)
+    congestion.on_loss()
+    congestion.on_timeout()
+    assert congestion.window() == 16
+
+
+def test_reno_slow_start_and_aimd():
+    congestion = Reno(64)
+    assert congestion.window() == INITIAL_WINDOW
+    # Slow start grows by one packet per acknowledged packet
+    congestion.on_ack(INITIAL_WINDOW)
+    assert congestion.window() == 2 * INITIAL_WINDOW
+    congestion.on_ack(100)
+    assert congestion.window() == 64
+
+    congestion.on_loss()
+    assert congestion.window() == 32
+    # Congestion avoidance grows by one packet per window
+    congestion.on_ack(33)
+    assert congestion.window() == 33
+
+    congestion.on_timeout()
+    assert congestion.window() == 1
+    assert congestion.ssthresh == pytest.approx(33 / 2, rel=0.01)
+
+
+def test_vegas_backs_off_when_the_rtt_grows():
+    congestion = Vegas(64)
+    congestion.ssthresh = congestion.cwnd = 20.0
+    # One round trip at the base RTT grows the window
+    congestion.on_ack(20, 0.010)
+    assert congestion.window() == 21
+    # One round trip with twice the RTT means half the window is queued
+    congestion.on_ack(21, 0.020)
+    assert congestion.window() == 20
+
+
+def test_token_bucket():
+    pacer = TokenBucket(burst=2)
+    assert pacer.delay(None) == 0.0
+    pacer.consume()
+    pacer.consume()
+    assert pacer.delay(None) == 0.0
+    # Without tokens left the next packet has to wait for one
+    pacer.consume()
+    pacer.consume()
+    assert 0 < pacer.delay(100.0) <= 0.01
+    pacer.tokens = 0.5
+    assert pacer.delay(1e9) == 0.0
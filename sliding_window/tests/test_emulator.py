@@ -0,0 +1,61 @@
+import socket
+import pytest
+from NetworkEmulator import Link, NetworkEmulator, parse_rate
+
+
+def test_parse_rate():
+    assert parse_rate("10mbit") == 10**7
+    assert parse_rate("1.5Kbit") == 1500
+    assert parse_rate("800") == 800
+
+
+def test_link_is_deterministic():
+    def decisions(seed):
+        link = Link(loss=0.3, duplicate=0.2, seed=seed)
+        return [len(link.arrivals(100, 0.0)) for _ in range(200)]
+
+    assert decisions(1) == decisions(1)
+    assert decisions(1) != decisions(2)
+    # Lost, delivered and duplicated packets all occur
+    assert set(decisions(1)) == {0, 1, 2}
+
+
+def test_link_loss_rate():
+    link = Link(loss=0.05, seed=3)
+    for _ in range(10000):
+        link.arrivals(100, 0.0)
+    assert link.dropped == pytest.approx(500, rel=0.2)
+
+
+def test_link_rate_and_delay():
+    # 1000 bytes take 8 ms at 1 Mbit/s
+    link = Link(delay_s=0.05, rate_bps=10**6, queue_limit=3)
+    arrivals = [link.arrivals(1000, 0.0) for _ in range(4)]
+    assert arrivals[:3] == [[pytest.approx(0.05 + 0.008 * i)] for i in (1, 2, 3)]
+    # The queue is full
+    assert arrivals[3] == []
+    # Once the queue has drained packets go out right away again
+    assert link.arrivals(1000, 1.0) == [pytest.approx(1.058)]
+
+
+def test_link_jitter_and_reorder():
+    link = Link(delay_s=0.05, jitter_s=0.01, reorder=0.25, seed=5)
+    arrivals = [link.arrivals(100, 0.0)[0] for _ in range(1000)]
+    assert all(a == 0.0 or 0.04 <= a <= 0.06 for a in arrivals)
+    assert arrivals.count(0.0) == link.reordered == pytest.approx(250, rel=0.2)
+
+
+def test_emulator_relays_both_ways():
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as receiver:
+        receiver.bind(("127.0.0.1", 0))
+        receiver.settimeout(5)
+        emulator = NetworkEmulator(0, *receiver.getsockname())
+        emulator.start()
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sender:
+            sender.settimeout(5)
+            sender.sendto(b"ping", ("127.0.0.1", emulator.port))
+            data, addr = receiver.recvfrom(100)
+            receiver.sendto(b"pong", addr)
+            assert data == b"ping"
+            assert sender.recvfrom(100) == (b"pong", ("127.0.0.1", emulator.port))
+        emulator.close()
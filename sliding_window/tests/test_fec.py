@@ -0,0 +1,141 @@
+import os
+import socket
+import struct
+import pytest
+import Receiver3
+import Receiver4
+from utils import (
+    SequenceNumber,
+    HEADER_FORMAT,
+    EOF_FLAG,
+    SACK_FLAG,
+    FEC_FLAG,
+    COMPRESSED_FLAG,
+)
+from fec import FecSender, FecDecoder, xor_parity, MIN_GROUP_SIZE, CLEAN_GROUPS
+
+
+class RecordingSocket:
+    def __init__(self):
+        self.sent = []
+
+    def sendmsg(self, buffers):
+        self.sent.append(b"".join(buffers))
+
+
+class RecordingSender:
+    """Stands in for GoBackN or SlidingWindow and records the packets in send order"""
+
+    def __init__(self, flags=0):
+        self.seq_num = SequenceNumber()
+        self.sock = RecordingSocket()
+        self.total_retransmissions = 0
+        self.flags = flags
+
+    def send(self, data, eof_flag):
+        flags = self.flags | (EOF_FLAG if eof_flag else 0)
+        self.sock.sent.append(struct.pack(HEADER_FORMAT, self.seq_num(), flags) + data)
+        self.seq_num.next()
+        return True
+
+
+def encode(payloads, group_size, parity, flags=0):
+    sender = RecordingSender(flags)
+    fec = FecSender(sender, group_size, parity)
+    for i, payload in enumerate(payloads):
+        fec.send(payload, i == len(payloads) - 1)
+    return fec, sender.sock.sent
+
+
+def test_xor_parity_pads_shorter_payloads():
+    assert xor_parity([b"\x01\x02", b"\x03"]) == b"\x02\x02"
+    assert xor_parity([]) == b""
+
+
+def test_fec_sender_groups():
+    payloads = [bytes([i]) * 10 for i in range(10)]
+    fec, sent = encode(payloads, 4, 2)
+
+    parity = [packet for packet in sent if packet[2] & FEC_FLAG]
+    # Two full groups and a short last one
+    assert len(parity) == fec.total_parity_packets == 6
+    assert len(sent) == len(payloads) + 6
+
+
+@pytest.mark.parametrize("module", [Receiver3, Receiver4])
+@pytest.mark.parametrize("lost", [[1], [0, 5], [2, 3, 9], [8]])
+def test_receivers_rebuild_lost_packets(tmp_path, module, lost):
+    data = os.urandom(100 * 10 + 42)
+    payloads = [data[i : i + 100] for i in range(0, len(data), 100)]
+    _, sent = encode(payloads, 4, 2, SACK_FLAG if module is Receiver4 else 0)
+    # Drop the data packets, their parity still arrives
+    packets = [
+        packet
+        for packet in sent
+        if packet[2] & FEC_FLAG or struct.unpack_from("!H", packet)[0] not in lost
+    ]
+
+    output_path = tmp_path / "output.bin"
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(("127.0.0.1", 0))
+    if module is Receiver3:
+        receiver = Receiver3.GoBackNReceiver(sock, open(output_path, "wb"))
+    else:
+        receiver = Receiver4.SelectiveRepeatReceiver(sock, open(output_path, "wb"), 16)
+    # Acknowledgments go to ourselves and are never read
+    addr = sock.getsockname()
+    done = False
+    for packet in packets:
+        done = receiver.handle_packet(memoryview(packet), addr)
+        if done:
+            break
+    receiver.output_file.close()
+    sock.close()
+
+    assert done
+    assert output_path.read_bytes() == data
+
+
+def test_decoder_cannot_repair_two_losses_under_one_parity():
+    payloads = [bytes([i]) * 10 for i in range(4)]
+    _, sent = encode(payloads, 4, 1)
+    decoder = FecDecoder()
+    for index in (0, 3):
+        decoder.add_data(index, memoryview(sent[index]), 0)
+
+    assert decoder.add_parity(memoryview(sent[4]), 0) == []
+
+
+def test_decoder_rebuilds_from_parity_alone():
+    # A lost single packet transfer, the parity tells the flags of the lost packet
+    _, sent = encode([bytes(10)], 4, 1, COMPRESSED_FLAG)
+    decoder = FecDecoder()
+
+    assert decoder.add_parity(memoryview(sent[1]), 0) == [(0, sent[0])]
+
+
+def test_decoder_ignores_packets_without_parity():
+    decoder = FecDecoder()
+    decoder.add_data(0, memoryview(struct.pack(HEADER_FORMAT, 0, 0) + b"a"), 0)
+
+    assert decoder.packets == {}
+
+
+def test_fec_sender_tunes_redundancy():
+    sender = RecordingSender()
+    fec = FecSender(sender)
+    payload = bytes(10)
+
+    # Losses the parity did not repair halve the group, then add parity packets
+    for _ in range(4):
+        sender.total_retransmissions += 1
+        for _ in range(fec.group_size):
+            fec.send(payload, False)
+    assert fec.group_size == MIN_GROUP_SIZE
+    assert fec.parity == 3
+
+    # Without them the redundancy goes back down
+    for _ in range(2 * CLEAN_GROUPS):
+        for _ in range(fec.group_size):
+            fec.send(payload, False)
+    assert fec.parity == 1
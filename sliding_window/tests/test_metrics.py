@@ -0,0 +1,81 @@
+import json
+import os
+import pytest
+import benchmark
+from metrics import TransferMetrics
+from NetworkEmulator import Link, NetworkEmulator
+
+
+def test_timeline_is_sampled():
+    metrics = TransferMetrics(interval_s=3600)
+    for _ in range(10):
+        metrics.acknowledged(1, 100, 4, 8)
+    # Only the first acknowledgment was sampled, the latest one is added at the end
+    assert len(metrics.timeline) == 1
+    rows = metrics.goodput_timeline()
+    assert [row[1:5] for row in rows] == [(1, 100, 4, 8), (10, 1000, 4, 8)]
+    summary = metrics.summary()
+    assert summary["acked_packets"] == 10
+    assert summary["acked_bytes"] == 1000
+
+
+def test_retransmissions_and_rtt():
+    metrics = TransferMetrics()
+    for index in (3, 3, 7):
+        metrics.retransmit(index)
+    for rtt_s in (0.3, 0.1, 0.2):
+        metrics.rtt(rtt_s)
+    metrics.blocked(0.5)
+    metrics.blocked(0.25)
+
+    summary = metrics.summary()
+    assert summary["retransmissions"] == 3
+    assert summary["retransmitted_packets"] == 2
+    assert summary["max_retransmissions"] == 2
+    assert summary["blocked_s"] == 0.75
+    assert (summary["rtt_min_s"], summary["rtt_median_s"], summary["rtt_max_s"]) == (
+        0.1,
+        0.2,
+        0.3,
+    )
+
+
+def test_write(tmp_path):
+    metrics = TransferMetrics()
+    metrics.retransmit(5)
+    metrics.acknowledged(2, 2048, 0, 1)
+    metrics.write_json(tmp_path / "metrics.json")
+    metrics.write_csv(tmp_path / "metrics.csv")
+
+    data = json.loads((tmp_path / "metrics.json").read_text())
+    assert data["retransmissions"] == {"5": 1}
+    assert data["timeline"][0]["acked_bytes"] == 2048
+    header, row = (tmp_path / "metrics.csv").read_text().splitlines()
+    assert header.startswith("time_s,acked_packets,acked_bytes")
+
+
+@pytest.mark.parametrize(
+    "protocol", ["stop_and_wait", "go_back_n", "selective_repeat_sack"]
+)
+def test_senders_record_metrics(tmp_path, protocol):
+    input_file = tmp_path / "input.bin"
+    input_file.write_bytes(os.urandom(200 * 1024 + 7))
+    with open(tmp_path / "output.bin", "wb") as output_file:
+        port, receiver = benchmark.start_receiver(protocol, 8, output_file)
+        # Only data packets are lost, a lost final ACK would make the sender give up on
+        # the last packet and leave acked_bytes short of the file size
+        emulator = NetworkEmulator(
+            0, "127.0.0.1", port, Link(0.05, 0.001, seed=1), Link(0.0, 0.001)
+        )
+        emulator.start()
+        sender = benchmark.send(protocol, emulator.port, str(input_file), 8, 20)
+        receiver.join(timeout=10)
+        emulator.close()
+
+    assert (tmp_path / "output.bin").read_bytes() == input_file.read_bytes()
+    summary = sender.metrics.summary()
+    assert summary["acked_bytes"] == os.path.getsize(input_file)
+    assert summary["retransmissions"] == sender.total_retransmissions > 0
+    assert summary["rtt_samples"] > 0
+    assert summary["blocked_s"] > 0
+    assert sender.metrics.timeline
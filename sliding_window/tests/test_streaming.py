@@ -0,0 +1,98 @@
+import asyncio
+import io
+import os
+import socket
+import threading
+import pytest
+import Receiver3
+import Receiver4
+from streaming import packets, CallbackSink, AsyncSink
+from utils import packet_count, PACKET_SIZE
+from tests.test_transfer import send, WINDOW_SIZE
+
+
+def test_packets_of_chunks():
+    source = [b"ab", b"cdefg", b"", bytearray(b"h")]
+    assert list(packets(source, 3)) == [b"abc", b"def", b"gh"]
+
+
+@pytest.mark.parametrize("source", [[b"abc", b"def"], io.BytesIO(b"abcdef")])
+def test_packets_whole_packets(source):
+    # The last packet is full instead of followed by an empty one
+    assert list(packets(source, 3)) == [b"abc", b"def"]
+
+
+def test_packets_of_empty_source():
+    assert list(packets(iter([]), 3)) == [b""]
+
+
+def make_receiver(protocol, sink):
+    """Returns the receiver module and a session on a new socket that writes into sink"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(("127.0.0.1", 0))
+    if protocol == "go_back_n":
+        return Receiver3, Receiver3.GoBackNReceiver(sock, sink)
+    return Receiver4, Receiver4.SelectiveRepeatReceiver(sock, sink, WINDOW_SIZE)
+
+
+@pytest.mark.parametrize(
+    "protocol", ["go_back_n", "selective_repeat", "selective_repeat_sack"]
+)
+@pytest.mark.parametrize("size", [0, PACKET_SIZE * 50, PACKET_SIZE * 50 + 7])
+def test_stream_to_callback(protocol, size):
+    data = os.urandom(size)
+    received = []
+    closed = threading.Event()
+    sink = CallbackSink(lambda chunk: received.append(bytes(chunk)), closed.set)
+    module, receiver = make_receiver(protocol, sink)
+    thread = threading.Thread(
+        target=module.receive_packets, args=(receiver,), daemon=True
+    )
+    thread.start()
+
+    # A generator of unknown length whose chunks do not line up with the packets
+    source = (data[i : i + 1000] for i in range(0, size, 1000))
+    sender = send(protocol, receiver.sock.getsockname()[1], source=source)
+    thread.join(timeout=10)
+
+    assert closed.is_set()
+    assert b"".join(received) == data
+    assert sink.tell() == size
+    assert sender.total_packets == packet_count(size)
+
+
+@pytest.mark.parametrize("protocol", ["go_back_n", "selective_repeat"])
+def test_stream_to_async_iterator(protocol):
+    data = os.urandom(PACKET_SIZE * 200 + 7)
+
+    async def receive():
+        sink = AsyncSink(max_pending=8)
+        module, receiver = make_receiver(protocol, sink)
+        port = receiver.sock.getsockname()[1]
+        sending = asyncio.ensure_future(
+            asyncio.to_thread(send, protocol, port, source=io.BytesIO(data))
+        )
+        received = [
+            chunk async for chunk in sink.receive(module.receive_packets, receiver)
+        ]
+        await sending
+        return b"".join(received)
+
+    assert asyncio.run(receive()) == data
+
+
+def test_async_iterator_ends_when_receiver_fails():
+    async def receive():
+        sink = AsyncSink()
+        received = []
+
+        def fail(receiver):
+            sink.write(memoryview(b"abc"))
+            raise OSError("Receiver failed")
+
+        with pytest.raises(OSError):
+            async for chunk in sink.receive(fail, None):
+                received.append(chunk)
+        return received
+
+    assert asyncio.run(receive()) == [b"abc"]
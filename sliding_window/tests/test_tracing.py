@@ -0,0 +1,94 @@
+import os
+import signal
+import socket
+import struct
+import threading
+import pytest
+import tracing
+import utils
+from tracing import TraceBuffer, trace, load, SEND, RECORD
+from Sender3 import GoBackN
+from tests.test_transfer import transfer
+
+
+def test_trace_is_off_by_default():
+    assert tracing.buffer is None
+    trace(SEND, 1, 0)
+
+
+def test_buffer_keeps_latest_events(tmp_path):
+    buffer = TraceBuffer(capacity=4)
+    for i in range(6):
+        buffer.record(SEND, i, i - 1)
+    assert len(buffer.buffer) == 4 * RECORD.size
+
+    buffer.dump(tmp_path / "trace.bin")
+    events = load(tmp_path / "trace.bin")
+    assert [(name, seq, base) for _, name, seq, base in events] == [
+        ("send", i, i - 1) for i in range(2, 6)
+    ]
+    times = [seconds for seconds, _, _, _ in events]
+    assert times == sorted(times)
+
+
+def test_load_rejects_other_files(tmp_path):
+    (tmp_path / "other.bin").write_bytes(os.urandom(100))
+    with pytest.raises(ValueError):
+        load(tmp_path / "other.bin")
+
+
+def test_dump_on_signal(monkeypatch, tmp_path):
+    # start_tracing() replaces the buffer and the handler, restore both afterwards
+    monkeypatch.setattr(tracing, "buffer", None)
+    monkeypatch.setattr(tracing.atexit, "register", lambda *args: None)
+    previous = signal.getsignal(signal.SIGUSR1)
+    try:
+        tracing.start_tracing(str(tmp_path / "trace.bin"))
+        trace(SEND, 7, 3)
+        os.kill(os.getpid(), signal.SIGUSR1)
+    finally:
+        signal.signal(signal.SIGUSR1, previous)
+    assert [event[1:] for event in load(tmp_path / "trace.bin")] == [("send", 7, 3)]
+
+
+def test_transfer_is_traced(monkeypatch, tmp_path):
+    buffer = TraceBuffer()
+    monkeypatch.setattr(tracing, "buffer", buffer)
+    input_file = tmp_path / "input.bin"
+    input_file.write_bytes(os.urandom(10 * 1024 + 1))
+
+    transfer("go_back_n", input_file, tmp_path / "output.bin")
+
+    buffer.dump(tmp_path / "trace.bin")
+    events = load(tmp_path / "trace.bin")
+    sent = [seq for _, name, seq, _ in events if name == "send"]
+    received = [seq for _, name, seq, _ in events if name == "receive"]
+    assert sent == received == list(range(11))
+    assert any(name == "eof" and seq == 10 for _, name, seq, _ in events)
+
+
+def test_go_back_n_traces_duplicate_acks(monkeypatch, tmp_path):
+    buffer = TraceBuffer()
+    monkeypatch.setattr(tracing, "buffer", buffer)
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as receiver:
+        receiver.bind(("127.0.0.1", 0))
+        receiver.settimeout(5)
+        sender = GoBackN("127.0.0.1", receiver.getsockname()[1], 10000, 8, 2)
+        ack_thread = threading.Thread(target=sender.handle_acknowledgments, daemon=True)
+        ack_thread.start()
+        for i in range(2):
+            sender.send(memoryview(bytearray([i])), i == 1)
+        _, addr = receiver.recvfrom(1024)
+        receiver.recv(1024)
+
+        # Packet 0 got lost, two duplicates stay below the fast retransmit threshold
+        for _ in range(2):
+            receiver.sendto(struct.pack("!H", utils.wire_seq_num(-1)), addr)
+        receiver.sendto(struct.pack("!H", 1), addr)
+        ack_thread.join(timeout=5)
+        sender.sock.close()
+
+    buffer.dump(tmp_path / "trace.bin")
+    events = [event[1:] for event in load(tmp_path / "trace.bin")]
+    assert events.count(("dup_ack", -1, 0)) == 2
+    assert sender.total_fast_retransmits == 0
@@ -0,0 +1,706 @@
+import os
+from pathlib import Path
+import socket
+import struct
+import threading
+import time
+import types
+import pytest
+import utils
+import Receiver3
+import Receiver4
+from utils import (
+    send_file,
+    packet_count,
+    PACKET_SIZE,
+    MAX_PACKET_SIZE,
+    HEADER_FORMAT,
+    EOF_FLAG,
+    SACK_FLAG,
+    COMPRESSED_FLAG,
+    UNKNOWN_PACKET_COUNT,
+    SACK_FORMAT,
+    SACK_SIZE,
+    AckPolicy,
+)
+from Sender3 import GoBackN
+from Sender4 import SlidingWindow
+from ReceiverServer import ReceiverServer
+from StripedSender import send_stripe, send_striped
+from StripedReceiver import receive_striped
+from pmtu import probe_packet_size
+from resume import Checkpoint, query_resume_offset
+from compression import send_compressed
+from streaming import send_stream
+from NetworkEmulator import Link, NetworkEmulator
+from async_engine import (
+    AsyncSender,
+    StopAndWaitProtocol,
+    GoBackNProtocol,
+    SelectiveRepeatProtocol,
+    send_file_async,
+)
+
+# A small sequence space so that a few hundred packets wrap around several times
+SEQ_MODULUS = 64
+WINDOW_SIZE = 16
+
+
+@pytest.fixture
+def input_file(tmp_path):
+    path = tmp_path / "input.bin"
+    path.write_bytes(os.urandom(PACKET_SIZE * SEQ_MODULUS * 4 + 123))
+    return path
+
+
+def make_receiver(module, output_path, ack_policy=None, pwrite=False, checkpoint=None):
+    """Returns a Receiver3/Receiver4 session on a new socket"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(("127.0.0.1", 0))
+    start_offset = 0
+    if checkpoint is None:
+        output_file = open(output_path, "wb")
+    else:
+        output_file, start_offset = checkpoint.open_output(str(output_path))
+    if module is Receiver3:
+        return Receiver3.GoBackNReceiver(
+            sock, output_file, ack_policy, checkpoint, start_offset
+        )
+    return Receiver4.SelectiveRepeatReceiver(
+        sock,
+        output_file,
+        WINDOW_SIZE,
+        pwrite,
+        ack_policy=ack_policy,
+        checkpoint=checkpoint,
+        start_offset=start_offset,
+    )
+
+
+def start_receiver(module, output_path, ack_policy, pwrite=False):
+    """Run the receive loop of Receiver3/Receiver4 in a thread, returns its port and the thread"""
+    receiver = make_receiver(module, output_path, ack_policy, pwrite)
+    thread = threading.Thread(
+        target=module.receive_packets, args=(receiver,), daemon=True
+    )
+    thread.start()
+    return receiver.sock.getsockname()[1], thread
+
+
+def send(
+    protocol,
+    port,
+    input_file=None,
+    packet_size=PACKET_SIZE,
+    compress=None,
+    source=None,
+    **sender_args,
+):
+    """
+    Send input_file, or a streaming source instead, to a receiver on port over loopback and
+    return the sender
+    """
+    if source is not None or compress:
+        total_packets = UNKNOWN_PACKET_COUNT
+    else:
+        total_packets = packet_count(
+            os.path.getsize(input_file), packet_size=packet_size
+        )
+    if compress:
+        sender_args["flags"] = COMPRESSED_FLAG
+    if protocol == "go_back_n":
+        sender = GoBackN(
+            "127.0.0.1", port, 50, WINDOW_SIZE, total_packets, **sender_args
+        )
+        threads = [threading.Thread(target=sender.handle_acknowledgments, daemon=True)]
+    else:
+        sender = SlidingWindow(
+            "127.0.0.1",
+            port,
+            WINDOW_SIZE,
+            total_packets,
+            0.05,
+            sack=protocol == "selective_repeat_sack",
+            **sender_args,
+        )
+        threads = [
+            threading.Thread(target=sender.handle_acknowledgments, daemon=True),
+            threading.Thread(target=sender.resend_timedout_packets, daemon=True),
+        ]
+    for thread in threads:
+        thread.start()
+
+    if source is not None:
+        send_stream(source, sender, packet_size)
+    elif compress:
+        send_compressed(str(input_file), sender, compress, packet_size)
+    else:
+        send_file(str(input_file), sender, packet_size=packet_size)
+    for thread in threads:
+        thread.join(timeout=10)
+    sender.sock.close()
+    return sender
+
+
+def transfer(
+    protocol,
+    input_file,
+    output_path,
+    ack_policy=None,
+    packet_size=PACKET_SIZE,
+    **sender_args,
+):
+    """Send input_file to output_path over loopback and return the sender"""
+    ack_policy = ack_policy or AckPolicy()
+    if protocol == "go_back_n":
+        port, receiver = start_receiver(Receiver3, output_path, ack_policy)
+    else:
+        pwrite = protocol == "selective_repeat_pwrite"
+        port, receiver = start_receiver(Receiver4, output_path, ack_policy, pwrite)
+    sender = send(protocol, port, input_file, packet_size, **sender_args)
+    receiver.join(timeout=10)
+    return sender
+
+
+PROTOCOLS = [
+    "go_back_n",
+    "selective_repeat",
+    "selective_repeat_pwrite",
+    "selective_repeat_sack",
+]
+
+
+@pytest.mark.parametrize("protocol", PROTOCOLS)
+def test_transfer_wraps_sequence_numbers(monkeypatch, tmp_path, input_file, protocol):
+    monkeypatch.setattr(utils, "SEQ_MODULUS", SEQ_MODULUS)
+    output_path = tmp_path / "output.bin"
+    total_packets = packet_count(os.path.getsize(input_file))
+    assert total_packets > 3 * SEQ_MODULUS
+
+    sender = transfer(protocol, input_file, output_path)
+
+    assert not sender.done
+    assert sender.seq_num.index == total_packets
+    assert sender.seq_num() == total_packets % SEQ_MODULUS
+    assert output_path.read_bytes() == input_file.read_bytes()
+
+
+@pytest.mark.parametrize("protocol", ["go_back_n", "selective_repeat_sack"])
+def test_transfer_delayed_acks(tmp_path, input_file, protocol):
+    output_path = tmp_path / "output.bin"
+
+    transfer(protocol, input_file, output_path, AckPolicy(4, 0.005))
+
+    assert output_path.read_bytes() == input_file.read_bytes()
+
+
+@pytest.mark.parametrize("protocol", ["go_back_n", "selective_repeat_sack"])
+@pytest.mark.parametrize("congestion_control", ["reno", "vegas"])
+def test_transfer_congestion_control(
+    tmp_path, input_file, protocol, congestion_control
+):
+    output_path = tmp_path / "output.bin"
+
+    sender = transfer(
+        protocol,
+        input_file,
+        output_path,
+        congestion_control=congestion_control,
+        pacing=True,
+    )
+
+    assert not sender.done
+    assert sender.total_retransmissions == 0
+    assert output_path.read_bytes() == input_file.read_bytes()
+
+
+@pytest.mark.parametrize("protocol", PROTOCOLS)
+@pytest.mark.parametrize("packet_size", [100, 9000, MAX_PACKET_SIZE])
+def test_transfer_packet_size(tmp_path, input_file, protocol, packet_size):
+    output_path = tmp_path / "output.bin"
+
+    sender = transfer(protocol, input_file, output_path, packet_size=packet_size)
+
+    assert not sender.done
+    assert sender.seq_num.index == packet_count(
+        os.path.getsize(input_file), packet_size=packet_size
+    )
+    assert output_path.read_bytes() == input_file.read_bytes()
+
+
+@pytest.mark.parametrize("protocol", PROTOCOLS)
+def test_transfer_through_emulator(tmp_path, input_file, protocol):
+    output_path = tmp_path / "output.bin"
+    if protocol == "go_back_n":
+        port, receiver = start_receiver(Receiver3, output_path, AckPolicy())
+    else:
+        pwrite = protocol == "selective_repeat_pwrite"
+        port, receiver = start_receiver(Receiver4, output_path, AckPolicy(), pwrite)
+    link = dict(loss=0.05, delay_s=0.002, jitter_s=0.001, reorder=0.05, duplicate=0.05)
+    emulator = NetworkEmulator(
+        0, "127.0.0.1", port, Link(**link, seed=1), Link(**link, seed=2)
+    )
+    emulator.start()
+
+    sender = send(protocol, emulator.port, input_file)
+    receiver.join(timeout=10)
+    emulator.close()
+
+    assert not sender.done
+    assert sender.total_retransmissions > 0
+    assert emulator.forward.dropped > 0 and emulator.reverse.duplicated > 0
+    assert output_path.read_bytes() == input_file.read_bytes()
+
+
+@pytest.mark.parametrize("receiver_module", [Receiver3, Receiver4])
+def test_probe_packet_size(tmp_path, receiver_module):
+    receiver = make_receiver(receiver_module, tmp_path / "output.bin")
+    thread = threading.Thread(
+        target=receiver_module.receive_packets, args=(receiver,), daemon=True
+    )
+    thread.start()
+    port = receiver.sock.getsockname()[1]
+
+    # Loopback has an MTU of 64 KB, so the largest UDP datagram gets through
+    assert probe_packet_size("127.0.0.1", port) == MAX_PACKET_SIZE
+    assert probe_packet_size("127.0.0.1", port, 5000) == 5000
+
+    # The receiver ignored the probes and still takes a transfer
+    data = os.urandom(10)
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sender:
+        sender.sendto(
+            struct.pack(HEADER_FORMAT, 0, EOF_FLAG) + data, ("127.0.0.1", port)
+        )
+    thread.join(timeout=5)
+    assert (tmp_path / "output.bin").read_bytes() == data
+
+
+def test_receiver4_learns_packet_size(tmp_path):
+    data = os.urandom(300 * 3 + 7)
+    payloads = [data[i : i + 300] for i in range(0, len(data), 300)]
+    # The short EOF packet arrives before any packet that tells the packet size
+    order = [3, 2, 0, 1]
+
+    output_path = tmp_path / "output.bin"
+    receiver = make_receiver(Receiver4, output_path, pwrite=True)
+    packets = [
+        struct.pack(HEADER_FORMAT, i, i == len(payloads) - 1) + payloads[i]
+        for i in order
+    ]
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sender:
+        for packet in packets:
+            sender.sendto(packet, receiver.sock.getsockname())
+        Receiver4.receive_packets(receiver)
+
+    assert receiver.packet_size == 300
+    assert output_path.read_bytes() == data
+
+
+@pytest.mark.parametrize("protocol", PROTOCOLS)
+def test_resume_transfer(tmp_path, input_file, protocol):
+    data = input_file.read_bytes()
+    output_path = tmp_path / "output.bin"
+    checkpoint_path = str(output_path) + ".checkpoint"
+    # An interrupted transfer left some garbage after what its checkpoint recorded
+    complete = PACKET_SIZE * 10 + 5
+    output_path.write_bytes(data[:complete] + os.urandom(3000))
+    with open(output_path, "r+b") as f:
+        Checkpoint(checkpoint_path).save(f, complete)
+
+    module = Receiver3 if protocol == "go_back_n" else Receiver4
+    receiver = make_receiver(
+        module,
+        output_path,
+        pwrite=protocol == "selective_repeat_pwrite",
+        checkpoint=Checkpoint(checkpoint_path),
+    )
+    thread = threading.Thread(
+        target=module.receive_packets, args=(receiver,), daemon=True
+    )
+    thread.start()
+    port = receiver.sock.getsockname()[1]
+
+    offset = query_resume_offset("127.0.0.1", port)
+    rest = tmp_path / "rest.bin"
+    rest.write_bytes(data[offset:])
+    send(protocol, port, rest)
+    thread.join(timeout=10)
+
+    assert offset == complete
+    assert output_path.read_bytes() == data
+    # The transfer completed, so there is nothing left to resume
+    assert not os.path.exists(checkpoint_path)
+
+
+@pytest.mark.parametrize("protocol", PROTOCOLS)
+@pytest.mark.parametrize("method", ["zlib", "lzma"])
+def test_compressed_transfer(monkeypatch, tmp_path, protocol, method):
+    monkeypatch.setattr(utils, "SEQ_MODULUS", SEQ_MODULUS)
+    input_file = tmp_path / "input.txt"
+    lines = [f"{i},{i * i},{os.urandom(4).hex()}\n" for i in range(50000)]
+    input_file.write_text("".join(lines))
+    output_path = tmp_path / "output.txt"
+
+    sender = transfer(protocol, input_file, output_path, compress=method)
+
+    assert not sender.done
+    # The compressed stream took far fewer packets than the file
+    assert sender.total_packets == sender.seq_num.index
+    assert sender.total_packets < packet_count(os.path.getsize(input_file)) / 2
+    assert output_path.read_bytes() == input_file.read_bytes()
+
+
+def test_interrupted_receiver_saves_checkpoint(tmp_path):
+    output_path = tmp_path / "output.bin"
+    checkpoint = Checkpoint(str(output_path) + ".checkpoint")
+    receiver = make_receiver(Receiver3, output_path, checkpoint=checkpoint)
+    payload = os.urandom(PACKET_SIZE)
+    addr = receiver.sock.getsockname()
+    for i in range(3):
+        packet = struct.pack(HEADER_FORMAT, i, 0) + payload
+        receiver.handle_packet(memoryview(packet), addr)
+    checkpoint.close(receiver, done=False)
+    receiver.output_file.close()
+    receiver.sock.close()
+
+    assert Checkpoint(checkpoint.path).load() == 3 * PACKET_SIZE
+    assert output_path.read_bytes() == payload * 3
+
+
+def test_go_back_n_fast_retransmit():
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as receiver:
+        receiver.bind(("127.0.0.1", 0))
+        receiver.settimeout(5)
+        # A timeout far longer than the test, so every resend is a fast retransmit
+        sender = GoBackN("127.0.0.1", receiver.getsockname()[1], 10000, 8, 6)
+        ack_thread = threading.Thread(target=sender.handle_acknowledgments, daemon=True)
+        ack_thread.start()
+        for i in range(6):
+            sender.send(memoryview(bytearray([i])), i == 5)
+        sent = [receiver.recvfrom(1024) for _ in range(6)]
+        addr = sent[0][1]
+
+        # Packet 0 got lost, so the receiver acknowledges the packet before it for the others
+        for _ in range(3):
+            receiver.sendto(struct.pack("!H", utils.wire_seq_num(-1)), addr)
+        resent = [receiver.recv(1024) for _ in range(6)]
+        receiver.sendto(struct.pack("!H", 5), addr)
+        ack_thread.join(timeout=5)
+        sender.sock.close()
+
+    assert resent == [packet for packet, _ in sent]
+    assert sender.total_fast_retransmits == 1
+    assert sender.total_retransmissions == 6
+    assert sender.base == 6
+
+
+def test_selective_repeat_resends_earlier_deadline_first():
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as receiver:
+        receiver.bind(("127.0.0.1", 0))
+        receiver.settimeout(1)
+        sender = SlidingWindow("127.0.0.1", receiver.getsockname()[1], 8, 2, 10)
+        # Like an adaptive timeout that shrinks after the first packet
+        timeouts = iter([5.0, 0.05, 10.0])
+        sender.rto = types.SimpleNamespace(
+            timeout=lambda retry_attempts: next(timeouts)
+        )
+        resend_thread = threading.Thread(
+            target=sender.resend_timedout_packets, daemon=True
+        )
+        sender.send(memoryview(b"a"), False)
+        resend_thread.start()
+        # Let the resend thread go to sleep until the deadline of the first packet
+        time.sleep(0.1)
+        start = time.monotonic()
+        sender.send(memoryview(b"b"), True)
+        sent = [receiver.recv(1024) for _ in range(2)]
+        resent = receiver.recv(1024)
+        resend_time = time.monotonic() - start
+        with sender.lock:
+            sender.done = True
+            sender.deadline_added.notify()
+        resend_thread.join(timeout=5)
+        sender.sock.close()
+
+    assert resent == sent[1]
+    assert resend_time < 1
+    assert sender.total_retransmissions == 1
+
+
+def test_async_sender_needs_every_protocol_method():
+    class IncompleteProtocol(AsyncSender):
+        def window_open(self):
+            return True
+
+        def add_to_transit(self, index, packet):
+            pass
+
+    # Fails right away instead of inside an event loop callback mid-transfer
+    with pytest.raises(TypeError, match="handle_ack"):
+        IncompleteProtocol(memoryview(b""), WINDOW_SIZE, 0.05)
+
+
+@pytest.mark.parametrize(
+    "protocol_factory, receiver",
+    [
+        (lambda view: StopAndWaitProtocol(view, 0.05), Receiver3),
+        (lambda view: GoBackNProtocol(view, WINDOW_SIZE, 0.05), Receiver3),
+        (lambda view: SelectiveRepeatProtocol(view, WINDOW_SIZE, 0.05), Receiver4),
+        (
+            lambda view: SelectiveRepeatProtocol(view, WINDOW_SIZE, 0.05, sack=True),
+            Receiver4,
+        ),
+    ],
+)
+def test_async_transfer(monkeypatch, tmp_path, input_file, protocol_factory, receiver):
+    monkeypatch.setattr(utils, "SEQ_MODULUS", SEQ_MODULUS)
+    output_path = tmp_path / "output.bin"
+    port, receiver_thread = start_receiver(receiver, output_path, AckPolicy())
+
+    sender, _ = send_file_async("127.0.0.1", port, str(input_file), protocol_factory)
+    receiver_thread.join(timeout=10)
+
+    assert not sender.done
+    assert sender.seq_num.index == packet_count(os.path.getsize(input_file))
+    assert output_path.read_bytes() == input_file.read_bytes()
+
+
+@pytest.mark.parametrize("protocol", PROTOCOLS)
+def test_transfer_empty_file(tmp_path, protocol):
+    input_file = tmp_path / "empty.bin"
+    input_file.write_bytes(b"")
+    output_path = tmp_path / "output.bin"
+
+    sender = transfer(protocol, input_file, output_path)
+
+    assert sender.seq_num.index == 1
+    assert output_path.read_bytes() == b""
+
+
+@pytest.mark.parametrize("pwrite", [False, True])
+def test_receiver4_out_of_order(tmp_path, pwrite):
+    data = os.urandom(PACKET_SIZE * 10 + 7)
+    payloads = [data[i : i + PACKET_SIZE] for i in range(0, len(data), PACKET_SIZE)]
+    order = [1, 0, 3, 4, 2, 10, 6, 5, 9, 7, 8]
+
+    output_path = tmp_path / "output.bin"
+    receiver = make_receiver(Receiver4, output_path, pwrite=pwrite)
+    packets = [
+        struct.pack(HEADER_FORMAT, i, i == len(payloads) - 1) + payloads[i]
+        for i in order
+    ]
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sender:
+        for packet in packets:
+            sender.sendto(packet, receiver.sock.getsockname())
+        Receiver4.receive_packets(receiver)
+
+    assert receiver.base == len(payloads)
+    assert receiver.buffer == {}
+    assert output_path.read_bytes() == data
+
+
+@pytest.mark.parametrize("pwrite", [False, True])
+def test_receiver4_sack(tmp_path, pwrite):
+    data = os.urandom(PACKET_SIZE * 5)
+    payloads = [data[i : i + PACKET_SIZE] for i in range(0, len(data), PACKET_SIZE)]
+    order = [0, 2, 4, 3, 1]
+
+    output_path = tmp_path / "output.bin"
+    receiver = make_receiver(Receiver4, output_path, pwrite=pwrite)
+    packets = [
+        struct.pack(
+            HEADER_FORMAT,
+            i,
+            SACK_FLAG | (EOF_FLAG if i == len(payloads) - 1 else 0),
+        )
+        + payloads[i]
+        for i in order
+    ]
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sender:
+        for packet in packets:
+            sender.sendto(packet, receiver.sock.getsockname())
+        Receiver4.receive_packets(receiver)
+
+        sacks = []
+        for _ in order:
+            ack = sender.recv(1024)
+            cumulative, size = struct.unpack_from(SACK_FORMAT, ack)
+            assert len(ack) == SACK_SIZE + size
+            sacks.append((cumulative, int.from_bytes(ack[SACK_SIZE:], "little")))
+
+    # Bit i acknowledges the packet cumulative + 2 + i
+    assert sacks == [(0, 0b0), (0, 0b1), (0, 0b101), (0, 0b111), (4, 0b0)]
+    assert output_path.read_bytes() == data
+
+
+def consecutive_ports(count):
+    """
+    Returns the first of count consecutive ports that are free right now. Striping needs them,
+    a port the kernel picked is tried as the start of the block until the rest are free too
+    """
+    while True:
+        sockets = [socket.socket(socket.AF_INET, socket.SOCK_DGRAM)]
+        try:
+            sockets[0].bind(("127.0.0.1", 0))
+            port = sockets[0].getsockname()[1]
+            if port + count > 65536:
+                continue
+            for offset in range(1, count):
+                sockets.append(socket.socket(socket.AF_INET, socket.SOCK_DGRAM))
+                sockets[-1].bind(("127.0.0.1", port + offset))
+            return port
+        except OSError:
+            continue
+        finally:
+            for sock in sockets:
+                sock.close()
+
+
+@pytest.mark.parametrize("size", [0, 123, PACKET_SIZE * 3, PACKET_SIZE * 50 + 7])
+def test_striped_transfer(tmp_path, size):
+    streams = 4
+    input_file = tmp_path / "input.bin"
+    input_file.write_bytes(os.urandom(size))
+    output_path = tmp_path / "output.bin"
+    port = consecutive_ports(streams)
+
+    receiver = threading.Thread(
+        target=receive_striped,
+        args=(port, str(output_path), WINDOW_SIZE, streams),
+        kwargs={"bind_address": "127.0.0.1"},
+        daemon=True,
+    )
+    receiver.start()
+    time.sleep(0.2)
+    send_striped("127.0.0.1", port, str(input_file), WINDOW_SIZE, 0.05, streams)
+    receiver.join(timeout=10)
+
+    assert output_path.read_bytes() == input_file.read_bytes()
+
+
+def test_striped_receiver_gives_up_on_missing_stripe(tmp_path):
+    input_file = tmp_path / "input.bin"
+    input_file.write_bytes(os.urandom(PACKET_SIZE * 20))
+    port = consecutive_ports(2)
+    errors = []
+
+    def receive():
+        try:
+            receive_striped(
+                port,
+                str(tmp_path / "output.bin"),
+                WINDOW_SIZE,
+                2,
+                bind_address="127.0.0.1",
+                timeout_s=0.5,
+            )
+        except RuntimeError as error:
+            errors.append(error)
+
+    receiver = threading.Thread(target=receive, daemon=True)
+    receiver.start()
+    time.sleep(0.2)
+    # The sender of stripe 1 never shows up
+    send_stripe("127.0.0.1", port, str(input_file), WINDOW_SIZE, 0.05, 0, 2)
+    receiver.join(timeout=10)
+
+    assert not receiver.is_alive()
+    assert len(errors) == 1
+
+
+def test_striped_sender_fails_on_silent_stripe(tmp_path):
+    input_file = tmp_path / "input.bin"
+    input_file.write_bytes(os.urandom(PACKET_SIZE * 20))
+    port = consecutive_ports(2)
+    # Stripe 0 is received, the receiver of stripe 1 never answers
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(("127.0.0.1", port))
+    receiver = Receiver4.SelectiveRepeatReceiver(
+        sock, open(tmp_path / "output.bin", "wb"), WINDOW_SIZE, stripe=0, stripes=2
+    )
+    threading.Thread(
+        target=Receiver4.receive_packets, args=(receiver,), daemon=True
+    ).start()
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as silent:
+        silent.bind(("127.0.0.1", port + 1))
+        # The sender of stripe 1 gives up after 50 retransmissions of 50 ms each
+        with pytest.raises(RuntimeError, match="Stripe 1"):
+            send_striped("127.0.0.1", port, str(input_file), WINDOW_SIZE, 0.05, 2)
+
+
+@pytest.mark.parametrize("protocol", ["go_back_n", "selective_repeat_sack"])
+def test_receiver_server(tmp_path, protocol):
+    inputs = []
+    for i in range(4):
+        input_file = tmp_path / f"input{i}.bin"
+        input_file.write_bytes(os.urandom(PACKET_SIZE * 20 * i + 11))
+        inputs.append(input_file)
+    output_dir = tmp_path / "output"
+    output_dir.mkdir()
+
+    def make_session(sock, output_file):
+        if protocol == "go_back_n":
+            return Receiver3.GoBackNReceiver(sock, output_file)
+        return Receiver4.SelectiveRepeatReceiver(
+            sock, output_file, WINDOW_SIZE, ack_policy=AckPolicy(4, 0.005)
+        )
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(("127.0.0.1", 0))
+    server = ReceiverServer(sock, str(output_dir), make_session)
+    thread = threading.Thread(target=server.serve, args=(len(inputs),), daemon=True)
+    thread.start()
+    port = sock.getsockname()[1]
+
+    # Three concurrent transfers, then one more after they finished
+    senders = [
+        threading.Thread(target=send, args=(protocol, port, input_file))
+        for input_file in inputs[:3]
+    ]
+    for sender in senders:
+        sender.start()
+    for sender in senders:
+        sender.join(timeout=10)
+    send(protocol, port, inputs[3])
+    thread.join(timeout=10)
+    sock.close()
+
+    assert len(server.completed) == len(inputs)
+    assert not server.sessions
+    received = sorted(Path(path).read_bytes() for _, path in server.completed)
+    assert received == sorted(input_file.read_bytes() for input_file in inputs)
+
+
+@pytest.mark.parametrize("module", [Receiver3, Receiver4])
+def test_receiver_server_back_to_back_transfers(tmp_path, module):
+    def make_session(sock, output_file):
+        if module is Receiver3:
+            return Receiver3.GoBackNReceiver(sock, output_file)
+        return Receiver4.SelectiveRepeatReceiver(sock, output_file, WINDOW_SIZE)
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(("127.0.0.1", 0))
+    # Far longer than the test, the second transfer starts while the first one lingers
+    server = ReceiverServer(sock, str(tmp_path), make_session, linger_s=60)
+    thread = threading.Thread(target=server.serve, args=(2,), daemon=True)
+    thread.start()
+
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sender:
+        sender.settimeout(5)
+        sender.connect(sock.getsockname())
+        first = struct.pack(HEADER_FORMAT, 0, EOF_FLAG) + b"first"
+        # The first transfer, then a retransmission of it as if its ACK was lost
+        for packet in [
+            first,
+            first,
+            struct.pack(HEADER_FORMAT, 0, EOF_FLAG) + b"second",
+        ]:
+            sender.send(packet)
+            sender.recv(1024)
+        thread.join(timeout=10)
+    sock.close()
+
+    assert [Path(path).read_bytes() for _, path in server.completed] == [
+        b"first",
+        b"second",
+    ]
@@ -0,0 +1,88 @@
+import pytest
+from utils import (
+    AckPolicy,
+    FixedTimeout,
+    RTTEstimator,
+    SEQ_MODULUS,
+    seq_diff,
+    unwrap_seq_num,
+)
+
+
+def test_fixed_timeout():
+    rto = FixedTimeout(0.05)
+    rto.sample(1.0)
+    rto.backoff()
+    assert rto.timeout() == 0.05
+    assert rto.timeout(3) == 0.05
+
+
+def test_rtt_estimator_first_sample():
+    rto = RTTEstimator(1.0)
+    assert rto.timeout() == 1.0
+    rto.sample(0.1)
+    # SRTT + 4 * RTTVAR with RTTVAR = SRTT / 2
+    assert rto.srtt == pytest.approx(0.1)
+    assert rto.timeout() == pytest.approx(0.3)
+
+
+def test_rtt_estimator_converges():
+    rto = RTTEstimator(1.0)
+    for _ in range(100):
+        rto.sample(0.05)
+    assert rto.srtt == pytest.approx(0.05)
+    # The variance decays, so the timeout approaches the clamped RTT
+    assert rto.timeout() == pytest.approx(0.05, abs=0.001)
+
+
+def test_rtt_estimator_backoff_and_clamps():
+    rto = RTTEstimator(0.1, min_timeout_s=0.02, max_timeout_s=0.5)
+    rto.backoff()
+    assert rto.timeout() == pytest.approx(0.2)
+    for _ in range(10):
+        rto.backoff()
+    assert rto.timeout() == 0.5
+    assert rto.timeout(3) == 0.5
+    # A new sample resets the backoff
+    rto.sample(0.001)
+    assert rto.timeout() == pytest.approx(0.02)
+    assert rto.timeout(2) == pytest.approx(0.08)
+
+
+def test_seq_diff_wraps():
+    assert seq_diff(5, 3) == 2
+    assert seq_diff(3, 5) == -2
+    assert seq_diff(1, SEQ_MODULUS - 1) == 2
+    assert seq_diff(SEQ_MODULUS - 1, 1) == -2
+
+
+def test_unwrap_seq_num():
+    assert unwrap_seq_num(3, 0) == 3
+    assert unwrap_seq_num(SEQ_MODULUS - 1, 0) == -1
+    reference = 5 * SEQ_MODULUS + 10
+    assert unwrap_seq_num(12, reference) == reference + 2
+    assert unwrap_seq_num(8, reference) == reference - 2
+    reference = 7 * SEQ_MODULUS - 1
+    assert unwrap_seq_num(1, reference) == reference + 2
+
+
+def test_ack_policy_every_n():
+    policy = AckPolicy(ack_every=3, ack_delay_s=10.0)
+    assert policy.timeout() is None
+    assert not policy.received("a")
+    assert not policy.received("b")
+    assert 0 < policy.timeout() <= 10.0
+    assert policy.received("c")
+    assert policy.addr == "c"
+    policy.sent()
+    assert policy.timeout() is None
+    assert not policy.expired()
+
+
+def test_ack_policy_delay():
+    policy = AckPolicy(ack_every=100, ack_delay_s=0.0)
+    assert not policy.received("a")
+    assert policy.expired()
+    assert policy.timeout() == 0.0
+    # The default acknowledges every packet
+    assert AckPolicy().received("a")
@@ -0,0 +1,129 @@
+# Tracing of the per-packet events of the senders and receivers. Events are fixed size binary
+# records written into a preallocated ring buffer, so tracing a lossy run costs a struct
+# pack_into per event instead of formatting and printing a line, and does not change its
+# timing much. When tracing is off an event is a function call that returns right away.
+#
+# The buffer only keeps the latest events. It is written to a file at exit or on SIGUSR1 and
+# can be read with "python tracing.py FILE".
+import argparse
+import atexit
+import signal
+import struct
+from time import monotonic_ns
+
+# Event types
+SEND = 1
+RESEND = 2
+ACK = 3
+DUP_ACK = 4
+TIMEOUT = 5
+FAST_RETRANSMIT = 6
+GIVE_UP = 7
+RECEIVE = 8
+ACK_SENT = 9
+EOF = 10
+FEC_REBUILT = 11
+WINDOW_FULL = 12
+RELAY_FORWARD = 13
+RELAY_REVERSE = 14
+EVENT_NAMES = {
+    SEND: "send",
+    RESEND: "resend",
+    ACK: "ack",
+    DUP_ACK: "dup_ack",
+    TIMEOUT: "timeout",
+    FAST_RETRANSMIT: "fast_retransmit",
+    GIVE_UP: "give_up",
+    RECEIVE: "receive",
+    ACK_SENT: "ack_sent",
+    EOF: "eof",
+    FEC_REBUILT: "fec_rebuilt",
+    WINDOW_FULL: "window_full",
+    RELAY_FORWARD: "relay_forward",
+    RELAY_REVERSE: "relay_reverse",
+}
+# Monotonic nanoseconds, event type, logical packet index and the base of the window. For the
+# relay events the index is the size of the datagram
+RECORD = struct.Struct("<qBqq")
+TRACE_MAGIC = b"SWTR"
+# Magic, record size and number of records of a dump
+DUMP_HEADER = struct.Struct("<4sII")
+# Events kept by default, about 1.6 MB
+DEFAULT_CAPACITY = 65536
+
+
+class TraceBuffer:
+    """
+    Ring buffer of the latest events. Events of different threads are not synchronised, two
+    events recorded at the same time may end up in the same slot and one of them is lost.
+    """
+
+    def __init__(self, capacity: int = DEFAULT_CAPACITY):
+        self.capacity = capacity
+        self.buffer = bytearray(capacity * RECORD.size)
+        # Events recorded so far, the buffer holds the last capacity of them
+        self.count = 0
+
+    # pack_into is bound once as a default, which saves looking it up for every event
+    def record(self, event: int, seq: int, base: int, pack_into=RECORD.pack_into):
+        count = self.count
+        self.count = count + 1
+        offset = (count % self.capacity) * RECORD.size
+        pack_into(self.buffer, offset, monotonic_ns(), event, seq, base)
+
+    def records(self) -> bytes:
+        """Returns the records in the buffer, oldest first"""
+        if self.count <= self.capacity:
+            return bytes(self.buffer[: self.count * RECORD.size])
+        split = (self.count % self.capacity) * RECORD.size
+        return bytes(self.buffer[split:] + self.buffer[:split])
+
+    def dump(self, path: str):
+        records = self.records()
+        with open(path, "wb") as f:
+            f.write(
+                DUMP_HEADER.pack(TRACE_MAGIC, RECORD.size, len(records) // RECORD.size)
+            )
+            f.write(records)
+
+
+# The buffer events are recorded into, None while tracing is off
+buffer = None
+
+
+def trace(event: int, seq: int = 0, base: int = 0):
+    """Record an event if tracing is on"""
+    if buffer is not None:
+        buffer.record(event, seq, base)
+
+
+def start_tracing(path: str, capacity: int = DEFAULT_CAPACITY):
+    """Record events from now on and write them to path at exit and on SIGUSR1"""
+    global buffer
+    buffer = TraceBuffer(capacity)
+    atexit.register(buffer.dump, path)
+    signal.signal(signal.SIGUSR1, lambda signum, frame: buffer.dump(path))
+
+
+def load(path: str) -> list:
+    """Returns the events of a dump as (seconds, event name, index, base)"""
+    with open(path, "rb") as f:
+        data = f.read()
+    magic, record_size, count = DUMP_HEADER.unpack_from(data)
+    if magic != TRACE_MAGIC or record_size != RECORD.size:
+        raise ValueError(f"{path} is not a trace")
+    events = []
+    for ns, event, seq, base in RECORD.iter_unpack(data[DUMP_HEADER.size :]):
+        events.append((ns / 1e9, EVENT_NAMES.get(event, str(event)), seq, base))
+    return events[:count]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("filename", help="A trace written by --trace")
+    args = parser.parse_args()
+
+    events = load(args.filename)
+    start = events[0][0] if events else 0
+    for seconds, name, seq, base in events:
+        print(f"{(seconds - start) * 1000:12.3f} {name:16} {seq:8} {base:8}")
@@ -1,12 +1,50 @@
 # Utils file to be used by all senders and receivers
 import os
 import math
+import mmap
+import struct
+import sys
+import threading
+import time
 
 # Common variables
+# Default payload size of a packet, senders can choose any size up to MAX_PACKET_SIZE
 PACKET_SIZE = 1024
 HEADER_SIZE = 3
+# The largest UDP payload over IPv4 (65535 - 20 byte IP header - 8 byte UDP header) minus our header
+MAX_PACKET_SIZE = 65507 - HEADER_SIZE
+# total_packets of a sender whose source has no known length, see send_payloads()
+UNKNOWN_PACKET_COUNT = sys.maxsize
 LOGGING = False
-HEADER_FORMAT = "!H?"
+# Sequence number and flags
+HEADER_FORMAT = "!HB"
+EOF_FLAG = 0x01
+# Set by senders that understand SACK acknowledgments
+SACK_FLAG = 0x02
+# Path MTU probes carry padding instead of file data, see pmtu.py
+PROBE_FLAG = 0x04
+# Parity packets of the forward error correction, see fec.py
+FEC_FLAG = 0x08
+# Asks the receiver where to resume an interrupted transfer, see resume.py
+RESUME_FLAG = 0x10
+# Set on every packet of a transfer whose payload is a compressed stream, see compression.py
+COMPRESSED_FLAG = 0x20
+# Set on the data packets of a transfer that also sends parity packets, see fec.py
+FEC_DATA_FLAG = 0x40
+# A plain acknowledgment is just a sequence number
+ACK_FORMAT = "!H"
+ACK_SIZE = 2
+# A SACK acknowledgment is the cumulative acknowledgment and the length of the bitmap that follows.
+# Bit i of the little endian bitmap acknowledges the packet cumulative + 2 + i
+SACK_FORMAT = "!HB"
+SACK_SIZE = 3
+MAX_ACK_SIZE = SACK_SIZE + 255
+# Sequence numbers are 2 bytes on the wire and wrap around after this
+SEQ_MODULUS = 2**16
+# Clamps for the adaptive retransmission timeout
+MIN_TIMEOUT_S = 0.01
+MAX_TIMEOUT_S = 10.0
+
 
 # Log function to easily turn on and off all logging for debugging
 def log(msg: str):
@@ -19,47 +57,382 @@ class SequenceNumber:
     def __init__(self, max_seq_num: int | None = None):
         """
         Params:
-        max_seq_num: The maximum sequence number to use. If None, we use 2^16 because we use a 2 byte sequence number
+        max_seq_num: The maximum sequence number to use. If None, we use SEQ_MODULUS because we use a 2 byte sequence number
         """
         self.seq_num = 0
-        self.max_seq_num = int(math.pow(2, 16)) if max_seq_num is None else max_seq_num
+        # Logical index of the packet, this does not wrap around
+        self.index = 0
+        self.max_seq_num = SEQ_MODULUS if max_seq_num is None else max_seq_num
 
     def next(self) -> None:
-        self.seq_num = (self.seq_num + 1) % self.max_seq_num
+        self.index += 1
+        self.seq_num = self.index % self.max_seq_num
 
     def __call__(self) -> int:
         return self.seq_num
 
 
-def send_file(filename: str, sender):
+def wire_seq_num(index: int) -> int:
+    """
+    Returns the sequence number that is sent on the wire for a logical packet index
     """
+    return index % SEQ_MODULUS
+
+
+def seq_diff(a: int, b: int) -> int:
+    """
+    Signed distance a - b of two wire sequence numbers in serial number arithmetic (RFC 1982).
+    Only meaningful if the numbers are less than SEQ_MODULUS / 2 apart
+    """
+    diff = (a - b) % SEQ_MODULUS
+    if diff >= SEQ_MODULUS // 2:
+        diff -= SEQ_MODULUS
+    return diff
+
+
+def unwrap_seq_num(seq_num: int, reference_index: int) -> int:
+    """
+    Returns the logical packet index of a wire sequence number, which is the one closest to reference_index.
     Params:
-        filename: The name of the file to send
-        sender: The sender object to use to send the file
+        seq_num: The sequence number received on the wire
+        reference_index: A nearby logical index, e.g. the base of the window
+    """
+    return reference_index + seq_diff(seq_num, wire_seq_num(reference_index))
+
+
+def acked_indices(ack_data: bytes, base: int, in_transit) -> list:
+    """
+    Returns the logical indices acknowledged by a plain or a SACK acknowledgment.
+    Params:
+        base: The logical index of the oldest unacknowledged packet
+        in_transit: The logical indices of the packets in flight, in increasing order
+    """
+    if len(ack_data) == ACK_SIZE:
+        (ack_seq_num,) = struct.unpack(ACK_FORMAT, ack_data)
+        return [unwrap_seq_num(ack_seq_num, base)]
+
+    if len(ack_data) < SACK_SIZE:
+        return []
+    cumulative_seq_num, size = struct.unpack_from(SACK_FORMAT, ack_data)
+    if len(ack_data) != SACK_SIZE + size:
+        log(f"Malformed ack of length {len(ack_data)}")
+        return []
+    cumulative_index = unwrap_seq_num(cumulative_seq_num, base)
+    indices = []
+    for index in in_transit:
+        if index > cumulative_index:
+            break
+        indices.append(index)
+    bits = int.from_bytes(ack_data[SACK_SIZE:], "little")
+    while bits:
+        lowest_bit = bits & -bits
+        # Bit i acknowledges cumulative_index + 2 + i
+        indices.append(cumulative_index + 1 + lowest_bit.bit_length())
+        bits ^= lowest_bit
+    return indices
+
+
+class FixedTimeout:
+    """
+    A retransmission timeout that never changes. Has the same interface as RTTEstimator.
+    """
+
+    def __init__(self, timeout_s: float):
+        self.timeout_s = timeout_s
+
+    def sample(self, rtt_s: float):
+        pass
+
+    def backoff(self):
+        pass
+
+    def timeout(self, backoffs: int = 0) -> float:
+        return self.timeout_s
+
+
+class RTTEstimator:
+    """
+    Estimates the retransmission timeout from RTT samples (Jacobson/Karels, RFC 6298).
+    Following Karn's rule callers must only sample packets that were never retransmitted.
+    """
+
+    ALPHA = 1 / 8
+    BETA = 1 / 4
+    K = 4
+
+    def __init__(
+        self,
+        initial_timeout_s: float,
+        min_timeout_s: float = MIN_TIMEOUT_S,
+        max_timeout_s: float = MAX_TIMEOUT_S,
+    ):
+        """
+        Params:
+            initial_timeout_s: The timeout to use until the first RTT sample arrives
+            min_timeout_s: Lower bound of the timeout
+            max_timeout_s: Upper bound of the timeout, also for the exponential backoff
+        """
+        self.min_timeout_s = min_timeout_s
+        self.max_timeout_s = max_timeout_s
+        self.srtt = None
+        self.rttvar = None
+        self.rto = self.clamp(initial_timeout_s)
+
+    def clamp(self, timeout_s: float) -> float:
+        return min(self.max_timeout_s, max(self.min_timeout_s, timeout_s))
+
+    def sample(self, rtt_s: float):
+        """
+        Update the estimate with a new RTT measurement. This also resets any backoff
+        """
+        if self.srtt is None:
+            self.srtt = rtt_s
+            self.rttvar = rtt_s / 2
+        else:
+            self.rttvar = (1 - self.BETA) * self.rttvar + self.BETA * abs(
+                self.srtt - rtt_s
+            )
+            self.srtt = (1 - self.ALPHA) * self.srtt + self.ALPHA * rtt_s
+        self.rto = self.clamp(self.srtt + self.K * self.rttvar)
+
+    def backoff(self):
+        """
+        Double the timeout after a timeout event
+        """
+        self.rto = self.clamp(self.rto * 2)
+
+    def timeout(self, backoffs: int = 0) -> float:
+        """
+        Params:
+            backoffs: How often to double the timeout, used for per packet backoff
+        """
+        return self.clamp(self.rto * 2**backoffs)
+
+
+def timeout_estimator(retry_timeout_s: float, adaptive: bool):
+    """
+    Returns the retransmission timeout to use for a sender
+    Params:
+        retry_timeout_s: The fixed timeout, or the initial one if adaptive
+        adaptive: Whether to estimate the timeout from RTT samples
     """
-    file_size = os.path.getsize(filename)
-    total_packets = math.ceil(file_size / PACKET_SIZE)
+    if adaptive:
+        return RTTEstimator(retry_timeout_s)
+    return FixedTimeout(retry_timeout_s)
 
+
+class RetransmissionTimer:
+    """
+    A single long lived timer thread that calls `callback` once its deadline has passed.
+    Re-arming the timer only moves the deadline, so no new thread is created per ACK.
+    """
+
+    def __init__(self, callback):
+        """
+        Params:
+            callback: Called from the timer thread when the deadline expires
+        """
+        self.callback = callback
+        self.deadline = None
+        self.running = True
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def start(self, timeout_s: float):
+        """
+        (Re-)arm the timer to expire timeout_s seconds from now
+        """
+        with self.condition:
+            deadline = time.monotonic() + timeout_s
+            # Only wake the thread if it would otherwise sleep past the new deadline.
+            # A deadline that moved back is picked up when the thread wakes up anyway.
+            if self.deadline is None or deadline < self.deadline:
+                self.condition.notify()
+            self.deadline = deadline
+
+    def stop(self):
+        with self.condition:
+            self.deadline = None
+
+    def shutdown(self):
+        with self.condition:
+            self.running = False
+            self.deadline = None
+            self.condition.notify()
+
+    def run(self):
+        with self.condition:
+            while self.running:
+                if self.deadline is None:
+                    self.condition.wait()
+                    continue
+                remaining = self.deadline - time.monotonic()
+                if remaining > 0:
+                    self.condition.wait(remaining)
+                    continue
+                self.deadline = None
+                # Release the condition so the callback can re-arm the timer
+                self.condition.release()
+                try:
+                    self.callback()
+                finally:
+                    self.condition.acquire()
+
+
+class AckPolicy:
+    """
+    Decides when a receiver sends a cumulative acknowledgment: once ack_every packets are
+    unacknowledged, or once the oldest of them waited ack_delay_s, whichever comes first.
+    Receivers still acknowledge gaps, duplicates and the end of the file immediately.
+    """
+
+    def __init__(self, ack_every: int = 1, ack_delay_s: float = 0.0):
+        """
+        Params:
+            ack_every: The number of packets covered by one acknowledgment
+            ack_delay_s: How long an acknowledgment may be held back
+        """
+        self.ack_every = max(1, ack_every)
+        self.ack_delay_s = ack_delay_s
+        self.pending = 0
+        self.deadline = None
+        # Where to send the pending acknowledgment to
+        self.addr = None
+
+    def received(self, addr) -> bool:
+        """
+        Records a packet that needs acknowledging. Returns True if it should be acknowledged now
+        """
+        self.pending += 1
+        self.addr = addr
+        if self.pending >= self.ack_every:
+            return True
+        if self.deadline is None:
+            self.deadline = time.monotonic() + self.ack_delay_s
+        return False
+
+    def sent(self):
+        """Called whenever an acknowledgment was sent, it covers everything pending"""
+        self.pending = 0
+        self.deadline = None
+
+    def timeout(self):
+        """Returns the seconds until a pending acknowledgment is due, None if nothing is pending"""
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.monotonic())
+
+    def expired(self) -> bool:
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+
+def packet_count(
+    file_size: int, stripe: int = 0, stripes: int = 1, packet_size: int = PACKET_SIZE
+) -> int:
+    """
+    Returns the number of packets needed to send a file of file_size bytes.
+    An empty file is still sent as a single empty packet carrying the EOF flag
+    Params:
+        stripe, stripes: Only count every stripes-th packet, starting with packet stripe
+        packet_size: The payload size of every packet but the last
+    """
+    return max(1, len(range(stripe, math.ceil(file_size / packet_size), stripes)))
+
+
+def map_file(filename: str) -> memoryview:
+    """
+    Returns a read only view of the whole file without copying it into memory
+    """
     with open(filename, "rb") as f:
-        sent_packets = 0
-        while True:
-            # Get the data
-            data = f.read(PACKET_SIZE)
-            eof_flag = sent_packets + 1 == total_packets
-
-            if eof_flag:
-                log("Sending last packet")
-                # If sending the last packet fails we don't want to retry
-                sender.send(data, eof_flag)
-            else:
-                retry_count = 0
-                max_retries = 100
-                while not sender.send(data, eof_flag):
-                    retry_count += 1
-                    if retry_count >= max_retries:
-                        log(f"Failed to send packet after {max_retries} retries")
-                        return
-            sent_packets += 1
-
-            if eof_flag:
-                break
+        # Empty files cannot be mapped
+        if os.fstat(f.fileno()).st_size == 0:
+            return memoryview(b"")
+        # The mapping stays valid after the file is closed and is unmapped once
+        # the last view into it is garbage collected. A private copy-on-write mapping
+        # only costs memory when written to, which we never do, but unlike a read only
+        # one its buffer can be handed to ctypes for batched sends
+        return memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY))
+
+
+def send_packet(sender, data: memoryview, eof_flag: bool) -> bool:
+    """
+    Send the next packet of a file, retrying while the sender refuses it.
+    Returns False if we gave up on the transfer
+    """
+    if eof_flag:
+        log("Sending last packet")
+        # If sending the last packet fails we don't want to retry
+        sender.send(data, eof_flag)
+        return True
+    retry_count = 0
+    max_retries = 100
+    while not sender.send(data, eof_flag):
+        retry_count += 1
+        if retry_count >= max_retries:
+            log(f"Failed to send packet after {max_retries} retries")
+            return False
+    return True
+
+
+def send_file(
+    filename: str,
+    sender,
+    stripe: int = 0,
+    stripes: int = 1,
+    packet_size: int = PACKET_SIZE,
+    offset: int = 0,
+):
+    """
+    Params:
+        filename: The name of the file to send
+        sender: The sender object to use to send the file. Its send() is called with
+            memoryview slices of the mapped file, so it must not expect bytes
+        stripe, stripes: Only send every stripes-th packet of the file, starting with packet
+            stripe. The sender numbers them 0, 1, 2, ... and the receiver puts packet i
+            back at the offset of packet i * stripes + stripe
+        packet_size: The payload size of every packet but the last
+        offset: Only send the file from this byte on, the receiver already has the rest.
+            Packet 0 starts there
+    """
+    file_view = map_file(filename)[offset:]
+    total_packets = packet_count(len(file_view), stripe, stripes, packet_size)
+
+    sent_packets = 0
+    while True:
+        # Get the data
+        start = (sent_packets * stripes + stripe) * packet_size
+        data = file_view[start : start + packet_size]
+        eof_flag = sent_packets + 1 == total_packets
+
+        if not send_packet(sender, data, eof_flag):
+            return
+        sent_packets += 1
+
+        if eof_flag:
+            break
+
+
+def send_payloads(payloads, sender) -> int:
+    """
+    Send one packet per payload when their number is not known up front. The sender starts
+    with UNKNOWN_PACKET_COUNT and is told its total_packets once the last payload is known,
+    which is the one sent with the EOF flag. No payloads send a single empty packet.
+    Returns the number of payload bytes sent
+    Params:
+        payloads: Iterable of writable buffers, send_batch() needs that for resends
+    """
+    payloads = iter(payloads)
+    sent_packets = 0
+    sent_bytes = 0
+    data = next(payloads, bytearray())
+    for next_data in payloads:
+        if not send_packet(sender, memoryview(data), False):
+            return sent_bytes
+        sent_packets += 1
+        sent_bytes += len(data)
+        data = next_data
+    # Only now do we know where the transfer ends
+    sender.total_packets = sent_packets + 1
+    send_packet(sender, memoryview(data), True)
+    return sent_bytes + len(data)